@@ -1,17 +1,21 @@
-from pymongo import MongoClient, GEO2D, GEOSPHERE
-from geopy.distance import geodesic
-from shapely.geometry import Point, Polygon
+from pymongo import MongoClient
+from geo_distance import within_distance
+from agency_index import AgencyIndex
 import json
 import logging
 import config
+import metrics
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class MongoDBClient:
     """Handles MongoDB connections and data retrieval."""
-    def __init__(self, uri=config.MONGO_URI, db_name=config.MONGO_DB):
-        self.client = MongoClient(uri)
+    def __init__(self, uri=config.MONGO_URI, db_name=config.MONGO_DB, client=None):
+        """
+        :param client: Existing MongoClient to share (e.g. the application's); a new one is created otherwise.
+        """
+        self.client = client if client is not None else MongoClient(uri)
         self.db = self.client[db_name]
         logging.info("Connected to MongoDB.")
     
@@ -20,8 +24,11 @@ class MongoDBClient:
 
 class ConfigLoader:
     """Handles loading and providing configuration data."""
-    def __init__(self, config_path="critical.json"):
-        self.config = self._load_config(config_path)
+    def __init__(self, config_path="critical.json", data=None):
+        """
+        :param data: Already parsed {detected object: critical} map; skips reading config_path.
+        """
+        self.config = data if data is not None else self._load_config(config_path)
     
     def _load_config(self, config_path):
         try:
@@ -37,47 +44,54 @@ class ConfigLoader:
 
 class AgencyFinder:
     """Handles finding the nearest agencies for an event."""
-    def __init__(self, db_client):
+    def __init__(self, db_client, index=None):
         self.db_client = db_client
+        self.index = index or AgencyIndex(db_client, ttl_seconds=config.AGENCY_INDEX_TTL)
     
     def find_nearest_agencies(self, event, top_n=3):
         """Finds the nearest agencies for critical events, checking if they handle the detected object."""
-        agencies_collection = self.db_client.get_collection("agencies")
-        event_location = (event['latitude'], event['longitude'])
-        print(f"[DEBUG] Types -> latitude: {type(event.get('latitude'))}, longitude: {type(event.get('longitude'))}")
-        event_type = event["detected_object"].lower()
-        
-        agencies = agencies_collection.find({
-            "eventResponsibleFor": {
-                "$regex": f"^{event_type}$",
-                "$options": "i"
-            }
-        })
+        return self.find_nearest_agencies_many([event], top_n)[0]
 
-        agencies_list = list(agencies)
-        if not agencies_list:
-            logging.warning(f"No agencies found for event type: {event['detected_object']}")
-            return []
+    @metrics.timed("agency_nearest")
+    def find_nearest_agencies_many(self, events, top_n=3):
+        """
+        Batch version of find_nearest_agencies: one KD-tree query per event type for all events.
+        :return: List of agency ID lists, in the order of events.
+        """
+        results = [None] * len(events)
+        positions_by_type = {}
+        for position, event in enumerate(events):
+            positions_by_type.setdefault(event["detected_object"].lower(), []).append(position)
 
-        sorted_agencies = sorted(
-            [
-                (agency["AgencyId"], geodesic(event_location, (agency["location"].get("latitude"), agency["location"].get("longitude"))).kilometers) 
-                for agency in agencies_list if "location" in agency and "latitude" in agency["location"] and "longitude" in agency["location"]
-            ],
-            key=lambda x: x[1]
-        )
+        for event_type, positions in positions_by_type.items():
+            nearest_agencies = self.index.nearest_many(
+                event_type,
+                [events[p]["latitude"] for p in positions],
+                [events[p]["longitude"] for p in positions],
+                top_n
+            )
+            for position, agencies in zip(positions, nearest_agencies):
+                if not agencies:
+                    logging.warning(f"No agencies found for event type: {events[position]['detected_object']}")
+                for agency_id, meters in agencies:
+                    logging.info(f"Agency: {agency_id}, Distance: {meters / 1000} km")
+                results[position] = [agency_id for agency_id, _ in agencies]
+        return results
 
-        for agency_id, distance in sorted_agencies:
-            logging.info(f"Agency: {agency_id}, Distance: {distance} km")
-
-        return [agency[0] for agency in sorted_agencies[:top_n]]
+    def refresh(self):
+        """Reloads agency locations from the database."""
+        self.index.load()
 
 
 class JurisdictionFinder:
     """Handles finding the jurisdiction for non-critical events."""
     
-    def __init__(self, db_client):
+    def __init__(self, db_client, registry=None):
         self.db_client = db_client
+        if registry is None:
+            from jurisdiction_registry import JurisdictionRegistry  # shapely is only imported when needed
+            registry = JurisdictionRegistry(db_client, ttl_seconds=config.AGENCY_INDEX_TTL)
+        self.registry = registry
     
     def get_agencies_with_jurisdictions(self):
         """Fetches agencies with defined jurisdictions from the database."""
@@ -94,6 +108,7 @@ class JurisdictionFinder:
     
     def create_polygon(self, coordinates):
         """Creates a Shapely Polygon from the list of coordinates."""
+        from shapely.geometry import Polygon
         return Polygon(coordinates)
     
     def is_point_inside_polygon(self, point, polygon):
@@ -101,15 +116,14 @@ class JurisdictionFinder:
         return polygon.contains(point)
     
     def is_nearby(self, event_location, coordinates, threshold=0.05):
-        """Checks if event location is within a threshold distance from any jurisdiction point."""
-        for coord in coordinates:
-            distance = geodesic(event_location, coord).km
-            if distance < threshold:
-                return True
-        return False
+        """Checks if event location is within a threshold distance (km) from any jurisdiction point."""
+        if not len(coordinates):
+            return False
+        return bool(within_distance(event_location, coordinates, threshold * 1000).any())
     
     def is_event_in_jurisdiction(self, event_location, coordinates):
         """Checks if the event is inside the jurisdiction or nearby its boundary."""
+        from shapely.geometry import Point
         polygon = self.create_polygon(coordinates)
         point = Point(event_location)
         
@@ -124,40 +138,89 @@ class JurisdictionFinder:
         """Checks if the agency is responsible for the event type."""
         return event_type in responsibilities
     
+    @metrics.timed("jurisdiction_lookup")
     def find_jurisdiction(self, event):
-        """Finds the jurisdiction for non-critical events using point matching and event responsibility."""
+        """
+        Finds the jurisdiction for non-critical events using point matching and event responsibility.
+        Polygons are loaded once into the registry; call refresh() after agencies change.
+        """
         event_location = self.get_event_location(event)
         event_type = self.get_event_type(event)
-        
-        agencies = self.get_agencies_with_jurisdictions()
-        
-        for agency in agencies:
-            jurisdiction = agency.get("jurisdiction", {})
-            coordinates = jurisdiction.get("coordinates", [])
-            responsibilities = agency.get("eventResponsibleFor", [])
-            
-            # Check if the event is within jurisdiction and the agency is responsible for it
-            if self.is_event_in_jurisdiction(event_location, coordinates) and self.is_responsible_for_event(event_type, responsibilities):
-                logging.info(f"Event is within jurisdiction of agency: {agency['AgencyId']} and they are responsible for it.")
-                return agency["AgencyId"]
-            else:
-                logging.info(f"Agency: {agency['AgencyId']} does not match jurisdiction or responsibility.")
-        
+
+        agency_id = self.registry.find(event_type, event_location)
+        if agency_id is not None:
+            logging.info(f"Event is within jurisdiction of agency: {agency_id} and they are responsible for it.")
+            return agency_id
+
         logging.warning("No matching jurisdiction found for this event.")
         return None
 
+    def refresh(self):
+        """Reloads agency jurisdictions from the database."""
+        self.registry.load()
+
 
 
 class EventProcessor:
     """Handles event classification and agency allocation."""
-    def __init__(self, config_loader, agency_finder, jurisdiction_finder):
+    def __init__(self, config_loader, agency_finder, jurisdiction_finder, cache=None):
+        """
+        :param cache: Optional AllocationCache; hits skip the agency and jurisdiction lookups.
+                      Results are stored under the cache generation current when the processor is
+                      built, so once the cache is invalidated for newer agencies, this processor's
+                      results are no longer stored.
+        """
         self.config_loader = config_loader
         self.agency_finder = agency_finder
         self.jurisdiction_finder = jurisdiction_finder
+        self.cache = cache
+        self.cache_generation = cache.generation if cache is not None else None
     
+    @metrics.timed("agency_allocation_batch")
+    def process_events(self, events):
+        """
+        Allocates many events in one call: critical events share one nearest-agency batch query,
+        non-critical events go through the jurisdiction registry.
+        :return: List of allocations, in the order of events.
+        """
+        results = [None] * len(events)
+        keys = [None] * len(events)
+        critical_positions = []
+        for position, event in enumerate(events):
+            if self.cache is not None:
+                keys[position] = self.cache.key(event)
+                results[position] = self.cache.get(keys[position])
+                if results[position] is not None:
+                    continue
+            if self.config_loader.is_critical(event.get("detected_object", "Unknown")):
+                critical_positions.append(position)
+            else:
+                results[position] = self._allocate(event)
+                if self.cache is not None:
+                    self.cache.put(keys[position], results[position], self.cache_generation)
+
+        nearest_agencies = self.agency_finder.find_nearest_agencies_many([events[p] for p in critical_positions])
+        for position, agencies in zip(critical_positions, nearest_agencies):
+            results[position] = {"type": "critical", "agencies": agencies}
+            if self.cache is not None:
+                self.cache.put(keys[position], results[position], self.cache_generation)
+        return results
+
+    @metrics.timed("agency_allocation")
     def process_event(self, event):
+        """Allocates one event, from the cache when an event of the same type in the same cell was allocated before."""
+        if self.cache is None:
+            return self._allocate(event)
+        key = self.cache.key(event)
+        allocation = self.cache.get(key)
+        if allocation is None:
+            allocation = self._allocate(event)
+            self.cache.put(key, allocation, self.cache_generation)
+        return allocation
+
+    def _allocate(self, event):
         detected_object = event.get("detected_object", "Unknown")
-        print( detected_object)
+        logging.debug(f"Allocating agencies for {detected_object}.")
         if self.config_loader.is_critical(detected_object):
         # Handle critical events
             nearest_agencies = self.agency_finder.find_nearest_agencies(event)
@@ -1,8 +1,11 @@
 import logging
-from pymongo import MongoClient
-from datetime import datetime, timedelta
-from geopy.distance import geodesic
+from pymongo import MongoClient, ASCENDING, GEOSPHERE
+from pymongo.errors import PyMongoError
+from datetime import datetime, timedelta, timezone
+from geo_distance import EARTH_RADIUS_METERS, HAVERSINE_MAX_RELATIVE_ERROR, point_distance_meters, is_within
 from typing import Optional, Dict
+import config
+import metrics
 import traceback
 
 # Configure logging
@@ -18,21 +21,73 @@ class EventSearcher:
     based on timestamp, status, incident type, and geolocation.
     """
 
-    def __init__(self, db):
+    # Dedup thresholds: an incident joins an event if its most recent incident is this close
+    TIME_WINDOW = timedelta(minutes=config.DEDUP_WINDOW_MINUTES)
+    MAX_DISTANCE_METERS = config.DEDUP_MAX_DISTANCE_METERS
+
+    # Denormalized fields kept on every event by EventHandler
+    SUMMARY_PROJECTION = {"incident_type": 1, "last_incident_time": 1, "last_location": 1, "incident_count": 1}
+
+    # Index of get_candidate_events on the event summary fields:
+    # last incident location (2dsphere), incident type and last incident time
+    SUMMARY_INDEX_KEYS = [("last_location", GEOSPHERE), ("incident_type", ASCENDING), ("last_incident_time", ASCENDING)]
+    SUMMARY_INDEX_NAME = "summary_geo_type_time"
+
+    def __init__(self, db, index=None, index_authoritative=False):
         """
         Initialize the EventSearcher with a database connection.
         :param db: MongoDB database instance
+        :param index: Optional SpatioTemporalIndex of recently active events.
+        :param index_authoritative: Trust index misses without asking Mongo. Only safe when this
+                                    process sees every incident of the types/areas it handles.
         """
         self.events_collection = db["events"]
+        self.index = index
+        self.index_authoritative = index_authoritative
+        self.ensure_indexes()
         logging.info("EventSearcher initialized with database connection.")
-        from datetime import datetime
-
-        ts1 = datetime.strptime("2025-03-05T17:07:40.246", "%Y-%m-%dT%H:%M:%S.%f")
-        ts2 = datetime.strptime("2025-03-05T08:59:09.906", "%Y-%m-%dT%H:%M:%S.%f")
-
-        time_diff = abs(ts1 - ts2)
-        print(time_diff)  # Expected output: ?
 
+    def ensure_indexes(self):
+        """Creates the index used by get_candidate_events (SUMMARY_INDEX_KEYS)."""
+        try:
+            self.events_collection.create_index(self.SUMMARY_INDEX_KEYS, name=self.SUMMARY_INDEX_NAME)
+        except PyMongoError as e:
+            logging.error(f"Could not create candidate event index: {e}")
+
+    def warm_index(self):
+        """Rebuilds the in-memory index from the open events in Mongo."""
+        if self.index is not None:
+            self.index.rebuild(self.events_collection, self.extract_coordinates)
+
+    def record_incident(self, event_id, incident_type: str, incident: Dict):
+        """Updates the in-memory index after an incident was added to (or created) an event."""
+        if self.index is None:
+            return
+        latitude, longitude = self.extract_coordinates(incident["location"])
+        self.index.add(event_id, incident_type, self.get_incident_time(incident), latitude, longitude)
+
+    def refresh_index(self):
+        """Drops indexed events that were closed elsewhere (e.g. from the dashboard), at a bounded rate."""
+        if self.index is None or not self.index.closed_check_due():
+            return
+        event_ids = self.index.event_ids()
+        if event_ids:
+            for event in self.events_collection.find({"_id": {"$in": event_ids}, "status": "closed"}, {"_id": 1}):
+                self.index.discard(event["_id"])
+
+    def find_in_index(self, incident_type: str, new_incident: Dict):
+        """
+        Looks the incident up in the in-memory index.
+        :return: Tuple (event_id, conclusive). A miss is conclusive only for an authoritative, warm index.
+        """
+        if self.index is None:
+            return None, False
+        incident_time = self.get_incident_time(new_incident)
+        latitude, longitude = self.extract_coordinates(new_incident["location"])
+        event_id = self.index.find(incident_type, incident_time, latitude, longitude)
+        if event_id is not None:
+            return event_id, True
+        return None, self.index_authoritative and self.index.is_conclusive(incident_time)
 
     @staticmethod
     def parse_timestamp(ts: str) -> datetime:
@@ -47,7 +102,13 @@ class EventSearcher:
                 ts = ts["$date"]
 
             if isinstance(ts, str):
-                parsed_time = datetime.strptime(ts.replace("Z", ""), "%Y-%m-%dT%H:%M:%S.%f")
+                try:
+                    parsed_time = datetime.strptime(ts.replace("Z", ""), "%Y-%m-%dT%H:%M:%S.%f")
+                except ValueError:
+                    # ISO timestamps without milliseconds or with an explicit offset
+                    parsed_time = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+                    if parsed_time.tzinfo is not None:
+                        parsed_time = parsed_time.astimezone(timezone.utc).replace(tzinfo=None)
                 logging.debug(f"Parsed timestamp: {parsed_time}")
                 return parsed_time
         
@@ -58,17 +119,24 @@ class EventSearcher:
             traceback.print_exc()
             return None  # Or handle accordingly
 
+    @classmethod
+    def get_incident_time(cls, incident: Dict) -> datetime:
+        """Returns the stored incident_time, parsing the raw timestamp only when it is missing."""
+        return incident.get("incident_time") or cls.parse_timestamp(incident.get("timestamp"))
+
     @staticmethod
-    def calculate_distance(coords1: list, coords2: list) -> float:
+    def event_summary(event: Dict) -> Dict:
+        """Returns the denormalized most recent incident of an event as an incident-like dict."""
+        return {"incident_time": event.get("last_incident_time"), "location": event.get("last_location")}
+
+    @staticmethod
+    def calculate_distance(coords1: tuple, coords2: tuple) -> float:
         """
-        Calculate the geospatial distance in meters between two locations. 
+        Calculate the approximate (haversine) distance in meters between two (latitude, longitude)
+        points, as returned by extract_coordinates.
         """
-
-        latlon1 = (coords1[1], coords1[0])
-        latlon2 = (coords2[1], coords2[0])
-
-        distance = geodesic(latlon1, latlon2).meters
-        logging.debug(f"Calculated distance: {distance} meters between {latlon1} and {latlon2}")
+        distance = point_distance_meters(coords1, coords2)
+        logging.debug(f"Calculated distance: {distance} meters between {coords1} and {coords2}")
         return distance
 
     @staticmethod
@@ -86,15 +154,43 @@ class EventSearcher:
             logging.error("Invalid location format: %s", location)
             raise ValueError("Invalid location format")
 
-    def get_candidate_events(self, incident_type: str) -> list:
+    def build_candidate_query(self, incident_type: str, new_incident: Optional[Dict] = None) -> Dict:
+        """
+        Builds the candidate event filter on the event summary fields. With a new incident,
+        only events whose most recent incident is within MAX_DISTANCE_METERS and TIME_WINDOW
+        of it are matched.
+        """
+        query = {
+            "status": { "$ne": "closed" },
+            "incident_type": incident_type
+        }
+        if new_incident is not None:
+            new_time = self.get_incident_time(new_incident)
+            latitude, longitude = self.extract_coordinates(new_incident["location"])
+            # $centerSphere is spherical; padded so no event within MAX_DISTANCE_METERS on the
+            # ellipsoid falls outside it (the exact distance check runs on the candidates)
+            radius_meters = self.MAX_DISTANCE_METERS * (1 + HAVERSINE_MAX_RELATIVE_ERROR)
+            query["last_location"] = {
+                "$geoWithin": {
+                    "$centerSphere": [[longitude, latitude], radius_meters / EARTH_RADIUS_METERS]
+                }
+            }
+            query["last_incident_time"] = {
+                "$gte": new_time - self.TIME_WINDOW,
+                "$lte": new_time + self.TIME_WINDOW
+            }
+        return query
+
+    def get_candidate_events(self, incident_type: str, new_incident: Optional[Dict] = None) -> list:
         """
         Retrieve candidate events that match the incident type and are not closed.
+        Only the summary fields are read, so the cost does not depend on how many incidents an event holds.
         """
         logging.info(f"Fetching candidate events for incident type: {incident_type}")
-        candidate_events = list(self.events_collection.find({
-            "status": { "$ne": "closed" },
-            "incidents": { "$elemMatch": { "incident_type": incident_type } }
-            }))
+        candidate_events = list(self.events_collection.find(
+            self.build_candidate_query(incident_type, new_incident),
+            self.SUMMARY_PROJECTION
+        ))
         logging.info(f"Found {len(candidate_events)} candidate events.")
         return candidate_events
 
@@ -105,52 +201,34 @@ class EventSearcher:
         if not incidents:
             logging.warning("No incidents found in event.")
             return None
-        recent_incident = max(incidents, key=lambda inc: self.parse_timestamp(inc["timestamp"]))
+        recent_incident = max(incidents, key=self.get_incident_time)
         logging.debug(f"Most recent incident: {recent_incident}")
         return recent_incident
 
-    def extract_coordinates(self,location):
-        """
-        Extracts coordinates from location data regardless of format.
-        """
-        if "coordinates" in location:  # GeoJSON format
-            return location["coordinates"][1], location["coordinates"][0]
-        elif "latitude" in location and "longitude" in location:  # Direct lat/lon format
-            return location["latitude"], location["longitude"]
-        else:
-            raise ValueError("Invalid location format")
-
-
     def is_event_similar(self, new_incident: Dict, recent_incident: Dict) -> bool:
         """
         Check if the new incident is similar to the most recent incident under an event.
         """
-        new_time = self.parse_timestamp(new_incident["timestamp"])
-        recent_time = self.parse_timestamp(recent_incident["timestamp"])
+        new_time = self.get_incident_time(new_incident)
+        recent_time = self.get_incident_time(recent_incident)
         time_diff = abs(new_time - recent_time)
-        
-        print(f"🔍 Comparing timestamps: {new_time} vs {recent_time}")
-        print(f"⏳ Time difference: {time_diff} (Max allowed: 2 hours)")
-
-        if time_diff > timedelta(hours=2):
-            print("❌ Time condition failed")
+        if time_diff > self.TIME_WINDOW:
+            logging.debug(f"Time condition failed: {time_diff} (max {self.TIME_WINDOW})")
             return False
+
         new_coords = self.extract_coordinates(new_incident["location"])
         recent_coords = self.extract_coordinates(recent_incident["location"])
-        print(f"New Incident Coords: {new_coords}, Recent Incident Coords: {recent_coords}")
-
         distance = self.calculate_distance(new_coords, recent_coords)
-
-        print(f"📍 Distance: {distance} meters (Max allowed: 200m)")
-
-        if distance > 200:
-            print("❌ Distance condition failed")
+        # Exact geodesic is only computed when the haversine distance is close to the threshold
+        if not is_within(new_coords, recent_coords, self.MAX_DISTANCE_METERS, distance):
+            logging.debug(f"Distance condition failed: {distance:.1f} m (max {self.MAX_DISTANCE_METERS} m)")
             return False
 
-        print("✅ Event matched (Time & Location)")
+        logging.debug(f"Event matched: {time_diff} apart, {distance:.1f} m away")
         return True
 
 
+    @metrics.timed("find_similar_event")
     def find_similar_event(self, incident_type: str, new_incident: Dict) -> Optional[str]:
         """
         Find the first matching event ID based on the incident details.
@@ -165,18 +243,26 @@ class EventSearcher:
 
         logging.info(f"Searching for events matching incident type: {incident_type}")
 
-        candidate_events = self.get_candidate_events(incident_type)
+        self.refresh_index()
+        event_id, conclusive = self.find_in_index(incident_type, new_incident)
+        if conclusive:
+            logging.info(f"Answered from dedup index: {event_id}")
+            metrics.DEDUP_INDEX_LOOKUPS.inc(result="conclusive")
+            return event_id
+        metrics.DEDUP_INDEX_LOOKUPS.inc(result="fallback")
+
+        with metrics.timed("candidate_query"):
+            candidate_events = self.get_candidate_events(incident_type, new_incident)
        
 
         logging.debug(f"Candidate events found: {len(candidate_events)}")
         for event in candidate_events:
             logging.debug(f"Checking event ID: {event['_id']}")
-            recent_incident = self.get_most_recent_incident(event.get("incidents", []))
+            recent_incident = self.event_summary(event)
 
-            if recent_incident and self.is_event_similar(new_incident, recent_incident):
+            if recent_incident["incident_time"] and self.is_event_similar(new_incident, recent_incident):
                 logging.info(f"Found matching event: {event['_id']}")
-                print(f"Matching event found: {event['_id']}")
-                print(event["_id"])
+                self.record_incident(event["_id"], incident_type, recent_incident)
                 return event["_id"]
 
         return None
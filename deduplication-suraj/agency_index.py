@@ -0,0 +1,197 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from pymongo.errors import OperationFailure, PyMongoError
+
+from geo_distance import EARTH_RADIUS_METERS, HAVERSINE_MAX_RELATIVE_ERROR
+from geo_distance import nearest as exact_nearest
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """Converts lat/lon degrees to 3D unit vectors; chord length grows monotonically with great-circle distance."""
+    phi = np.radians(np.asarray(latitudes, dtype=float))
+    lam = np.radians(np.asarray(longitudes, dtype=float))
+    cos_phi = np.cos(phi)
+    return np.column_stack((cos_phi * np.cos(lam), cos_phi * np.sin(lam), np.sin(phi)))
+
+
+def chord_to_meters(chord):
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.minimum(1.0, chord / 2))
+
+
+def meters_to_chord(meters):
+    return 2 * math.sin(min(math.pi / 2, meters / (2 * EARTH_RADIUS_METERS)))
+
+
+class _TypeIndex:
+    """KD-tree over the agencies responsible for one event type."""
+
+    def __init__(self, agency_ids, latitudes, longitudes):
+        from scipy.spatial import cKDTree  # Imported with the first index build, not at startup
+        self.agency_ids = agency_ids
+        self.points = np.column_stack((latitudes, longitudes))
+        self.tree = cKDTree(to_unit_vectors(latitudes, longitudes))
+
+    def _refine(self, point, vector, chords, indices, top_n):
+        """Re-ranks every agency the haversine/geodesic difference could reorder with exact geodesic distances."""
+        cutoff = chord_to_meters(chords[-1])
+        bound = cutoff * (1 + HAVERSINE_MAX_RELATIVE_ERROR) / (1 - HAVERSINE_MAX_RELATIVE_ERROR)
+        candidates = sorted(set(self.tree.query_ball_point(vector, meters_to_chord(bound))) | set(indices))
+        ranked = exact_nearest(point, self.points[candidates], top_n)
+        return [(self.agency_ids[candidates[i]], meters) for i, meters in ranked]
+
+    def nearest(self, latitudes, longitudes, top_n):
+        """Top-N agencies (agency_id, meters) for each of several points of this event type."""
+        k = min(top_n, len(self.agency_ids))
+        vectors = to_unit_vectors(latitudes, longitudes)
+        chords, indices = self.tree.query(vectors, k=k)
+        chords = np.asarray(chords).reshape(len(vectors), k)
+        indices = np.asarray(indices).reshape(len(vectors), k)
+        return [
+            self._refine((latitudes[row], longitudes[row]), vectors[row], chords[row], indices[row], k)
+            for row in range(len(vectors))
+        ]
+
+
+class AgencyIndex:
+    """
+    In-process nearest-neighbour index of agency locations, one KD-tree per event type
+    (matched case-insensitively, like the previous $regex query).
+    The index is rebuilt after ttl_seconds or when invalidate() is called (e.g. by an
+    AgencyChangeWatcher), so top-N lookups are O(log n) and never query Mongo.
+    """
+
+    def __init__(self, db_client, ttl_seconds=300):
+        self.db_client = db_client
+        self.ttl_seconds = ttl_seconds
+        self._indexes = {}  # lowercased event type -> _TypeIndex
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def build(self, agencies):
+        """Builds the per-type trees from agency documents."""
+        by_type = {}
+        for agency in agencies:
+            location = agency.get("location") or {}
+            if "latitude" not in location or "longitude" not in location:
+                continue
+            for event_type in {str(t).lower() for t in agency.get("eventResponsibleFor") or []}:
+                by_type.setdefault(event_type, ([], [], []))
+                ids, latitudes, longitudes = by_type[event_type]
+                ids.append(agency["AgencyId"])
+                latitudes.append(location["latitude"])
+                longitudes.append(location["longitude"])
+
+        indexes = {event_type: _TypeIndex(*columns) for event_type, columns in by_type.items()}
+        with self._lock:
+            self._indexes = indexes
+            self._loaded_at = time.monotonic()
+        logging.info(f"Agency index built for {len(indexes)} event types.")
+
+    def load(self):
+        """(Re)loads agency locations from Mongo."""
+        agencies_collection = self.db_client.get_collection("agencies")
+        self.build(agencies_collection.find({}, {"AgencyId": 1, "location": 1, "eventResponsibleFor": 1}))
+
+    def invalidate(self):
+        """Forces a reload on the next lookup."""
+        with self._lock:
+            self._loaded_at = None
+
+    def _type_index(self, event_type):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+            self.load()
+        return self._indexes.get(event_type.lower())
+
+    def nearest(self, event_type, latitude, longitude, top_n=3):
+        """Returns up to top_n (agency_id, distance in meters) nearest agencies responsible for event_type."""
+        return self.nearest_many(event_type, [latitude], [longitude], top_n)[0]
+
+    def nearest_many(self, event_type, latitudes, longitudes, top_n=3):
+        """Batch version of nearest() for many locations of the same event type."""
+        index = self._type_index(event_type)
+        if index is None:
+            return [[] for _ in latitudes]
+        return index.nearest(list(latitudes), list(longitudes), top_n)
+
+
+class AgencyChangeWatcher:
+    """
+    Watches the agencies collection with a change stream and calls every listener on each change.
+    Change streams need a replica set; on a standalone server the watcher logs a warning
+    and stops, and the listeners fall back to their own refresh policy (e.g. a TTL).
+    Other errors (network, failover) reopen the stream after a backoff, resuming after the last
+    change seen; when no change can be resumed from, the listeners are called once after reopening,
+    as changes may have been missed in between.
+    """
+
+    # Code of "The $changeStream stage is only supported on replica sets"
+    NOT_SUPPORTED_CODE = 40573
+
+    def __init__(self, agencies_collection, listeners=None, min_backoff=1.0, max_backoff=60.0):
+        """
+        :param min_backoff: Seconds before the first reopen attempt; doubled after each failure.
+        :param max_backoff: Longest wait between reopen attempts.
+        """
+        self.agencies_collection = agencies_collection
+        self.listeners = list(listeners or [])
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._resume_token = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self):
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as e:
+                logging.error(f"Agency change listener failed: {e}")
+
+    def _is_unsupported(self, error):
+        return isinstance(error, OperationFailure) and (
+            error.code == self.NOT_SUPPORTED_CODE or "only supported on replica sets" in str(error)
+        )
+
+    def _watch(self, reopened):
+        with self.agencies_collection.watch(resume_after=self._resume_token, max_await_time_ms=1000) as stream:
+            if reopened and self._resume_token is None:
+                self._notify()  # Changes between the failure and now are not in the new stream
+            while not self._stop.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    self._notify()
+                self._resume_token = stream.resume_token
+
+    def _run(self):
+        backoff = self.min_backoff
+        reopened = False
+        while not self._stop.is_set():
+            try:
+                self._watch(reopened)
+                backoff = self.min_backoff
+            except PyMongoError as e:
+                if self._is_unsupported(e):
+                    logging.warning(f"Agency change stream unavailable, relying on periodic refresh: {e}")
+                    return
+                if isinstance(e, OperationFailure) and self._resume_token is not None:
+                    self._resume_token = None  # e.g. the resume point fell off the oplog; start afresh
+                logging.error(f"Agency change stream failed, reopening in {backoff:g}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            reopened = True
+
+    def stop(self):
+        self._stop.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="agency-change-watcher", daemon=True)
+            self._thread.start()
+        return self
@@ -0,0 +1,90 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from partitioning import geocell
+import metrics
+
+
+class AllocationCache:
+    """
+    Caches agency allocations per (detected object, geocell), so new events next to an earlier
+    one reuse its allocation without a KD-tree, jurisdiction or Mongo lookup.
+    Entries expire after ttl_seconds, the least recently used ones are evicted beyond
+    max_entries, and invalidate() (e.g. from an AgencyChangeWatcher) drops everything.
+    Events in the same cell share one allocation, so cell_meters trades precision near
+    jurisdiction borders and between agencies for hit rate.
+    """
+
+    def __init__(self, ttl_seconds=300, max_entries=10000, cell_meters=250):
+        """
+        :param ttl_seconds: Lifetime of an entry, an upper bound on how stale an allocation can be.
+        :param max_entries: Number of (detected object, cell) entries kept.
+        :param cell_meters: Edge length of the grid cells events are grouped by.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.cell_km = cell_meters / 1000
+        self._entries = OrderedDict()  # (detected_object, row, column) -> (expires_at, allocation)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, event):
+        """Cache key of an allocation input ({detected_object, latitude, longitude})."""
+        row, column = geocell(event["latitude"], event["longitude"], self.cell_km)
+        return event.get("detected_object", "Unknown"), row, column
+
+    @property
+    def generation(self):
+        """Read before the agency data an allocation is computed from (e.g. when building an
+        EventProcessor) and pass it to put(), so results from outdated agencies are not stored."""
+        return self._generation
+
+    def get(self, key):
+        """Returns a copy of the cached allocation for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                metrics.ALLOCATION_CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        metrics.ALLOCATION_CACHE_LOOKUPS.inc(result="hit")
+        return copy.deepcopy(entry[1])
+
+    def put(self, key, allocation, generation):
+        """Stores an allocation computed after reading generation."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(allocation))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drops every entry, e.g. after the agencies collection changed."""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit and miss counts, hit rate and number of entries."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries)
+            }
@@ -0,0 +1,267 @@
+"""
+Application entry point: builds the consumer's services (Mongo client, dedup index, reference
+data, storage, ...) on first use instead of at import, so importing a pipeline module opens no
+connection, reads no file and loads none of the heavy libraries.
+
+    from app import get_app
+    get_app().warm_up()            # before consuming: build everything, check the startup budget
+    get_app().event_handler.handle_event(...)
+
+Every service is created once per process and shared, e.g. one MongoClient for the searcher,
+the event handler, the sequence allocators, the image hash index and the agency indexes.
+"""
+import logging
+import threading
+import time
+
+import config
+import metrics
+
+STARTUP_SECONDS = metrics.REGISTRY.gauge("startup_seconds", "Time spent in Application.warm_up().")
+
+_MISSING = object()
+
+
+class Application:
+    """Lazily built, process-wide services. Attributes are created on first access."""
+
+    # Legacy sequence tracker files (file backend, and seed for the Mongo counters)
+    EVENT_SEQUENCE_FILE = "event_sequence_tracker.json"
+    INCIDENT_SEQUENCE_FILE = "incident_sequence_tracker.json"
+
+    def __init__(self, startup_budget_seconds=None):
+        """
+        :param startup_budget_seconds: warm_up() logs a warning when it takes longer (default STARTUP_BUDGET_SECONDS).
+        """
+        self.startup_budget_seconds = (
+            startup_budget_seconds if startup_budget_seconds is not None else config.STARTUP_BUDGET_SECONDS
+        )
+        self.startup_seconds = None
+        self._services = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _service(self, name, factory):
+        """Returns the service called name, building it with factory() once (thread-safe)."""
+        service = self._services.get(name, _MISSING)
+        if service is not _MISSING:
+            return service
+        with self._locks_lock:
+            lock = self._locks.setdefault(name, threading.RLock())
+        with lock:
+            service = self._services.get(name, _MISSING)
+            if service is _MISSING:
+                service = self._services[name] = factory()
+        return service
+
+    # --- MongoDB ------------------------------------------------------------------------------
+
+    @property
+    def mongo_client(self):
+        def build():
+            from pymongo import MongoClient
+            return MongoClient(config.MONGO_URI)
+        return self._service("mongo_client", build)
+
+    @property
+    def db(self):
+        return self.mongo_client[config.MONGO_DB]
+
+    @property
+    def db_client(self):
+        """MongoDBClient wrapper (agency lookups) over the shared client."""
+        def build():
+            from Agency_event_allocation_db_2 import MongoDBClient
+            return MongoDBClient(config.MONGO_URI, config.MONGO_DB, client=self.mongo_client)
+        return self._service("db_client", build)
+
+    @property
+    def incidents_collection(self):
+        return self.db[config.MONGO_COLLECTION]
+
+    @property
+    def events_collection(self):
+        return self.db["events"]
+
+    @property
+    def event_sequence(self):
+        """Daily event numbers (E-YYYYMMDD-<code>-<seq>); expired counters restart above the stored events."""
+        def build():
+            from sequence_allocator import create_sequence_allocator, last_issued_sequence
+            return create_sequence_allocator(
+                self.db, "event", self.EVENT_SEQUENCE_FILE,
+                issued_floor=lambda day: last_issued_sequence(self.events_collection, "event_id", f"E-{day}-")
+            )
+        return self._service("event_sequence", build)
+
+    @property
+    def incident_sequence(self):
+        """Daily incident numbers (I-YYYYMMDD-<seq>); expired counters restart above the stored incidents."""
+        def build():
+            from sequence_allocator import create_sequence_allocator, last_issued_sequence
+            return create_sequence_allocator(
+                self.db, "incident", self.INCIDENT_SEQUENCE_FILE,
+                issued_floor=lambda day: last_issued_sequence(self.incidents_collection, "incident_id", f"I-{day}-")
+            )
+        return self._service("incident_sequence", build)
+
+    # --- Deduplication ------------------------------------------------------------------------
+
+    @property
+    def dedup_index(self):
+        def build():
+            if not config.DEDUP_INDEX_ENABLED:
+                return None
+            from dedup_index import SpatioTemporalIndex
+            from Mongo_interaction import EventSearcher
+            return SpatioTemporalIndex(
+                max_distance_meters=EventSearcher.MAX_DISTANCE_METERS,
+                window=EventSearcher.TIME_WINDOW,
+                max_events=config.DEDUP_INDEX_MAX_EVENTS
+            )
+        return self._service("dedup_index", build)
+
+    @property
+    def searcher(self):
+        """EventSearcher over the shared database, its in-memory index warmed from Mongo."""
+        def build():
+            from Mongo_interaction import EventSearcher
+            searcher = EventSearcher(
+                self.db, index=self.dedup_index, index_authoritative=config.DEDUP_INDEX_AUTHORITATIVE
+            )
+            searcher.warm_index()
+            return searcher
+        return self._service("searcher", build)
+
+    @property
+    def event_handler(self):
+        def build():
+            from test_dedup3 import EventHandler
+            return EventHandler(self.events_collection, self.searcher)
+        return self._service("event_handler", build)
+
+    @property
+    def near_duplicate_filter(self):
+        def build():
+            if not config.NEAR_DUPLICATE_FILTER_ENABLED:
+                return None
+            from datetime import timedelta
+            from frame_filter import NearDuplicateFilter
+            return NearDuplicateFilter(
+                max_distance=config.NEAR_DUPLICATE_MAX_DISTANCE,
+                window=timedelta(seconds=config.NEAR_DUPLICATE_WINDOW_SECONDS),
+                cell_meters=config.NEAR_DUPLICATE_CELL_METERS
+            )
+        return self._service("near_duplicate_filter", build)
+
+    # --- Reference data -----------------------------------------------------------------------
+
+    @property
+    def allocation_cache(self):
+        def build():
+            if not config.ALLOCATION_CACHE_ENABLED:
+                return None
+            from allocation_cache import AllocationCache
+            return AllocationCache(
+                config.ALLOCATION_CACHE_TTL, config.ALLOCATION_CACHE_SIZE, config.ALLOCATION_CACHE_CELL_METERS
+            )
+        return self._service("allocation_cache", build)
+
+    @property
+    def reference_data(self):
+        """
+        Classifier, criticality, incident codes and agency indexes: rebuilt in the background when
+        the JSON files or the agencies change (change stream, otherwise every AGENCY_INDEX_TTL).
+        """
+        def build():
+            from reference_data import ReferenceDataManager
+            return ReferenceDataManager(self.db_client, allocation_cache=self.allocation_cache).start()
+        return self._service("reference_data", build)
+
+    # --- Images -------------------------------------------------------------------------------
+
+    @property
+    def image_hash_index(self):
+        def build():
+            if not config.CONTENT_ADDRESSED_IMAGES:
+                return None
+            from image_hash_index import ImageHashIndex
+            return ImageHashIndex(self.db[config.IMAGE_HASH_COLLECTION], cache_size=config.IMAGE_HASH_CACHE_SIZE)
+        return self._service("image_hash_index", build)
+
+    @property
+    def image_normalizer(self):
+        def build():
+            if not config.IMAGE_NORMALIZE_ENABLED:
+                return None
+            from image_normalizer import ImageNormalizer
+            return ImageNormalizer(
+                workers=config.IMAGE_NORMALIZE_WORKERS,
+                max_dimension=config.IMAGE_MAX_DIMENSION,
+                quality=config.IMAGE_QUALITY,
+                thumbnail_size=config.THUMBNAIL_SIZE,
+                thumbnail_quality=config.THUMBNAIL_QUALITY
+            )
+        return self._service("image_normalizer", build)
+
+    @property
+    def storage(self):
+        """MinIOStorage used by process_image() and process_image_async()."""
+        def build():
+            from demo_objectstorage3 import MinIOStorage
+            return MinIOStorage(
+                config.MINIO_ENDPOINT, config.MINIO_ACCESS_KEY, config.MINIO_SECRET_KEY, config.BUCKET_NAME,
+                hash_index=self.image_hash_index, normalizer=self.image_normalizer
+            )
+        return self._service("storage", build)
+
+    # --- Lifecycle ----------------------------------------------------------------------------
+
+    def warm_up(self):
+        """
+        Builds every service the consumer uses (connections, warmed dedup index, reference data,
+        storage), so the first message pays no initialization. Later calls return immediately.
+        :return: self
+        """
+        if self.startup_seconds is not None:
+            return self
+        started = time.perf_counter()
+        self.reference_data
+        self.event_handler
+        self.near_duplicate_filter
+        self.incident_sequence
+        self.storage
+        self.startup_seconds = time.perf_counter() - started
+        STARTUP_SECONDS.set(self.startup_seconds)
+        logging.info(f"Application ready in {self.startup_seconds:.2f}s.")
+        if self.startup_seconds > self.startup_budget_seconds:
+            logging.warning(
+                f"Startup took {self.startup_seconds:.2f}s, over the {self.startup_budget_seconds}s budget."
+            )
+        return self
+
+    def shutdown(self):
+        """Stops the background threads and pools of the services that were built."""
+        reference_data = self._services.get("reference_data")
+        if reference_data is not None:
+            reference_data.stop()
+        storage = self._services.get("storage")
+        if storage is not None:
+            storage.shutdown()
+        image_normalizer = self._services.get("image_normalizer")
+        if image_normalizer is not None:
+            image_normalizer.shutdown()
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_app():
+    """The process-wide Application, created on first call."""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = Application()
+    return _app
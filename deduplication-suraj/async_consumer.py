@@ -0,0 +1,426 @@
+import asyncio
+import hashlib
+import logging
+import signal
+import weakref
+from contextlib import AsyncExitStack
+from datetime import timedelta
+from typing import Dict, Optional
+
+import aio_pika
+import aioboto3
+from botocore.config import Config
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+
+from Mongo_interaction import EventSearcher
+from test_dedup3 import EventHandler
+from demo_objectstorage3 import FilenameGenerator
+from app import get_app
+from image_normalizer import thumbnail_key
+from incident_message import loads_incident, parse_incident, has_required_fields
+from image_stream import decode_base64_image
+from frame_filter import NearDuplicateFilter
+from geo_distance import HAVERSINE_MAX_RELATIVE_ERROR
+from partitioning import cells_within
+import config  # Using your config file
+import metrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class AsyncEventSearcher(EventSearcher):
+    """
+    EventSearcher backed by a Motor collection.
+    Matching rules (incident type, most recent incident, time and distance) are inherited unchanged.
+    """
+
+    def ensure_indexes(self):
+        """Motor calls need a running loop: the pipeline awaits create_indexes() in run() instead."""
+
+    async def create_indexes(self):
+        """Creates the candidate event index, so candidate queries never scan the events collection."""
+        try:
+            await self.events_collection.create_index(self.SUMMARY_INDEX_KEYS, name=self.SUMMARY_INDEX_NAME)
+        except PyMongoError as e:
+            logging.error(f"Could not create candidate event index: {e}")
+
+    async def refresh_index(self):
+        """Drops indexed events that were closed elsewhere, at a bounded rate."""
+        if self.index is None or not self.index.closed_check_due():
+            return
+        event_ids = self.index.event_ids()
+        if event_ids:
+            async for event in self.events_collection.find({"_id": {"$in": event_ids}, "status": "closed"}, {"_id": 1}):
+                self.index.discard(event["_id"])
+
+    async def get_candidate_events(self, incident_type: str, new_incident: Optional[Dict] = None) -> list:
+        """
+        Retrieve candidate events that match the incident type and are not closed.
+        """
+        cursor = self.events_collection.find(
+            self.build_candidate_query(incident_type, new_incident),
+            self.SUMMARY_PROJECTION
+        )
+        return await cursor.to_list(length=None)
+
+    async def find_similar_event(self, incident_type: str, new_incident: Dict) -> Optional[str]:
+        """
+        Find the first matching event ID based on the incident details.
+        """
+        if not incident_type:
+            logging.error("No incident_type provided.")
+            return None
+
+        await self.refresh_index()
+        event_id, conclusive = self.find_in_index(incident_type, new_incident)
+        if conclusive:
+            return event_id
+
+        for event in await self.get_candidate_events(incident_type, new_incident):
+            recent_incident = self.event_summary(event)
+            if recent_incident["incident_time"] and self.is_event_similar(new_incident, recent_incident):
+                logging.info(f"Found matching event: {event['_id']}")
+                self.record_incident(event["_id"], incident_type, recent_incident)
+                return event["_id"]
+        return None
+
+
+class AsyncEventHandler(EventHandler):
+    """
+    Async counterpart of EventHandler with the same dedup and allocation semantics.
+    Dedup and event creation are serialized per incident type and geocell: an incident locks
+    every cell its match radius overlaps, so two incidents that can match share a lock and
+    cannot both miss and create two events, while incidents elsewhere proceed concurrently.
+    """
+
+    def __init__(self, events_collection, searcher):
+        super().__init__(events_collection, searcher)
+        # Match radius padded like the candidate query
+        self._lock_radius_meters = searcher.MAX_DISTANCE_METERS * (1 + HAVERSINE_MAX_RELATIVE_ERROR)
+        # Cells twice the match diameter: a radius overlaps at most four of them
+        self._lock_cell_km = 4 * searcher.MAX_DISTANCE_METERS / 1000
+        self._dedup_locks = weakref.WeakValueDictionary()  # Unused locks are dropped with their last waiter
+
+    def _lock_keys(self, incident_type, incident):
+        """Sorted (incident type, row, column) of the lock cells within the match radius of an incident."""
+        latitude, longitude = self.searcher.extract_coordinates(incident["location"])
+        return [
+            (incident_type, row, column)
+            for row, column in cells_within(latitude, longitude, self._lock_radius_meters, self._lock_cell_km)
+        ]
+
+    def _dedup_lock(self, key):
+        """The lock of one cell, created on first use."""
+        lock = self._dedup_locks.get(key)
+        if lock is None:
+            lock = self._dedup_locks[key] = asyncio.Lock()
+        return lock
+
+    def ensure_indexes(self):
+        """Motor calls need a running loop: the pipeline awaits create_indexes() in run() instead."""
+
+    async def create_indexes(self):
+        """Creates the incident bucket indexes, so bucket upserts never scan the collection."""
+        try:
+            for keys, name in self.BUCKET_INDEXES:
+                await self.buckets_collection.create_index(keys, name=name)
+        except PyMongoError as e:
+            logging.error(f"Could not create incident bucket indexes: {e}")
+
+    async def _append_to_bucket(self, event_ref, incident):
+        """Stores an incident in the buckets of its event."""
+        bucket_filter, update = self._build_bucket_update(event_ref, incident)
+        await self.buckets_collection.update_one(bucket_filter, update, upsert=True)
+
+    async def handle_event(self, incident, incident_type):
+        """
+        Handles an incident by either adding it to an existing event or creating a new event.
+        """
+        self._stamp_incident_time(incident)
+        async with AsyncExitStack() as locks:
+            # Always acquired in sorted order, so overlapping incidents cannot deadlock
+            for lock in [self._dedup_lock(key) for key in self._lock_keys(incident_type, incident)]:
+                await locks.enter_async_context(lock)
+            matching_event_id = await self.searcher.find_similar_event(incident_type, incident)
+
+            if matching_event_id:
+                await self._add_incident_to_event(matching_event_id, incident, incident_type)
+                return {
+                    "_id": matching_event_id,
+                    "event_ref": matching_event_id,
+                    "status": "updated",
+                    "description": f"Incident added to existing event {matching_event_id}"
+                }
+
+            new_event = await self._create_new_event(incident, incident_type)
+            return {
+                "_id": new_event["event_id"],
+                "event_ref": new_event["_id"],
+                "status": "new",
+                "description": f"New {incident_type} incident"
+            }
+
+    async def _add_incident_to_event(self, event_id, incident, incident_type=None):
+        """
+        Adds an incident to an existing event.
+        """
+        await self.events_collection.update_one({"_id": event_id}, self._build_add_update(incident))
+        await self._append_to_bucket(event_id, incident)
+        self.searcher.record_incident(event_id, incident_type, incident)
+
+    async def _create_new_event(self, incident, detected_incident):
+        """
+        Creates a new event with the given incident.
+        Agency allocation and the event ID (a Mongo counter) are blocking, so they run in a worker thread.
+        """
+        event_data = self._extract_event_data(incident, detected_incident)
+        assigned_agency = await asyncio.to_thread(get_app().reference_data.current().processor.process_event, event_data)
+
+        new_event_id = await asyncio.to_thread(self._generate_event_id, detected_incident)
+        new_event = self._build_new_event(incident, detected_incident, assigned_agency, new_event_id)
+        await self.events_collection.insert_one(new_event)
+        await self._append_to_bucket(new_event["_id"], incident)
+        self.searcher.record_incident(new_event["_id"], detected_incident, incident)
+        logging.info(f"New event created with ID: {new_event_id}")
+        return new_event
+
+    async def attach_duplicate_frame(self, event_ref, frame):
+        """Records a near-duplicate frame on an existing event as a lightweight reference."""
+        await self.events_collection.update_one({"_id": event_ref}, self._build_duplicate_frame_update(frame))
+
+
+class AsyncMinIOStorage:
+    """
+    Uploads incident images to MinIO through an aioboto3 client.
+    With a hash index, identical image bytes are uploaded once, and with a normalizer images
+    are resized in its process pool and stored with a thumbnail (see MinIOStorage).
+    """
+
+    def __init__(self, endpoint_url, access_key, secret_key, bucket_name, hash_index=None, normalizer=None):
+        self.session = aioboto3.Session(
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key
+        )
+        self.endpoint_url = endpoint_url
+        self.bucket_name = bucket_name
+        self.hash_index = hash_index
+        self.normalizer = normalizer
+        self._client_context = None
+        self.s3_client = None
+
+    async def start(self):
+        self._client_context = self.session.client(
+            "s3",
+            endpoint_url=self.endpoint_url,
+            config=Config(
+                max_pool_connections=max(1, config.UPLOAD_WORKERS),  # Bounds concurrent uploads
+                tcp_keepalive=True,
+                connect_timeout=config.S3_CONNECT_TIMEOUT,
+                read_timeout=config.S3_READ_TIMEOUT,
+                retries={"max_attempts": config.S3_MAX_ATTEMPTS, "mode": "standard"}
+            )
+        )
+        self.s3_client = await self._client_context.__aenter__()
+
+    async def close(self):
+        if self._client_context is not None:
+            await self._client_context.__aexit__(None, None, None)
+
+    async def upload_image(self, base64_image):
+        """Uploads a Base64 image to MinIO and returns the URL."""
+        try:
+            image_bytes = await asyncio.to_thread(decode_base64_image, base64_image)
+            if self.hash_index is not None:
+                digest = hashlib.sha256(image_bytes).hexdigest()
+                image_url = await asyncio.to_thread(self.hash_index.lookup, digest)
+                if image_url is not None:
+                    return image_url
+
+            incident_id = await asyncio.to_thread(FilenameGenerator.generate_incident_id, self)
+            filename = FilenameGenerator.generate(incident_id, [])
+            if self.normalizer is not None:
+                image_bytes, thumbnail_bytes = await asyncio.wrap_future(self.normalizer.submit(image_bytes))
+                await self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=thumbnail_key(filename),
+                    Body=thumbnail_bytes,
+                    ContentType="image/jpeg"
+                )
+            await self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=filename,
+                Body=image_bytes,
+                ContentType="image/jpeg"
+            )
+            image_url = f"{self.endpoint_url}/{self.bucket_name}/{filename}"
+            if self.hash_index is not None:
+                image_url = await asyncio.to_thread(self.hash_index.register, digest, image_url, len(image_bytes))
+            return image_url
+        except Exception as e:
+            logging.error(f"Failed to upload image to MinIO: {e}")
+            return None
+
+
+class AsyncIncidentPipeline:
+    """
+    asyncio entry point: consumes incidents with aio-pika and keeps up to
+    ASYNC_MAX_IN_FLIGHT messages in flight at once.
+    """
+
+    def __init__(self, max_in_flight=config.ASYNC_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.mongo_client = AsyncIOMotorClient(config.MONGO_URI)
+        db = self.mongo_client[config.MONGO_DB]
+        self.incidents_collection = db[config.MONGO_COLLECTION]
+        self.searcher = AsyncEventSearcher(db)
+        self.event_handler = AsyncEventHandler(db["events"], self.searcher)
+        self.generator = FilenameGenerator()
+        # Classifier, agency indexes and sequence allocators are loaded before the first message.
+        # They are blocking (pymongo, CPU-bound), so messages only call them through asyncio.to_thread.
+        get_app().reference_data
+        get_app().event_sequence
+        get_app().incident_sequence
+        self.storage = AsyncMinIOStorage(
+            config.MINIO_ENDPOINT, config.MINIO_ACCESS_KEY, config.MINIO_SECRET_KEY, config.BUCKET_NAME,
+            hash_index=get_app().image_hash_index, normalizer=get_app().image_normalizer
+        )
+        self.near_duplicate_filter = None
+        if config.NEAR_DUPLICATE_FILTER_ENABLED:
+            self.near_duplicate_filter = NearDuplicateFilter(
+                max_distance=config.NEAR_DUPLICATE_MAX_DISTANCE,
+                window=timedelta(seconds=config.NEAR_DUPLICATE_WINDOW_SECONDS),
+                cell_meters=config.NEAR_DUPLICATE_CELL_METERS
+            )
+        self._stop = asyncio.Event()
+        self._tasks = set()
+
+    async def process_message(self, message):
+        """Runs one message through classify, upload, insert and dedup, then acks or nacks it."""
+        metrics.MESSAGES.inc()
+        try:
+            with metrics.timed("parse"):
+                incident = loads_incident(message.body)
+                detected_object, timestamp, location, base64_image = parse_incident(incident)
+
+            if not has_required_fields(detected_object, timestamp, location, base64_image):
+                logging.error("Missing required fields in incident data.")
+                metrics.NACKS.inc(reason="missing_fields")
+                await message.nack(requeue=False)
+                return
+
+            signature = None
+            if self.near_duplicate_filter is not None:
+                frame_time = EventSearcher.parse_timestamp(timestamp)
+                signature = await asyncio.to_thread(
+                    self.near_duplicate_filter.signature, incident, location, frame_time, base64_image
+                )
+                event_ref = self.near_duplicate_filter.find(signature) if signature is not None else None
+                if event_ref is not None:
+                    await self.event_handler.attach_duplicate_frame(event_ref, {
+                        "userId": incident.get("userId"),
+                        "timestamp": timestamp,
+                        "incident_time": frame_time,
+                        "location": location,
+                        "frame_hash": f"{signature.frame_hash:016x}"
+                    })
+                    metrics.NEAR_DUPLICATES.inc()
+                    metrics.ACKS.inc()
+                    await message.ack()
+                    return
+
+            with metrics.timed("classify"):
+                incident_type = await asyncio.to_thread(
+                    get_app().reference_data.current().classifier.process_incidents, detected_object, timestamp
+                )
+
+            if incident_type:
+                incident["incident_type"] = incident_type
+                incident["location"] = location
+                incident["timestamp"] = timestamp
+
+                image_url = await self.storage.upload_image(base64_image)
+                if not image_url:
+                    logging.error("Image processing failed, skipping MongoDB insert.")
+                    metrics.NACKS.inc(reason="upload_failed")
+                    await message.nack(requeue=False)
+                    return
+
+                incident["image_url"] = image_url
+                incident["incident_id"] = await asyncio.to_thread(self.generator.generate_incident_id, detected_object)
+                incident.pop("base64String", None)
+                with metrics.timed("incident_insert"):
+                    await self.incidents_collection.insert_one(incident)
+
+                try:
+                    output = await self.event_handler.handle_event(incident, incident_type)
+                except Exception:
+                    # The message is rejected, so do not leave its incident without an event
+                    await self.incidents_collection.delete_one({"_id": incident["_id"]})
+                    raise
+                logging.info(f"Deduplication Output: {output}")
+                if signature is not None:
+                    self.near_duplicate_filter.add(signature, output["event_ref"])
+            else:
+                metrics.NON_INCIDENTS.inc()
+
+            metrics.ACKS.inc()
+            await message.ack()
+
+        except Exception as e:
+            logging.error(f"Processing message: {e}")
+            metrics.NACKS.inc(reason="error")
+            await message.nack(requeue=False)
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self):
+        """Consumes until stop() is called, then drains in-flight messages."""
+        await self.storage.start()
+        await self.searcher.create_indexes()
+        await self.event_handler.create_indexes()
+        connection = await aio_pika.connect_robust(host=config.RABBITMQ_HOST, port=config.RABBITMQ_PORT)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        metrics.QUEUE_DEPTH.set_function(lambda: len(self._tasks), queue="in_flight", worker="async")
+
+        async def handle(message):
+            async with semaphore:
+                await self.process_message(message)
+
+        async def on_message(message):
+            task = asyncio.create_task(handle(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        try:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=self.max_in_flight)
+            queue = await channel.declare_queue(config.INPUT_QUEUE)
+            consumer_tag = await queue.consume(on_message)
+            logging.info("Waiting for messages...")
+
+            await self._stop.wait()
+
+            await queue.cancel(consumer_tag)
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            await connection.close()
+            await self.storage.close()
+            self.mongo_client.close()
+
+
+async def main():
+    if config.METRICS_ENABLED:
+        metrics.start_metrics_server(config.METRICS_PORT, config.METRICS_HOST)
+    pipeline = AsyncIncidentPipeline()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, pipeline.stop)
+    await pipeline.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
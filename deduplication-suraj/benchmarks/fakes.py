@@ -0,0 +1,651 @@
+"""
+In-process stand-ins for MongoDB, MinIO (S3) and RabbitMQ, so the pipeline modules can be
+imported and benchmarked without live services.
+
+The Mongo fake implements the query, projection and update operators this repository uses
+(including the $geoWithin/$centerSphere candidate query and the pipeline update that appends
+incidents), not MongoDB in general. Every fake can add a fixed latency per call to model
+network round-trips.
+
+install() must run before any pipeline module is imported: the modules bind MongoClient at import.
+"""
+import copy
+import heapq
+import itertools
+import math
+import os
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+EARTH_RADIUS_METERS = 6378100
+_MISSING = object()
+
+
+def _sleep(latency):
+    if latency:
+        time.sleep(latency)
+
+
+# --- Mongo ------------------------------------------------------------------------------------
+
+def _get_path(document, path):
+    """Value at a dotted path, or _MISSING."""
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(document, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _within_center_sphere(location, center_sphere):
+    (center_lon, center_lat), radians = center_sphere
+    if not isinstance(location, dict) or "coordinates" not in location:
+        return False
+    lon, lat = location["coordinates"]
+    phi1, phi2 = math.radians(center_lat), math.radians(lat)
+    d_phi, d_lam = phi2 - phi1, math.radians(lon - center_lon)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lam / 2) ** 2
+    return 2 * math.asin(min(1.0, math.sqrt(a))) <= radians
+
+
+def _compare(value, operator, operand):
+    if operator == "$ne":
+        return value != operand
+    if operator == "$exists":
+        return (value is not _MISSING) == bool(operand)
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if operator == "$geoWithin":
+        return _within_center_sphere(value, operand["$centerSphere"])
+    if value is _MISSING or value is None:
+        return False
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$gt":
+        return value > operand
+    if operator == "$lte":
+        return value <= operand
+    if operator == "$lt":
+        return value < operand
+    raise NotImplementedError(f"Query operator {operator} is not supported by the fake")
+
+
+def matches(document, query):
+    """True if document matches a Mongo filter (the subset of operators used in this repository)."""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(document, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches(document, sub) for sub in condition):
+                return False
+            continue
+        value = _get_path(document, key)
+        if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif value is _MISSING and condition is None:
+            continue  # {field: None} also matches documents without the field
+        elif value is _MISSING or value != condition:
+            return False
+    return True
+
+
+def _project_value(value, parts):
+    if isinstance(value, list):
+        return [projected for projected in (_project_value(item, parts) for item in value) if projected is not _MISSING]
+    if not parts:
+        return copy.deepcopy(value)
+    if not isinstance(value, dict) or parts[0] not in value:
+        return _MISSING
+    return {parts[0]: _project_value(value[parts[0]], parts[1:])}
+
+
+def _merge(target, source):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        elif isinstance(value, list) and isinstance(target.get(key), list):
+            for existing, extra in zip(target[key], value):
+                if isinstance(existing, dict) and isinstance(extra, dict):
+                    _merge(existing, extra)
+        else:
+            target[key] = value
+
+
+def project(document, projection):
+    """Applies an inclusion or exclusion projection and returns a copy of the document."""
+    if not projection:
+        return copy.deepcopy(document)
+    include_id = projection.get("_id", 1)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if fields and not any(fields.values()):
+        result = copy.deepcopy(document)
+        for key in fields:
+            result.pop(key, None)
+    else:
+        result = {}
+        for key in fields:
+            parts = key.split(".")
+            if parts[0] in document:
+                projected = _project_value(document, parts)
+                if projected is not _MISSING:
+                    _merge(result, projected)
+    if include_id and "_id" in document:
+        result["_id"] = document["_id"]
+    elif not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def evaluate(expression, document):
+    """Evaluates an aggregation expression (as used by pipeline updates) against a document."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get_path(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, list):
+        return [evaluate(item, document) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) == 1:
+        operator, operand = next(iter(expression.items()))
+        if operator == "$literal":
+            return copy.deepcopy(operand)
+        if operator.startswith("$"):
+            args = evaluate(operand, document)
+            if operator == "$ifNull":
+                return next((arg for arg in args if arg is not None), None)
+            if operator == "$concatArrays":
+                return list(itertools.chain.from_iterable(args))
+            if operator == "$add":
+                return sum(args)
+            if operator == "$size":
+                return len(args)
+            if operator == "$slice":
+                array, count = args
+                return array[count:] if count < 0 else array[:count]
+            if operator == "$cond":
+                condition, then, otherwise = args if isinstance(args, list) else (
+                    args["if"], args["then"], args["else"])
+                return then if condition else otherwise
+            if operator in ("$gte", "$gt", "$lte", "$lt", "$eq", "$ne"):
+                left, right = args
+                return {
+                    "$gte": lambda: left >= right, "$gt": lambda: left > right,
+                    "$lte": lambda: left <= right, "$lt": lambda: left < right,
+                    "$eq": lambda: left == right, "$ne": lambda: left != right
+                }[operator]()
+            if operator in ("$max", "$min"):
+                values = [arg for arg in (args if isinstance(args, list) else [args]) if arg is not None]
+                if not values:
+                    return None
+                return max(values) if operator == "$max" else min(values)
+            raise NotImplementedError(f"Expression operator {operator} is not supported by the fake")
+    return {key: evaluate(value, document) for key, value in expression.items()}
+
+
+def apply_update(document, update, inserting=False):
+    """Applies an update document or pipeline to document in place."""
+    if isinstance(update, list):
+        for stage in update:
+            (stage_name, fields), = stage.items()
+            if stage_name not in ("$set", "$addFields"):
+                raise NotImplementedError(f"Pipeline stage {stage_name} is not supported by the fake")
+            values = {key: evaluate(value, document) for key, value in fields.items()}
+            for key, value in values.items():
+                _set_path(document, key, value)
+        return
+
+    for operator, fields in update.items():
+        for key, operand in fields.items():
+            current = _get_path(document, key)
+            if operator == "$set":
+                _set_path(document, key, copy.deepcopy(operand))
+            elif operator == "$setOnInsert":
+                if inserting:
+                    _set_path(document, key, copy.deepcopy(operand))
+            elif operator == "$inc":
+                _set_path(document, key, (0 if current is _MISSING else current) + operand)
+            elif operator == "$max":
+                if current is _MISSING or operand > current:
+                    _set_path(document, key, operand)
+            elif operator == "$min":
+                if current is _MISSING or operand < current:
+                    _set_path(document, key, operand)
+            elif operator == "$unset":
+                parent = _get_path(document, key.rpartition(".")[0]) if "." in key else document
+                if isinstance(parent, dict):
+                    parent.pop(key.rpartition(".")[2], None)
+            elif operator == "$push":
+                items = list(current) if isinstance(current, list) else []
+                if isinstance(operand, dict) and "$each" in operand:
+                    items.extend(copy.deepcopy(operand["$each"]))
+                    if "$slice" in operand:
+                        limit = operand["$slice"]
+                        items = items[limit:] if limit < 0 else items[:limit]
+                else:
+                    items.append(copy.deepcopy(operand))
+                _set_path(document, key, items)
+            else:
+                raise NotImplementedError(f"Update operator {operator} is not supported by the fake")
+
+
+class FakeCursor:
+    """Sorts on the full documents and applies the projection last, like the server."""
+
+    def __init__(self, documents, projection=None):
+        self._documents = documents
+        self._projection = projection
+
+    def sort(self, key, direction=1):
+        self._documents.sort(key=lambda d: (_get_path(d, key) is _MISSING, _get_path(d, key)),
+                             reverse=direction == -1)
+        return self
+
+    def limit(self, count):
+        if count:
+            self._documents = self._documents[:count]
+        return self
+
+    def __iter__(self):
+        return iter([project(d, self._projection) for d in self._documents])
+
+
+class FakeCollection:
+    """Thread-safe in-memory collection; documents are copied on the way in and out like with a real server."""
+
+    def __init__(self, database, name, latency=0.0):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self.latency = latency
+        self.calls = 0
+        self._documents = {}  # _id -> document, in insertion order
+        self._lock = threading.RLock()
+
+    def with_options(self, **kwargs):
+        return self
+
+    def create_index(self, keys, **kwargs):
+        return kwargs.get("name", str(keys))
+
+    def create_indexes(self, indexes, **kwargs):
+        return []
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets")
+
+    def _call(self):
+        self.calls += 1
+        _sleep(self.latency)
+
+    def _insert(self, document):
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} _id: {document['_id']}")
+        self._documents[document["_id"]] = copy.deepcopy(document)
+        return document["_id"]
+
+    def _find_first(self, query):
+        if set(query or {}) == {"_id"} and not isinstance(query["_id"], dict):
+            return self._documents.get(query["_id"])
+        return next((d for d in self._documents.values() if matches(d, query)), None)
+
+    def _update(self, query, update, upsert):
+        document = self._find_first(query)
+        if document is not None:
+            apply_update(document, update)
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None), document
+        if not upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None), None
+        document = {key: value for key, value in (query or {}).items() if not key.startswith("$")
+                    and not isinstance(value, dict)}
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._documents:
+            # The filter did not match the existing document, so the server's insert collides
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} _id: {document['_id']}")
+        apply_update(document, update, inserting=True)
+        self._documents[document["_id"]] = document
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=document["_id"]), document
+
+    def insert_one(self, document, **kwargs):
+        self._call()
+        with self._lock:
+            return SimpleNamespace(inserted_id=self._insert(document), acknowledged=True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        self._call()
+        with self._lock:
+            return SimpleNamespace(inserted_ids=[self._insert(d) for d in documents], acknowledged=True)
+
+    def find(self, query=None, projection=None, **kwargs):
+        self._call()
+        with self._lock:
+            return FakeCursor([d for d in self._documents.values() if matches(d, query)], projection)
+
+    def find_one(self, query=None, projection=None, **kwargs):
+        self._call()
+        with self._lock:
+            document = self._find_first(query)
+            return None if document is None else project(document, projection)
+
+    def count_documents(self, query, **kwargs):
+        self._call()
+        with self._lock:
+            return sum(1 for d in self._documents.values() if matches(d, query))
+
+    def update_one(self, query, update, upsert=False, **kwargs):
+        self._call()
+        with self._lock:
+            return self._update(query, update, upsert)[0]
+
+    def update_many(self, query, update, upsert=False, **kwargs):
+        self._call()
+        with self._lock:
+            documents = [d for d in self._documents.values() if matches(d, query)]
+            for document in documents:
+                apply_update(document, update)
+            if not documents and upsert:
+                return self._update(query, update, True)[0]
+            return SimpleNamespace(matched_count=len(documents), modified_count=len(documents), upserted_id=None)
+
+    def find_one_and_update(self, query, update, projection=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        self._call()
+        with self._lock:
+            before = self._find_first(query)
+            before = copy.deepcopy(before) if before is not None else None
+            _, after = self._update(query, update, upsert)
+            document = after if return_document == ReturnDocument.AFTER else before
+            return None if document is None else project(document, projection)
+
+    def delete_many(self, query, **kwargs):
+        self._call()
+        with self._lock:
+            ids = [key for key, d in self._documents.items() if matches(d, query)]
+            for key in ids:
+                del self._documents[key]
+            return SimpleNamespace(deleted_count=len(ids))
+
+    def bulk_write(self, operations, ordered=True, **kwargs):
+        """One round-trip for the whole batch, like the driver's bulk API."""
+        self._call()
+        inserted = modified = 0
+        with self._lock:
+            for index, operation in enumerate(operations):
+                try:
+                    if isinstance(operation, InsertOne):
+                        self._insert(operation._doc)
+                        inserted += 1
+                    elif isinstance(operation, UpdateOne):
+                        result, _ = self._update(operation._filter, operation._doc, operation._upsert)
+                        modified += result.modified_count
+                    else:
+                        raise NotImplementedError(f"{type(operation).__name__} is not supported by the fake")
+                except DuplicateKeyError as e:
+                    # Ordered bulk writes stop at the first error; the operations before it are kept
+                    raise BulkWriteError({
+                        "writeErrors": [{"index": index, "code": 11000, "errmsg": str(e)}],
+                        "writeConcernErrors": [], "nInserted": inserted, "nModified": modified
+                    })
+        return SimpleNamespace(inserted_count=inserted, modified_count=modified, acknowledged=True)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._documents)
+
+
+class FakeDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(self, name, self.client.latency)
+            return self._collections[name]
+
+    def get_collection(self, name, **kwargs):
+        return self[name]
+
+    def list_collection_names(self):
+        return list(self._collections)
+
+
+class FakeMongoClient:
+    """
+    Drop-in for pymongo.MongoClient. Every client with the same URI shares one in-memory
+    server, since the pipeline modules each open their own client.
+    """
+
+    _servers = {}
+    _servers_lock = threading.Lock()
+    latency = 0.0
+
+    def __init__(self, host="mongodb://localhost:27017", *args, **kwargs):
+        with FakeMongoClient._servers_lock:
+            self._databases = FakeMongoClient._servers.setdefault(host, {})
+
+    def __getitem__(self, name):
+        with FakeMongoClient._servers_lock:
+            if name not in self._databases:
+                self._databases[name] = FakeDatabase(self, name)
+            return self._databases[name]
+
+    def get_database(self, name, **kwargs):
+        return self[name]
+
+    def close(self):
+        pass
+
+    @classmethod
+    def reset(cls):
+        with cls._servers_lock:
+            cls._servers.clear()
+
+
+# --- S3 ---------------------------------------------------------------------------------------
+
+class FakeS3Client:
+    """Drop-in for a boto3 S3 client; object bodies are read (like an upload would) and only their size is kept."""
+
+    latency = 0.0
+    read_size = 8 * 1024 * 1024  # s3transfer's read size for non-seekable streams
+
+    def __init__(self, *args, **kwargs):
+        self.objects = {}  # (bucket, key) -> size
+        self._lock = threading.Lock()
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Callback=None, Config=None):
+        size = 0
+        while True:
+            chunk = fileobj.read(self.read_size)
+            if not chunk:
+                break
+            size += len(chunk)
+        _sleep(self.latency)
+        with self._lock:
+            self.objects[(bucket, key)] = size
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        size = len(Body) if isinstance(Body, (bytes, bytearray, memoryview)) else len(Body.read())
+        _sleep(self.latency)
+        with self._lock:
+            self.objects[(Bucket, Key)] = size
+        return {"ETag": '"fake"'}
+
+    def head_bucket(self, Bucket):
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        _sleep(self.latency)
+        with self._lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {"Contents": [{"Key": key, "Size": self.objects[(Bucket, key)]} for key in keys], "KeyCount": len(keys)}
+
+
+# --- RabbitMQ ---------------------------------------------------------------------------------
+
+class FakeConnection:
+    """The parts of pika.BlockingConnection the consumers use: thread-safe callbacks and timers."""
+
+    def __init__(self):
+        self.is_open = True
+        self._callbacks = queue.Queue()
+        self._timers = []  # heap of (due, sequence, callback)
+        self._sequence = itertools.count()
+
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.put(callback)
+
+    def call_later(self, delay, callback):
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._sequence), callback))
+
+    def process_data_events(self, time_limit=0):
+        """Runs due timers and queued callbacks, waiting up to time_limit for one to arrive."""
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            ran = False
+            while self._timers and self._timers[0][0] <= time.monotonic():
+                heapq.heappop(self._timers)[2]()
+                ran = True
+            try:
+                while True:
+                    self._callbacks.get_nowait()()
+                    ran = True
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if ran or remaining <= 0:
+                return
+            wait = min(remaining, max(0.0, self._timers[0][0] - time.monotonic())) if self._timers else remaining
+            try:
+                self._callbacks.get(timeout=max(wait, 0.0005))()
+                return
+            except queue.Empty:
+                pass
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeChannel:
+    """
+    The parts of a pika channel the consumers use. start_consuming() delivers the queued
+    bodies while respecting the prefetch window and returns once every delivery was acked
+    or nacked; delivery-to-ack latencies are recorded per message.
+    """
+
+    def __init__(self, connection=None, bodies=()):
+        self.connection = connection or FakeConnection()
+        self.is_open = True
+        self.prefetch_count = 0
+        self.published = []  # (exchange, routing_key, body, properties)
+        self._pending = list(bodies)
+        self._consumers = []
+        self._delivered_at = {}
+        self._stop = False
+        self.latencies = []
+        self.acked = 0
+        self.nacked = 0
+
+    def queue_declare(self, queue, **kwargs):
+        return SimpleNamespace(method=SimpleNamespace(queue=queue, message_count=len(self._pending)))
+
+    def exchange_declare(self, exchange, **kwargs):
+        pass
+
+    def queue_bind(self, queue, exchange, routing_key=None, **kwargs):
+        pass
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, **kwargs):
+        self._consumers.append(on_message_callback)
+        return f"ctag{len(self._consumers)}"
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, **kwargs):
+        self.published.append((exchange, routing_key, body, properties))
+
+    def _settle(self, delivery_tag):
+        started = self._delivered_at.pop(delivery_tag, None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked += 1
+        self._settle(delivery_tag)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.nacked += 1
+        self._settle(delivery_tag)
+
+    def stop_consuming(self):
+        self._stop = True
+
+    def start_consuming(self):
+        callback = self._consumers[0]
+        window = self.prefetch_count or len(self._pending) or 1
+        tags = itertools.count(1)
+        self._pending.reverse()
+        while not self._stop and (self._pending or self._delivered_at):
+            if self._pending and len(self._delivered_at) < window:
+                delivery_tag = next(tags)
+                self._delivered_at[delivery_tag] = time.perf_counter()
+                callback(self, SimpleNamespace(delivery_tag=delivery_tag, routing_key=""), None, self._pending.pop())
+                self.connection.process_data_events(0)
+            else:
+                self.connection.process_data_events(time_limit=0.01)
+
+    def close(self):
+        self.is_open = False
+
+
+# --- Installation -----------------------------------------------------------------------------
+
+BENCHMARK_ENV = {
+    "METRICS_ENABLED": "false",  # No HTTP server per benchmark run
+    "AGENCY_CHANGE_STREAM_ENABLED": "false",
+    "SEQUENCE_BACKEND": "mongo",  # The file backend would rewrite the repo's tracker files
+    "MONGO_URI": "mongodb://benchmark",
+    "MINIO_ENDPOINT": "http://benchmark-minio:9000",
+}
+
+
+def install(mongo_latency_ms=0.0, s3_latency_ms=0.0, env=None):
+    """
+    Replaces pymongo.MongoClient and boto3.client with the fakes and sets the environment the
+    pipeline reads in config.py. Call before importing any pipeline module.
+    :param env: Extra environment overrides (e.g. {"WRITE_BUFFER_ENABLED": "true"}).
+    """
+    import boto3
+    import pymongo
+
+    for key, value in {**BENCHMARK_ENV, **(env or {})}.items():
+        os.environ[key] = str(value)
+    FakeMongoClient.latency = mongo_latency_ms / 1000
+    FakeS3Client.latency = s3_latency_ms / 1000
+    pymongo.MongoClient = FakeMongoClient
+    boto3.client = lambda service_name, *args, **kwargs: FakeS3Client()
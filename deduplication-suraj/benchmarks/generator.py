@@ -0,0 +1,156 @@
+"""
+Synthetic incident messages and agencies for the benchmarks.
+
+Incidents cluster around hotspots (so a share of them deduplicates into the same events),
+follow a configurable mix of detected labels, and carry real JPEG images of a configurable
+size. Everything is derived from a seed, so two runs with the same options see the same data.
+"""
+import base64
+import io
+import json
+import math
+import random
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+METERS_PER_DEGREE = 111320
+
+# Detected labels as the camera model sends them, including variants the term normalizer has to map
+DEFAULT_TYPE_MIX = {
+    "pothole": 30,
+    "car accident": 15,
+    "fallen tree": 10,
+    "litter": 15,
+    "street light": 10,
+    "animal debris": 5,
+    "bus accident": 5,
+    "Potholes": 4,
+    "car_accident": 3,
+    "fallen trees": 3
+}
+
+# Incident types produced by IncidentClassifier that agencies can be responsible for
+INCIDENT_TYPES = [
+    "Human healthcare services",
+    "Obstruction on Roads",
+    "Road Damage",
+    "Daytime Running Street Light",
+    "Environmental Violation"
+]
+
+
+def _offset(latitude, longitude, meters, bearing):
+    d_lat = meters * math.cos(bearing) / METERS_PER_DEGREE
+    d_lon = meters * math.sin(bearing) / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+    return latitude + d_lat, longitude + d_lon
+
+
+def make_jpeg(rng, width, height, quality=85):
+    """A noisy gradient JPEG; noise keeps the encoded size close to a camera frame of the same dimensions."""
+    base = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+    image = Image.blend(base, noise, 0.35)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class IncidentGenerator:
+    """Generates incident message bodies (JSON bytes, as published by the camera service)."""
+
+    def __init__(self, seed=0, center=(20.2961, 85.8245), radius_km=10.0, hotspots=50, hotspot_share=0.7,
+                 hotspot_radius_m=150.0, type_mix=None, image_size=(640, 480), distinct_images=32,
+                 rate_per_second=20.0, users=200, start=None):
+        """
+        :param center: (latitude, longitude) of the covered area.
+        :param radius_km: Radius of the covered area.
+        :param hotspots: Number of locations incidents cluster around (spatial density).
+        :param hotspot_share: Share of incidents placed within hotspot_radius_m of a hotspot;
+                              the rest are spread uniformly over the area.
+        :param type_mix: {detected label: weight}; defaults to DEFAULT_TYPE_MIX.
+        :param image_size: (width, height) of the generated JPEGs.
+        :param distinct_images: Number of different images; incidents reuse them round-robin.
+        :param rate_per_second: Incident timestamps advance by 1 / rate_per_second on average.
+        :param users: Number of distinct reporting users (userId).
+        """
+        self.rng = random.Random(seed)
+        self.center = center
+        self.radius_m = radius_km * 1000
+        self.hotspot_share = hotspot_share
+        self.hotspot_radius_m = hotspot_radius_m
+        mix = type_mix or DEFAULT_TYPE_MIX
+        self.labels, self.weights = list(mix), list(mix.values())
+        self.rate_per_second = rate_per_second
+        self.users = users
+        self.clock = start or datetime(2025, 3, 7, 8, 0, 0)
+        self.hotspots = [self._uniform_point() for _ in range(hotspots)]
+        self.images = [
+            base64.b64encode(make_jpeg(self.rng, *image_size)).decode()
+            for _ in range(max(1, distinct_images))
+        ]
+        self.count = 0
+
+    def _uniform_point(self):
+        meters = self.radius_m * math.sqrt(self.rng.random())
+        return _offset(*self.center, meters, self.rng.uniform(0, 2 * math.pi))
+
+    def location(self):
+        """(latitude, longitude) of the next incident."""
+        if self.hotspots and self.rng.random() < self.hotspot_share:
+            hotspot = self.rng.choice(self.hotspots)
+            return _offset(*hotspot, self.hotspot_radius_m * math.sqrt(self.rng.random()),
+                           self.rng.uniform(0, 2 * math.pi))
+        return self._uniform_point()
+
+    def incident(self):
+        """The next incident message as a dictionary."""
+        self.clock += timedelta(seconds=self.rng.expovariate(self.rate_per_second))
+        latitude, longitude = self.location()
+        image = self.images[self.count % len(self.images)]
+        self.count += 1
+        return {
+            "userId": f"user_{self.rng.randrange(self.users)}",
+            "detected_objects": self.rng.choices(self.labels, self.weights)[0],
+            "timestamp": {"$date": self.clock.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"},
+            "location": {"type": "Point", "coordinates": [longitude, latitude]},
+            "boundingBox": [50, 75, 100, 125],
+            "base64String": image
+        }
+
+    def body(self):
+        """The next incident message as an AMQP body."""
+        return json.dumps(self.incident()).encode()
+
+    def bodies(self, count):
+        return [self.body() for _ in range(count)]
+
+    def image_bytes(self):
+        """Average decoded image size in bytes."""
+        return sum(len(image) for image in self.images) * 3 // (4 * len(self.images))
+
+
+def make_agencies(count=200, seed=0, center=(20.2961, 85.8245), radius_km=10.0, jurisdiction_km=1.5,
+                  types_per_agency=2):
+    """
+    Agency documents in the shape AgencyIndex and JurisdictionRegistry load: a location,
+    the incident types the agency handles and a square jurisdiction polygon ([latitude, longitude] pairs).
+    """
+    rng = random.Random(seed)
+    half = jurisdiction_km * 1000 / 2
+    agencies = []
+    for number in range(count):
+        meters = radius_km * 1000 * math.sqrt(rng.random())
+        latitude, longitude = _offset(*center, meters, rng.uniform(0, 2 * math.pi))
+        d_lat = half / METERS_PER_DEGREE
+        d_lon = half / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+        agencies.append({
+            "AgencyId": f"AG-{number:04d}",
+            "location": {"latitude": latitude, "longitude": longitude},
+            "eventResponsibleFor": rng.sample(INCIDENT_TYPES, types_per_agency),
+            "jurisdiction": {"coordinates": [
+                [latitude - d_lat, longitude - d_lon], [latitude - d_lat, longitude + d_lon],
+                [latitude + d_lat, longitude + d_lon], [latitude + d_lat, longitude - d_lon]
+            ]}
+        })
+    return agencies
@@ -0,0 +1,154 @@
+"""
+Timing helpers, pipeline loading on the in-process fakes, and benchmark result files.
+
+A result file holds the run metadata (commit, interpreter, machine, options) and one entry
+per benchmark with its throughput and latency percentiles, so files from different commits
+can be compared with `python -m benchmarks.suite compare`.
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(PACKAGE_DIR)
+RESULTS_DIR = os.path.join(PACKAGE_DIR, "results")
+
+# Metrics where a lower value is better; everything else (ops_per_sec) is better when higher
+LOWER_IS_BETTER = ("_ms", "_seconds")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(latencies, elapsed=None, count=None):
+    """Throughput and latency percentiles (ms) of per-operation latencies in seconds."""
+    latencies = sorted(latencies)
+    count = count if count is not None else len(latencies)
+    elapsed = elapsed if elapsed is not None else sum(latencies)
+    return {
+        "count": count,
+        "ops_per_sec": round(count / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 0.50), 4),
+        "p99_ms": round(1000 * percentile(latencies, 0.99), 4)
+    }
+
+
+def measure_each(function, items, warmup=20):
+    """Calls function(item) for every item and summarizes the per-call latencies."""
+    for item in items[:warmup]:
+        function(item)
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        call_started = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def measure_batch(function, batch_size, repeat=5):
+    """Calls function() repeat times; each call handles batch_size items. Latencies are per item."""
+    function()
+    per_item = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        per_item.append((time.perf_counter() - started) / batch_size)
+    # Best run for the throughput, as usual for batch timings
+    result = summarize(per_item, min(per_item) * batch_size, batch_size)
+    result["repeat"] = repeat
+    return result
+
+
+def load_pipeline(mongo_latency_ms=0.0, s3_latency_ms=0.0, env=None, log_level="ERROR"):
+    """
+    Installs the fakes and prepares this interpreter for importing the pipeline modules:
+    the repository directory becomes the working directory (the modules open their JSON
+    files relative to it) and logging is configured before any module calls basicConfig.
+    """
+    from benchmarks import fakes
+
+    logging.basicConfig(level=getattr(logging, log_level), format="%(levelname)s %(name)s: %(message)s")
+    fakes.install(mongo_latency_ms, s3_latency_ms, env)
+    os.chdir(REPO_DIR)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+
+
+def seed_agencies(agencies):
+    """Stores generated agencies in the fake database the pipeline reads them from."""
+    import config
+    from benchmarks.fakes import FakeMongoClient
+
+    collection = FakeMongoClient(config.MONGO_URI)[config.MONGO_DB]["agencies"]
+    collection.delete_many({})
+    collection.insert_many([dict(agency) for agency in agencies])
+    return collection
+
+
+def git_commit():
+    """Short hash of HEAD, with -dirty when the working tree has uncommitted changes."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                check=True, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               check=True, capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def metadata(options):
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "options": options
+    }
+
+
+def save_results(results, options, path=None):
+    """Writes a result file (by default benchmarks/results/<commit>.json) and returns its path."""
+    document = {"meta": metadata(options), "results": results}
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{document['meta']['commit']}.json")
+    with open(path, "w") as result_file:
+        json.dump(document, result_file, indent=2, sort_keys=True)
+    return path
+
+
+def compare(base, head, threshold=10.0):
+    """
+    Compares two result documents.
+    :param threshold: Percent change counted as a regression or improvement.
+    :return: (rows, regressions); rows are (benchmark, metric, base, head, change percent, verdict).
+    """
+    rows, regressions = [], 0
+    for name in sorted(set(base["results"]) | set(head["results"])):
+        before, after = base["results"].get(name), head["results"].get(name)
+        if before is None or after is None:
+            rows.append((name, "-", before is not None, after is not None, None, "only in " + ("base" if after is None else "head")))
+            continue
+        for metric in ("ops_per_sec", "p50_ms", "p99_ms"):
+            if metric not in before or metric not in after:
+                continue
+            old, new = before[metric], after[metric]
+            change = 100.0 * (new - old) / old if old else 0.0
+            better = -change if metric.endswith(LOWER_IS_BETTER) else change
+            verdict = "regression" if better < -threshold else "improvement" if better > threshold else ""
+            regressions += verdict == "regression"
+            rows.append((name, metric, old, new, change, verdict))
+    return rows, regressions
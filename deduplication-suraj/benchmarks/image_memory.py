@@ -0,0 +1,121 @@
+"""
+Peak memory of the image path for one in-flight message, legacy vs streaming.
+
+Each mode runs in a fresh interpreter and goes from the raw AMQP body to an upload sink
+that consumes the stream the way s3transfer does for non-seekable files (8 MB reads).
+Reports tracemalloc peak and the growth of peak RSS while handling the message.
+
+    python -m benchmarks.image_memory --size-mb 4
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_stream import Base64StreamReader  # noqa: E402
+from incident_message import loads_incident  # noqa: E402
+
+UPLOAD_READ_SIZE = 8 * 1024 * 1024
+
+
+def make_body(size_mb):
+    image = os.urandom(int(size_mb * 1024 * 1024))
+    return json.dumps({"detected_objects": "pothole", "base64String": base64.b64encode(image).decode()}).encode()
+
+
+def upload_sink(fileobj):
+    total = 0
+    while True:
+        chunk = fileobj.read(UPLOAD_READ_SIZE)
+        if not chunk:
+            return total
+        total += len(chunk)
+
+
+def legacy_path(body):
+    base64_image = json.loads(body).get("base64String", "")
+    data_uri = f"data:image/jpeg;base64,{base64_image}"
+    image_bytes = base64.b64decode(data_uri.split(",")[1] if "," in data_uri else data_uri)
+    return upload_sink(io.BytesIO(image_bytes))
+
+
+def streaming_path(body):
+    base64_image = loads_incident(body).get("base64String", "")
+    return upload_sink(Base64StreamReader(base64_image))
+
+
+MODES = {"legacy": legacy_path, "streaming": streaming_path}
+
+
+def max_rss_bytes():
+    # ru_maxrss keeps the parent's peak across fork/exec on Linux, VmHWM belongs to this process only
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_mode(mode, body_path):
+    with open(body_path, "rb") as body_file:
+        body = body_file.read()
+    rss_before = max_rss_bytes()
+    tracemalloc.start()
+    uploaded = MODES[mode](body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "mode": mode,
+        "body_bytes": len(body),
+        "uploaded_bytes": uploaded,
+        "tracemalloc_peak_bytes": peak,
+        "rss_growth_bytes": max_rss_bytes() - rss_before
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=float, default=4.0, help="Decoded image size")
+    parser.add_argument("--mode", choices=sorted(MODES), help=argparse.SUPPRESS)
+    parser.add_argument("--body", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.body)))
+        return
+
+    # The body is built once here so the children's RSS baseline is just the received body
+    with tempfile.NamedTemporaryFile(suffix=".json") as body_file:
+        body_file.write(make_body(args.size_mb))
+        body_file.flush()
+        results = [
+            json.loads(subprocess.run(
+                [sys.executable, "-m", "benchmarks.image_memory", "--mode", mode, "--body", body_file.name],
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                check=True, capture_output=True, text=True
+            ).stdout)
+            for mode in MODES
+        ]
+
+    for result in results:
+        mode = result["mode"]
+        print(f"{mode:>9}: body {result['body_bytes'] / 2**20:6.1f} MiB | "
+              f"tracemalloc peak {result['tracemalloc_peak_bytes'] / 2**20:6.1f} MiB | "
+              f"RSS growth {result['rss_growth_bytes'] / 2**20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
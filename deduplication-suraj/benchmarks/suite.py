@@ -0,0 +1,324 @@
+"""
+Benchmark suite for the deduplication service, run against in-process fakes of Mongo,
+MinIO and RabbitMQ (see benchmarks.fakes), so no services are needed.
+
+    python -m benchmarks.suite run                       # all benchmarks -> benchmarks/results/<commit>.json
+    python -m benchmarks.suite run --only end_to_end --messages 5000 --env WRITE_BUFFER_ENABLED=true
+    python -m benchmarks.suite run --mongo-latency-ms 0.5 --s3-latency-ms 5
+    python -m benchmarks.suite compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+
+Each benchmark group runs in a fresh interpreter, because the pipeline modules keep their
+connections and indexes in module globals. Mongo-side work (query matching, document copies)
+is done by the fake in Python, so timings of Mongo-bound paths show the client-side cost plus
+the configured latency, not the cost on a real server.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import harness  # noqa: E402
+from benchmarks.generator import IncidentGenerator, make_agencies  # noqa: E402
+
+
+def _generator(options, **overrides):
+    settings = {
+        "seed": options["seed"],
+        "hotspots": options["hotspots"],
+        "radius_km": options["radius_km"],
+        "image_size": tuple(options["image_size"]),
+        "distinct_images": options["distinct_images"],
+        # Recent timestamps, so events fall inside the dedup window of the index warm-up
+        "start": datetime.utcnow() - timedelta(hours=1)
+    }
+    settings.update(overrides)
+    return IncidentGenerator(**settings)
+
+
+def _events(generator, count, incident_type_of):
+    """Parsed (incident_type, incident) pairs as the consumer hands them to the event handler."""
+    from Mongo_interaction import EventSearcher
+    from incident_message import parse_incident
+
+    events = []
+    while len(events) < count:
+        message = generator.incident()
+        detected_object, timestamp, location, _ = parse_incident(message)
+        incident_type = incident_type_of(detected_object)
+        if incident_type:
+            incident = {"userId": message["userId"], "timestamp": timestamp, "location": location,
+                        "incident_type": incident_type}
+            incident["incident_time"] = EventSearcher.parse_timestamp(timestamp)
+            events.append((incident_type, incident))
+    return events
+
+
+def bench_classifier(options):
+    from incident_classifier import IncidentClassifier, IncidentPrioritizer
+
+    generator = _generator(options, image_size=(8, 8), distinct_images=1)
+    cases = [(generator.incident()["detected_objects"].lower(), {"$date": "2025-03-07T10:00:00.000Z"})
+             for _ in range(options["count"])]
+    classifier = IncidentClassifier(IncidentPrioritizer("priority.json"))
+    prioritizer = IncidentPrioritizer("priority.json")
+    return {
+        "classifier.process_incidents": harness.measure_each(lambda case: classifier.process_incidents(*case), cases),
+        "classifier.classify_many": harness.measure_batch(lambda: classifier.classify_many(cases), len(cases)),
+        # Every label is new, so each one misses the exact table and the cache and is fuzzy-matched
+        "classifier.uncached_fuzzy_match": harness.measure_each(
+            prioritizer.preprocess_detected_objects, [f"potholes near {n}" for n in range(options["count"])], warmup=0
+        )
+    }
+
+
+def bench_dedup(options):
+    import config
+    from benchmarks.fakes import FakeMongoClient
+    from dedup_index import SpatioTemporalIndex
+    from incident_classifier import IncidentClassifier, IncidentPrioritizer
+    from Mongo_interaction import EventSearcher
+    from test_dedup3 import EventHandler
+
+    classifier = IncidentClassifier(IncidentPrioritizer("priority.json"))
+    generator = _generator(options, image_size=(8, 8), distinct_images=1)
+    incident_type_of = lambda label: classifier.process_incidents(label, {"$date": "2025-03-07T10:00:00.000Z"})
+
+    db = FakeMongoClient(config.MONGO_URI)["dedup_benchmark"]
+    db["events"].insert_many([
+        EventHandler._build_new_event(incident, incident_type, {"type": "benchmark"}, f"E-{number}")
+        for number, (incident_type, incident) in enumerate(_events(generator, options["events"], incident_type_of))
+    ])
+    queries = _events(generator, options["count"], incident_type_of)
+
+    results = {}
+    searcher = EventSearcher(db)
+    results["find_similar_event.mongo"] = harness.measure_each(
+        lambda query: searcher.find_similar_event(*query), queries[:max(50, options["count"] // 10)], warmup=5
+    )
+
+    index = SpatioTemporalIndex(EventSearcher.MAX_DISTANCE_METERS, EventSearcher.TIME_WINDOW)
+    indexed_searcher = EventSearcher(db, index=index, index_authoritative=True)
+    started = time.perf_counter()
+    indexed_searcher.warm_index()
+    results["dedup_index.warm"] = harness.summarize([time.perf_counter() - started], count=1)
+    results["find_similar_event.index"] = harness.measure_each(
+        lambda query: indexed_searcher.find_similar_event(*query), queries
+    )
+    results["find_similar_event.index"]["events"] = len(index)
+    return results
+
+
+def _allocation_events(options, types):
+    generator = _generator(options, image_size=(8, 8), distinct_images=1)
+    events = []
+    for number in range(options["count"]):
+        latitude, longitude = generator.location()
+        events.append({"detected_object": types[number % len(types)], "latitude": latitude, "longitude": longitude})
+    return events
+
+
+def bench_allocation(options):
+    from Agency_event_allocation_db_2 import AgencyFinder, ConfigLoader, EventProcessor, JurisdictionFinder, MongoDBClient
+    from allocation_cache import AllocationCache
+    import config
+
+    harness.seed_agencies(make_agencies(options["agencies"], seed=options["seed"], radius_km=options["radius_km"]))
+    db_client = MongoDBClient()
+    results = {}
+
+    jurisdiction_finder = JurisdictionFinder(db_client)
+    started = time.perf_counter()
+    jurisdiction_finder.refresh()
+    results["jurisdiction_registry.load"] = harness.summarize([time.perf_counter() - started], count=1)
+    non_critical = _allocation_events(options, ["Road Damage", "Obstruction on Roads", "Environmental Violation"])
+    results["find_jurisdiction"] = harness.measure_each(jurisdiction_finder.find_jurisdiction, non_critical)
+
+    agency_finder = AgencyFinder(db_client)
+    started = time.perf_counter()
+    agency_finder.refresh()
+    results["agency_index.load"] = harness.summarize([time.perf_counter() - started], count=1)
+    critical = _allocation_events(options, ["Human healthcare services"])
+    results["find_nearest_agencies"] = harness.measure_each(agency_finder.find_nearest_agencies, critical)
+    results["find_nearest_agencies_many"] = harness.measure_batch(
+        lambda: agency_finder.find_nearest_agencies_many(critical), len(critical)
+    )
+
+    mixed = [event for pair in zip(non_critical, critical) for event in pair]
+    config_loader = ConfigLoader(config_path="Incident_criticalness.json")
+    processor = EventProcessor(config_loader, agency_finder, jurisdiction_finder)
+    results["process_event"] = harness.measure_each(processor.process_event, mixed)
+    cache = AllocationCache(config.ALLOCATION_CACHE_TTL, config.ALLOCATION_CACHE_SIZE, config.ALLOCATION_CACHE_CELL_METERS)
+    cached_processor = EventProcessor(config_loader, agency_finder, jurisdiction_finder, cache)
+    results["process_event.cached"] = harness.measure_each(cached_processor.process_event, mixed)
+    results["process_event.cached"]["hit_rate"] = round(cache.stats()["hit_rate"], 3)
+    return results
+
+
+def bench_image(options):
+    from demo_objectstorage3 import MinIOStorage
+    from frame_filter import NearDuplicateFilter
+    from image_normalizer import normalize_image
+    from image_stream import decode_base64_image, hash_base64_image
+    from incident_message import loads_incident, parse_incident
+    import config
+
+    generator = _generator(options)
+    bodies = generator.bodies(max(20, options["count"] // 20))
+    parsed = [parse_incident(loads_incident(body)) for body in bodies]
+    images = [base64_image for _, _, _, base64_image in parsed]
+    storage = MinIOStorage(config.MINIO_ENDPOINT, config.MINIO_ACCESS_KEY, config.MINIO_SECRET_KEY,
+                           config.BUCKET_NAME, upload_workers=1)
+    near_duplicate_filter = NearDuplicateFilter()
+
+    results = {
+        "image.parse_message": harness.measure_each(lambda body: parse_incident(loads_incident(body)), bodies),
+        "image.upload": harness.measure_each(storage.upload_image, images),
+        "image.sha256": harness.measure_each(hash_base64_image, images),
+        "image.dhash": harness.measure_each(
+            lambda item: near_duplicate_filter.signature({"userId": "u"}, item[2], None, item[3]), parsed
+        ),
+        "image.normalize": harness.measure_each(
+            normalize_image, [decode_base64_image(image) for image in images[:20]], warmup=2
+        )
+    }
+    for result in results.values():
+        result["image_bytes"] = generator.image_bytes()
+    return results
+
+
+def bench_end_to_end(options):
+    """Runs test_consumer2.run_consumer() over generated messages on a fake channel."""
+    from benchmarks.fakes import FakeChannel, FakeMongoClient
+    import config
+
+    harness.seed_agencies(make_agencies(options["agencies"], seed=options["seed"], radius_km=options["radius_km"]))
+    bodies = _generator(options).bodies(options["messages"])
+
+    import test_consumer2
+    from app import get_app
+
+    channel = FakeChannel(bodies=bodies)
+    test_consumer2.connect_rabbitmq = lambda *args: (channel.basic_qos(prefetch_count=config.PREFETCH_COUNT), channel)[1]
+    started = time.perf_counter()
+    test_consumer2.run_consumer()
+    elapsed = time.perf_counter() - started
+    get_app().storage.shutdown()
+
+    result = harness.summarize(channel.latencies, elapsed, len(bodies))
+    db = FakeMongoClient(config.MONGO_URI)[config.MONGO_DB]
+    result.update({
+        "acked": channel.acked,
+        "nacked": channel.nacked,
+        "incidents": len(db[config.MONGO_COLLECTION]),
+        "events": len(db["events"]),
+        "mongo_calls": sum(db[name].calls for name in db.list_collection_names()),
+        "image_bytes": _generator(options, distinct_images=1).image_bytes()
+    })
+    return {"end_to_end": result}
+
+
+BENCHMARKS = {
+    "classifier": bench_classifier,
+    "dedup": bench_dedup,
+    "allocation": bench_allocation,
+    "image": bench_image,
+    "end_to_end": bench_end_to_end
+}
+
+
+def run_child(name, options, output_path):
+    """Runs one benchmark group in this (fresh) interpreter and writes its results as JSON."""
+    harness.load_pipeline(options["mongo_latency_ms"], options["s3_latency_ms"], options["env"], options["log_level"])
+    sys.stdout = open(os.devnull, "w")  # The pipeline prints per message; keep it off the terminal
+    results = BENCHMARKS[name](options)
+    with open(output_path, "w") as output:
+        json.dump(results, output)
+
+
+def run(options, only=None, output=None):
+    import subprocess
+
+    results = {}
+    for name in only or BENCHMARKS:
+        with tempfile.NamedTemporaryFile(suffix=".json") as output_file:
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.suite", "_child", name, json.dumps(options), output_file.name],
+                cwd=harness.REPO_DIR, check=True
+            )
+            with open(output_file.name) as result_file:
+                group = json.load(result_file)
+        for benchmark, result in group.items():
+            print(f"{benchmark:<32} {result['ops_per_sec']:>12.1f} ops/s   "
+                  f"p50 {result['p50_ms']:>9.3f} ms   p99 {result['p99_ms']:>9.3f} ms")
+        results.update(group)
+    path = harness.save_results(results, options, output)
+    print(f"Results written to {path}")
+    return results
+
+
+def print_comparison(base_path, head_path, threshold):
+    with open(base_path) as base_file, open(head_path) as head_file:
+        base, head = json.load(base_file), json.load(head_file)
+    print(f"base {base['meta']['commit']}  ->  head {head['meta']['commit']}  (threshold {threshold:.0f}%)")
+    rows, regressions = harness.compare(base, head, threshold)
+    for name, metric, old, new, change, verdict in rows:
+        if change is None:
+            print(f"{name:<32} {verdict}")
+        else:
+            print(f"{name:<32} {metric:<12} {old:>12.3f} {new:>12.3f} {change:>+8.1f}%  {verdict}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run benchmarks and store the results")
+    run_parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Benchmark groups to run")
+    run_parser.add_argument("--output", help="Result file (default: benchmarks/results/<commit>.json)")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--count", type=int, default=2000, help="Operations per microbenchmark")
+    run_parser.add_argument("--messages", type=int, default=2000, help="Messages in the end-to-end run")
+    run_parser.add_argument("--events", type=int, default=5000, help="Open events stored before dedup lookups")
+    run_parser.add_argument("--agencies", type=int, default=300)
+    run_parser.add_argument("--hotspots", type=int, default=50, help="Spatial density: incident clusters")
+    run_parser.add_argument("--radius-km", type=float, default=10.0, help="Radius of the covered area")
+    run_parser.add_argument("--image-size", type=int, nargs=2, default=[640, 480], metavar=("WIDTH", "HEIGHT"))
+    run_parser.add_argument("--distinct-images", type=int, default=32)
+    run_parser.add_argument("--mongo-latency-ms", type=float, default=0.0, help="Added to every fake Mongo call")
+    run_parser.add_argument("--s3-latency-ms", type=float, default=0.0, help="Added to every fake S3 upload")
+    run_parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                            help="config.py override for the benchmark processes, e.g. UPLOAD_WORKERS=0")
+    run_parser.add_argument("--log-level", default="ERROR")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="Percent change that is reported")
+    compare_parser.add_argument("--fail-on-regression", action="store_true", help="Exit with 1 on a regression")
+
+    child_parser = commands.add_parser("_child")
+    child_parser.add_argument("name")
+    child_parser.add_argument("options")
+    child_parser.add_argument("output")
+
+    args = parser.parse_args()
+    if args.command == "_child":
+        run_child(args.name, json.loads(args.options), args.output)
+    elif args.command == "compare":
+        regressions = print_comparison(args.base, args.head, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+    else:
+        options = {key: value for key, value in vars(args).items() if key not in ("command", "only", "output")}
+        options["env"] = dict(item.split("=", 1) for item in args.env)
+        run(options, args.only, args.output)
+
+
+if __name__ == "__main__":
+    main()
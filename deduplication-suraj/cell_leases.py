@@ -0,0 +1,75 @@
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from partitioning import cells_within
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class CellLeases:
+    """
+    Mongo leases on partition geocells, so partition workers cannot race on incidents near a
+    cell edge. An incident whose match radius overlaps several cells can match incidents routed
+    to other partitions; its worker leases every one of those cells (in sorted order, so workers
+    cannot deadlock) until its event is written. Two incidents within the match radius of each
+    other always share a leased cell, so the second one only looks for events once the first
+    one's event is in Mongo. Incidents inside one cell need no lease: their partition handles
+    them one at a time.
+    A lease is one document per (incident type, row, column); it expires after ttl_seconds so a
+    crashed worker cannot block a cell. Use one instance per worker: leases are reentrant per owner.
+    """
+
+    def __init__(self, collection, cell_km, radius_meters, ttl_seconds=30, poll_seconds=0.02):
+        """
+        :param collection: Leases collection shared by every partition worker.
+        :param cell_km: Partition geocell size (PARTITION_CELL_KM).
+        :param radius_meters: Match radius, padded to cover geodesic distances.
+        :param ttl_seconds: Lease lifetime, longer than a message takes to be deduplicated and written.
+        :param poll_seconds: Wait between attempts to take a lease held by another worker.
+        """
+        self.collection = collection
+        self.cell_km = cell_km
+        self.radius_meters = radius_meters
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+        self.owner = uuid.uuid4().hex
+
+    def cells(self, incident_type, latitude, longitude):
+        """Lease keys an incident needs: none inside a cell, every overlapped cell near an edge."""
+        cells = cells_within(latitude, longitude, self.radius_meters, self.cell_km)
+        if len(cells) == 1:
+            return []
+        return [f"{incident_type}|{row}|{column}" for row, column in cells]
+
+    def _try_acquire(self, key):
+        now = datetime.utcnow()
+        try:
+            # Matches a free (expired) or own lease; a lease held by another owner fails the upsert
+            self.collection.update_one(
+                {"_id": key, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def acquire(self, keys):
+        """Takes the leases on keys, waiting while other workers hold them."""
+        for key in sorted(keys):
+            waited = False
+            while not self._try_acquire(key):
+                waited = True
+                time.sleep(self.poll_seconds)
+            if waited:
+                logging.info(f"Waited for the dedup lease on {key}.")
+
+    def release(self, keys):
+        """Frees the leases on keys held by this owner."""
+        if keys:
+            self.collection.delete_many({"_id": {"$in": list(keys)}, "owner": self.owner})
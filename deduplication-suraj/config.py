@@ -16,4 +16,118 @@ BUCKET_NAME = os.getenv("BUCKET_NAME", "billion-eyes-images")
 # MongoDB Configuration
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongodb:27017") #mongodb://host.docker.internal:27017
 MONGO_DB = os.getenv("MONGO_DB", "BillionEyes_V1")
-MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "Incident") 
\ No newline at end of file
+MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "Incident") 
+
+# Consumer worker configuration
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", 1))
+CONSUMER_WORKER_MODE = os.getenv("CONSUMER_WORKER_MODE", "process")  # "process" or "thread"
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", 10))
+
+# Partitioned consumption: routers move messages from INPUT_QUEUE to PARTITIONS queues
+# ("<INPUT_QUEUE>.p<n>") by incident type and PARTITION_CELL_KM geocell (consistent hashing),
+# and each partition queue has exactly one active consumer, so similar incidents in the same cell
+# never race. Incidents on either side of a cell edge go to different partitions: they are
+# deduplicated through the Mongo lookup (DEDUP_INDEX_AUTHORITATIVE is off), serialized by leases
+# on the cells near the edge (DEDUP_LEASE_COLLECTION, expiring after DEDUP_LEASE_TTL_SECONDS).
+PARTITIONED_CONSUMERS = os.getenv("PARTITIONED_CONSUMERS", "false").lower() == "true"
+PARTITIONS = int(os.getenv("PARTITIONS", CONSUMER_WORKERS))
+PARTITION_CELL_KM = float(os.getenv("PARTITION_CELL_KM", 5.0))
+PARTITION_VIRTUAL_NODES = int(os.getenv("PARTITION_VIRTUAL_NODES", 64))
+ROUTER_WORKERS = int(os.getenv("ROUTER_WORKERS", 1))
+DEDUP_LEASE_COLLECTION = os.getenv("DEDUP_LEASE_COLLECTION", "dedup_leases")
+DEDUP_LEASE_TTL_SECONDS = float(os.getenv("DEDUP_LEASE_TTL_SECONDS", 30))
+
+# Asyncio consumer configuration
+ASYNC_MAX_IN_FLIGHT = int(os.getenv("ASYNC_MAX_IN_FLIGHT", 200))
+
+# Write-behind Mongo buffer (acks are sent after the batch is flushed,
+# so keep PREFETCH_COUNT >= WRITE_BATCH_SIZE)
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "false").lower() == "true"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", 1.0))
+
+# Dedup rule: an incident joins an open event of the same type whose most recent incident
+# is at most DEDUP_WINDOW_MINUTES and DEDUP_MAX_DISTANCE_METERS away
+DEDUP_WINDOW_MINUTES = float(os.getenv("DEDUP_WINDOW_MINUTES", 120))
+DEDUP_MAX_DISTANCE_METERS = float(os.getenv("DEDUP_MAX_DISTANCE_METERS", 200))
+
+# Event incident storage: an event keeps its EVENT_INLINE_INCIDENTS most recent incidents inline,
+# and every incident is appended to buckets of INCIDENT_BUCKET_SIZE in INCIDENT_BUCKET_COLLECTION
+EVENT_INLINE_INCIDENTS = int(os.getenv("EVENT_INLINE_INCIDENTS", 20))
+INCIDENT_BUCKET_SIZE = int(os.getenv("INCIDENT_BUCKET_SIZE", 100))
+INCIDENT_BUCKET_COLLECTION = os.getenv("INCIDENT_BUCKET_COLLECTION", "event_incidents")
+
+# In-memory dedup index. Misses are only trusted without asking Mongo when this process
+# sees every incident it could be deduplicated against (a single, unpartitioned consumer by default;
+# a partition does not see the incidents across its cell edges).
+DEDUP_INDEX_ENABLED = os.getenv("DEDUP_INDEX_ENABLED", "true").lower() == "true"
+DEDUP_INDEX_MAX_EVENTS = int(os.getenv("DEDUP_INDEX_MAX_EVENTS", 50000))
+DEDUP_INDEX_AUTHORITATIVE = os.getenv(
+    "DEDUP_INDEX_AUTHORITATIVE", "true" if CONSUMER_WORKERS <= 1 and not PARTITIONED_CONSUMERS else "false"
+).lower() == "true"
+
+# Agency lookups: in-process indexes are rebuilt after this many seconds,
+# or immediately on change stream events when MongoDB runs as a replica set
+AGENCY_INDEX_TTL = int(os.getenv("AGENCY_INDEX_TTL", 300))
+AGENCY_CHANGE_STREAM_ENABLED = os.getenv("AGENCY_CHANGE_STREAM_ENABLED", "true").lower() == "true"
+
+# Reference data (priority.json, Incident_criticalness.json, incident_codes.json) is rebuilt in the
+# background when a file's mtime changes, checked every REFERENCE_POLL_SECONDS; agencies are rebuilt
+# on change stream events and, even with a change stream, every AGENCY_INDEX_TTL seconds
+REFERENCE_POLL_SECONDS = float(os.getenv("REFERENCE_POLL_SECONDS", 5))
+
+# Allocation cache: new events of the same detected object in the same ALLOCATION_CACHE_CELL_METERS
+# grid cell reuse an earlier allocation for up to ALLOCATION_CACHE_TTL seconds (cleared on agency changes)
+ALLOCATION_CACHE_ENABLED = os.getenv("ALLOCATION_CACHE_ENABLED", "false").lower() == "true"
+ALLOCATION_CACHE_TTL = int(os.getenv("ALLOCATION_CACHE_TTL", AGENCY_INDEX_TTL))
+ALLOCATION_CACHE_SIZE = int(os.getenv("ALLOCATION_CACHE_SIZE", 10000))
+ALLOCATION_CACHE_CELL_METERS = float(os.getenv("ALLOCATION_CACHE_CELL_METERS", 250))
+
+# ID sequences: "mongo" (atomic counters, safe with many consumers) or "file" (legacy JSON trackers)
+SEQUENCE_BACKEND = os.getenv("SEQUENCE_BACKEND", "mongo")
+SEQUENCE_COLLECTION = os.getenv("SEQUENCE_COLLECTION", "counters")
+SEQUENCE_BLOCK_SIZE = int(os.getenv("SEQUENCE_BLOCK_SIZE", 50))
+
+# Detected-label normalization: optional {label: priority term} alias file and fuzzy-match cache size
+TERM_ALIASES_PATH = os.getenv("TERM_ALIASES_PATH", "")
+TERM_CACHE_SIZE = int(os.getenv("TERM_CACHE_SIZE", 4096))
+
+# MinIO uploads: size of the upload thread pool (and of the pooled keep-alive S3 connections).
+# With UPLOAD_WORKERS > 0 the consumer overlaps uploads with the next messages; 0 uploads inline.
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 8))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", 5))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", 30))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 3))
+
+# Content-addressed images: identical image bytes are uploaded once and later incidents
+# reuse the stored URL (SHA-256 index in a local LRU and the IMAGE_HASH_COLLECTION)
+CONTENT_ADDRESSED_IMAGES = os.getenv("CONTENT_ADDRESSED_IMAGES", "false").lower() == "true"
+IMAGE_HASH_COLLECTION = os.getenv("IMAGE_HASH_COLLECTION", "image_hashes")
+IMAGE_HASH_CACHE_SIZE = int(os.getenv("IMAGE_HASH_CACHE_SIZE", 10000))
+
+# Near-duplicate frames: a frame whose perceptual hash is within NEAR_DUPLICATE_MAX_DISTANCE bits
+# of a recent frame from the same source and area is attached to that frame's event as a
+# reference (duplicate_frames) and skips classification, upload, insert and deduplication
+NEAR_DUPLICATE_FILTER_ENABLED = os.getenv("NEAR_DUPLICATE_FILTER_ENABLED", "false").lower() == "true"
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", 6))
+NEAR_DUPLICATE_WINDOW_SECONDS = int(os.getenv("NEAR_DUPLICATE_WINDOW_SECONDS", 120))
+NEAR_DUPLICATE_CELL_METERS = float(os.getenv("NEAR_DUPLICATE_CELL_METERS", 100))
+DUPLICATE_FRAMES_KEPT = int(os.getenv("DUPLICATE_FRAMES_KEPT", 100))
+
+# Image normalization before upload (process pool): images are downscaled to IMAGE_MAX_DIMENSION,
+# re-encoded as JPEG, and a "<name>-thumb.jpg" thumbnail is stored next to each image
+IMAGE_NORMALIZE_ENABLED = os.getenv("IMAGE_NORMALIZE_ENABLED", "false").lower() == "true"
+IMAGE_NORMALIZE_WORKERS = int(os.getenv("IMAGE_NORMALIZE_WORKERS", 2))
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 1920))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 85))
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 320))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 70))
+
+# Metrics endpoint (Prometheus text format on /metrics); process-mode workers use METRICS_PORT + worker id
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+
+# Startup: pipeline modules build their connections and indexes lazily; Application.warm_up()
+# builds them before consuming and logs a warning when that takes over STARTUP_BUDGET_SECONDS
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", 5))
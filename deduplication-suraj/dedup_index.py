@@ -0,0 +1,193 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from geo_distance import EARTH_RADIUS_METERS, HAVERSINE_MAX_RELATIVE_ERROR, is_within
+
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_METERS / 180
+
+
+class _IndexEntry:
+    __slots__ = ("event_id", "incident_type", "cell", "last_time", "latitude", "longitude", "seq")
+
+    def __init__(self, event_id, incident_type, cell, last_time, latitude, longitude, seq):
+        self.event_id = event_id
+        self.incident_type = incident_type
+        self.cell = cell
+        self.last_time = last_time
+        self.latitude = latitude
+        self.longitude = longitude
+        self.seq = seq
+
+
+class SpatioTemporalIndex:
+    """
+    In-process index of recently active events, keyed by (incident type, grid cell).
+    Each event is stored once, at the location and time of its most recent incident.
+    Entries leave the index once that incident is older than the sliding window,
+    measured against the newest incident time seen (so replays of old data work too).
+    Cells are at least max_distance wide, so a lookup only checks the 3x3 cells around a point.
+    """
+
+    def __init__(self, max_distance_meters=200, window=timedelta(hours=2), max_events=50000,
+                 closed_check_interval=30.0):
+        """
+        :param max_distance_meters: Distance threshold of the dedup rule (also the cell size).
+        :param window: Time threshold of the dedup rule (also the eviction window).
+        :param max_events: Memory cap; the least recently updated events are evicted beyond it.
+        :param closed_check_interval: Seconds between checks for events closed outside this process.
+        """
+        self.max_distance_meters = max_distance_meters
+        self.window = window
+        self.max_events = max_events
+        self.closed_check_interval = closed_check_interval
+        # Padded by the haversine error so points within the geodesic threshold are never two cells apart
+        self.cell_degrees = max_distance_meters * (1 + HAVERSINE_MAX_RELATIVE_ERROR) / METERS_PER_DEGREE
+        self._cells = {}  # (incident_type, row, col) -> {event_id: entry}
+        self._events = OrderedDict()  # event_id -> entry, least recently updated first
+        self._watermark = None  # Newest incident time seen
+        self._lossy_until = None  # Misses are not conclusive until the watermark passes this time
+        self._warm = False
+        self._seq = 0
+        self._last_closed_check = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._events)
+
+    def _row(self, latitude):
+        return math.floor((latitude + 90) / self.cell_degrees)
+
+    def _col(self, row, longitude):
+        # Column width grows with latitude so every cell is at least cell_degrees tall and wide in meters
+        row_latitude = min(89.0, abs(row * self.cell_degrees - 90) + 2 * self.cell_degrees)
+        return math.floor((longitude + 180) * math.cos(math.radians(row_latitude)) / self.cell_degrees)
+
+    def _cell(self, incident_type, latitude, longitude):
+        row = self._row(latitude)
+        return (incident_type, row, self._col(row, longitude))
+
+    def _remove(self, entry):
+        self._events.pop(entry.event_id, None)
+        bucket = self._cells.get(entry.cell)
+        if bucket is not None:
+            bucket.pop(entry.event_id, None)
+            if not bucket:
+                del self._cells[entry.cell]
+
+    def _evict(self):
+        """Drops expired entries and enforces the memory cap."""
+        if self._watermark is not None:
+            horizon = self._watermark - self.window
+            while self._events:
+                entry = next(iter(self._events.values()))
+                if entry.last_time >= horizon:
+                    break
+                self._remove(entry)
+
+        while len(self._events) > self.max_events:
+            entry = next(iter(self._events.values()))
+            self._remove(entry)
+            # The evicted event could still have matched, so misses stay inconclusive for a while
+            lossy_until = entry.last_time + self.window
+            if self._lossy_until is None or lossy_until > self._lossy_until:
+                self._lossy_until = lossy_until
+
+    def add(self, event_id, incident_type, incident_time, latitude, longitude):
+        """Records the latest incident of an event (newer than the stored one, otherwise ignored)."""
+        if incident_time is None:
+            return
+        with self._lock:
+            entry = self._events.get(event_id)
+            if entry is not None:
+                if incident_time < entry.last_time:
+                    return
+                self._remove(entry)
+                seq = entry.seq
+            else:
+                self._seq += 1
+                seq = self._seq
+
+            cell = self._cell(incident_type, latitude, longitude)
+            entry = _IndexEntry(event_id, incident_type, cell, incident_time, latitude, longitude, seq)
+            self._cells.setdefault(cell, {})[event_id] = entry
+            self._events[event_id] = entry
+
+            if self._watermark is None or incident_time > self._watermark:
+                self._watermark = incident_time
+            self._evict()
+
+    def discard(self, event_id):
+        """Removes an event, e.g. after it was closed."""
+        with self._lock:
+            entry = self._events.get(event_id)
+            if entry is not None:
+                self._remove(entry)
+
+    def find(self, incident_type, incident_time, latitude, longitude):
+        """
+        Returns the ID of the earliest indexed event whose most recent incident is within
+        the time window and distance threshold of the given incident, or None.
+        """
+        with self._lock:
+            row = self._row(latitude)
+            best = None
+            for r in (row - 1, row, row + 1):
+                col = self._col(r, longitude)
+                for c in (col - 1, col, col + 1):
+                    for entry in self._cells.get((incident_type, r, c), {}).values():
+                        if abs(incident_time - entry.last_time) > self.window:
+                            continue
+                        if not is_within((latitude, longitude), (entry.latitude, entry.longitude), self.max_distance_meters):
+                            continue
+                        if best is None or entry.seq < best.seq:
+                            best = entry
+            return best.event_id if best is not None else None
+
+    def is_conclusive(self, incident_time):
+        """True if a miss means no similar open event exists (index warm and nothing relevant evicted)."""
+        with self._lock:
+            if not self._warm:
+                return False
+            return self._lossy_until is None or incident_time > self._lossy_until
+
+    def rebuild(self, events_collection, extract_coordinates, now=None):
+        """
+        Loads every open event whose last incident is inside the window from Mongo.
+        :param extract_coordinates: Function returning (latitude, longitude) of a location.
+        """
+        now = now or datetime.utcnow()
+        cursor = events_collection.find(
+            {"status": {"$ne": "closed"}, "last_incident_time": {"$gte": now - self.window}},
+            {"incident_type": 1, "last_incident_time": 1, "last_location": 1}
+        ).sort("last_incident_time", 1)  # Oldest first, so eviction order follows incident time
+        with self._lock:
+            self._cells, self._events = {}, OrderedDict()
+            self._watermark, self._lossy_until, self._warm = now, None, False
+
+        loaded = 0
+        for event in cursor:
+            if not event.get("last_location"):
+                continue
+            latitude, longitude = extract_coordinates(event["last_location"])
+            self.add(event["_id"], event.get("incident_type"), event["last_incident_time"], latitude, longitude)
+            loaded += 1
+
+        with self._lock:
+            self._warm = True
+        logging.info(f"Dedup index rebuilt with {loaded} active events.")
+
+    def closed_check_due(self):
+        """True every closed_check_interval seconds; the caller then re-checks which indexed events were closed."""
+        if time.monotonic() - self._last_closed_check < self.closed_check_interval:
+            return False
+        self._last_closed_check = time.monotonic()
+        return True
+
+    def event_ids(self):
+        """IDs of all indexed events."""
+        with self._lock:
+            return list(self._events.keys())
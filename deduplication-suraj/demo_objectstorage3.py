@@ -1,13 +1,15 @@
-import boto3
 import base64
 import io
-import re
 import datetime
-import uuid
-import json
-import os
-import datetime # Changed import
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from image_normalizer import thumbnail_key
+from image_stream import Base64StreamReader, decode_base64_image, hash_base64_image
+from app import get_app
 import config  # Import configuration file
+import metrics
 
 # MinIO Configuration
 MINIO_URL = config.MINIO_ENDPOINT  # Example: "http://192.168.1.116:9000"
@@ -15,41 +17,19 @@ ACCESS_KEY = config.MINIO_ACCESS_KEY
 SECRET_KEY = config.MINIO_SECRET_KEY
 BUCKET_NAME = config.BUCKET_NAME
 
-# Sequence tracker file for persistent storage
-SEQUENCE_TRACKER_FILE = "incident_sequence_tracker.json"
-
 class FilenameGenerator:
     """Handles structured file naming logic."""
-    
-    @staticmethod
-    def load_sequence_tracker():
-        """Loads the sequence tracker from a file."""
-        if os.path.exists(SEQUENCE_TRACKER_FILE):
-            with open(SEQUENCE_TRACKER_FILE, "r") as file:
-                return json.load(file)
-        return {}
 
-    @staticmethod
-    def save_sequence_tracker(tracker):
-        """Saves the sequence tracker to a file."""
-        with open(SEQUENCE_TRACKER_FILE, "w") as file:
-            json.dump(tracker, file)
+    @classmethod
+    def get_sequence_allocator(cls):
+        """Returns the application's shared incident sequence allocator."""
+        return get_app().incident_sequence
 
     @staticmethod
     def generate_incident_id(self):
         """Generates a sequential incident ID in the format I-YYYYMMDD-SEQ."""
         date_part = datetime.datetime.now(datetime.UTC).strftime("%Y%m%d")  # YYYYMMDD
-        sequence_tracker = FilenameGenerator.load_sequence_tracker()
-
-        # Increment sequence or reset if a new day
-        if date_part not in sequence_tracker:
-            sequence_tracker[date_part] = 1
-        else:
-            sequence_tracker[date_part] += 1
-        
-        seq_number = sequence_tracker[date_part]
-        FilenameGenerator.save_sequence_tracker(sequence_tracker)  # Save the updated sequence
-        
+        seq_number = FilenameGenerator.get_sequence_allocator().next(date_part)  # Sequence resets every day
         return f"I-{date_part}-{seq_number:03d}"
     
     @staticmethod
@@ -66,18 +46,105 @@ class FilenameGenerator:
         # next_index = max(existing_indexes, default=0) + 1
         return f"{prefix}.jpg"
 
+class UploadStats:
+    """Thread-safe upload counters, queue depth and latency percentiles over the last uploads."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.reused = 0
+        self.in_progress = 0
+
+    def on_submit(self):
+        with self._lock:
+            self.submitted += 1
+
+    def on_start(self):
+        with self._lock:
+            self.in_progress += 1
+
+    def on_finish(self, seconds, success, reused=False):
+        with self._lock:
+            self.in_progress -= 1
+            self.completed += 1
+            if not success:
+                self.failed += 1
+            if reused:
+                self.reused += 1
+            self._latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            queued = self.submitted - self.completed - self.in_progress
+
+            def percentile(q):
+                return 1000 * latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "reused": self.reused,
+                "in_progress": self.in_progress,
+                "queue_depth": queued,
+                "latency_p50_ms": percentile(0.50),
+                "latency_p99_ms": percentile(0.99)
+            }
+
+
 class MinIOStorage:
-    """Handles MinIO operations: upload and retrieve URLs."""
+    """
+    Handles MinIO operations: upload and retrieve URLs.
+    Uploads can run on a dedicated thread pool (upload_image_async); the S3 client keeps
+    one pooled keep-alive connection per upload worker.
+    With a hash index (content-addressed mode) identical image bytes are stored once and
+    later uploads return the URL of the existing object.
+    With a normalizer, images are downscaled/re-encoded in its process pool before upload and
+    a thumbnail is stored next to each image (see image_normalizer.thumbnail_key).
+    """
     
-    def __init__(self, endpoint_url, access_key, secret_key, bucket_name):
+    def __init__(self, endpoint_url, access_key, secret_key, bucket_name, upload_workers=None, hash_index=None,
+                 normalizer=None):
+        """
+        :param upload_workers: Size of the upload thread pool and of the S3 connection pool
+                               (defaults to config.UPLOAD_WORKERS).
+        :param hash_index: Optional ImageHashIndex enabling content-addressed uploads.
+        :param normalizer: Optional ImageNormalizer applied before upload.
+        """
+        # boto3 takes a noticeable part of startup, so it is only imported with the first storage
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.upload_workers = max(1, upload_workers if upload_workers is not None else config.UPLOAD_WORKERS)
         self.s3_client = boto3.client(
             's3',
             endpoint_url=endpoint_url,
             aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key
+            aws_secret_access_key=secret_key,
+            config=Config(
+                max_pool_connections=self.upload_workers,
+                tcp_keepalive=True,
+                connect_timeout=config.S3_CONNECT_TIMEOUT,
+                read_timeout=config.S3_READ_TIMEOUT,
+                retries={"max_attempts": config.S3_MAX_ATTEMPTS, "mode": "standard"}
+            )
         )
+        # Each upload runs on the calling (pool) thread instead of spawning transfer threads
+        self.transfer_config = TransferConfig(use_threads=False)
         self.bucket_name = bucket_name
         self.endpoint_url = endpoint_url
+        self.hash_index = hash_index
+        self.normalizer = normalizer
+        self.stats = UploadStats()
+        metrics.QUEUE_DEPTH.set_function(lambda: self.stats.snapshot()["queue_depth"], queue="uploads_queued", worker="all")
+        metrics.QUEUE_DEPTH.set_function(lambda: self.stats.snapshot()["in_progress"], queue="uploads_running", worker="all")
+        self._executor = None
+        self._executor_lock = threading.Lock()
 
     def get_existing_files(self, prefix):
         """Lists existing objects in a given prefix for filename generation."""
@@ -87,33 +154,89 @@ class MinIOStorage:
         except Exception as e:
             print(f"⚠️ [ERROR] Could not fetch existing files: {e}")
             return []
-    
-    def upload_image(self, base64_image):
-        """Uploads a Base64 image to MinIO and returns the URL."""
-        incident_id = FilenameGenerator.generate_incident_id(self)
-        existing_files = self.get_existing_files(f"{datetime.datetime.now(datetime.UTC).year}/{incident_id}/")
-        filename = FilenameGenerator.generate(incident_id, existing_files)
-        
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.upload_workers, thread_name_prefix="minio-upload")
+            return self._executor
+
+    @metrics.timed("upload")
+    def _upload(self, base64_image):
+        """Uploads one image under the next incident filename and returns its URL, or None on failure."""
+        self.stats.on_start()
+        started = time.perf_counter()
         try:
-            image_bytes = base64.b64decode(base64_image.split(",")[1] if "," in base64_image else base64_image)
-            image_buffer = io.BytesIO(image_bytes)
+            if self.hash_index is not None:
+                with metrics.timed("image_hash"):
+                    digest, size = hash_base64_image(base64_image)
+                    image_url = self.hash_index.lookup(digest)
+                if image_url is not None:
+                    print(f"✅ Identical image already stored: {image_url}")
+                    self.stats.on_finish(time.perf_counter() - started, True, reused=True)
+                    return image_url
+
+            filename = self._next_filename()
+            if self.normalizer is not None:
+                # Resized in the normalizer's processes; only this upload thread waits for it
+                with metrics.timed("image_normalize"):
+                    image_bytes, thumbnail_bytes = self.normalizer.normalize(decode_base64_image(base64_image))
+                self._put(thumbnail_key(filename), io.BytesIO(thumbnail_bytes))
+                image_stream = io.BytesIO(image_bytes)
+            else:
+                # Decoded chunk by chunk straight into the upload, without copying the payload
+                image_stream = Base64StreamReader(base64_image)
             
-            self.s3_client.upload_fileobj(
-                image_buffer,
-                self.bucket_name,
-                filename,
-                ExtraArgs={'ContentType': 'image/jpeg'}
-            )
+            self._put(filename, image_stream)
             
             image_url = f"{self.endpoint_url}/{BUCKET_NAME}/{filename}"
             print(f"✅ Image uploaded successfully: {image_url}")
+            if self.hash_index is not None:
+                image_url = self.hash_index.register(digest, image_url, size)
+            self.stats.on_finish(time.perf_counter() - started, True)
             return image_url
         except Exception as e:
             print(f"⚠️ [ERROR] Failed to upload image to MinIO: {e}")
+            self.stats.on_finish(time.perf_counter() - started, False)
             return None
 
-# Initialize MinIO Client
-minio_storage = MinIOStorage(MINIO_URL, ACCESS_KEY, SECRET_KEY, BUCKET_NAME)
+    def _put(self, key, fileobj):
+        self.s3_client.upload_fileobj(
+            fileobj,
+            self.bucket_name,
+            key,
+            ExtraArgs={'ContentType': 'image/jpeg'},
+            Config=self.transfer_config
+        )
+
+    def _next_filename(self):
+        # Names come from the incident sequence, so no listing of existing objects is needed
+        incident_id = FilenameGenerator.generate_incident_id(self)
+        return FilenameGenerator.generate(incident_id, [])
+    
+    def upload_image(self, base64_image):
+        """Uploads a Base64 image (optionally a data URI) to MinIO and returns the URL."""
+        self.stats.on_submit()
+        return self._upload(base64_image)
+
+    def upload_image_async(self, base64_image):
+        """
+        Queues the upload on the upload pool.
+        :return: Future resolving to the image URL, or None if the upload failed.
+        """
+        self.stats.on_submit()
+        return self._get_executor().submit(self._upload, base64_image)
+
+    def upload_stats(self):
+        """Upload counts, queue depth and p50/p99 latency of the recent uploads."""
+        return self.stats.snapshot()
+
+    def shutdown(self, wait=True):
+        """Stops the upload pool, by default after the queued uploads finished."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
 
 def process_image(incident):
     """
@@ -127,13 +250,28 @@ def process_image(incident):
         print("❌ [ERROR] Missing required fields in incident data.")
         return None
     
-    result = minio_storage.upload_image(base64_img)
+    result = get_app().storage.upload_image(base64_img)
     if result:
         print("✅ Image processing completed successfully.")
     else:
         print("❌ Image processing failed.")
     return result
 
+def process_image_async(incident):
+    """
+    Like process_image, but queues the upload on the upload pool.
+    Returns a future resolving to the uploaded image URL (or None).
+    """
+    base64_img = incident.get("base64_img")
+    
+    if not base64_img:
+        print("❌ [ERROR] Missing required fields in incident data.")
+        future = Future()
+        future.set_result(None)
+        return future
+    
+    return get_app().storage.upload_image_async(base64_img)
+
 
 # === TESTING THE CODE ===
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+import logging
+import math
+import threading
+from collections import deque, namedtuple
+from datetime import timedelta
+
+from image_stream import Base64StreamReader
+
+METERS_PER_DEGREE = 111320
+
+FrameSignature = namedtuple("FrameSignature", ["source", "latitude", "longitude", "frame_time", "frame_hash"])
+
+
+def dhash(image_file, hash_size=8):
+    """
+    Difference hash of an image: one bit per horizontally adjacent pixel pair of a
+    (hash_size + 1) x hash_size grayscale thumbnail. JPEGs are decoded in draft mode at
+    a reduced scale, so hashing costs a fraction of a full decode.
+    :param image_file: File-like object with the encoded image.
+    :return: hash_size * hash_size bit integer.
+    """
+    from PIL import Image  # Imported with the first frame, not at startup
+    with Image.open(image_file) as image:
+        image.draft("L", (4 * hash_size, 4 * hash_size))
+        thumbnail = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = thumbnail.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(offset, offset + hash_size):
+            value = (value << 1) | (pixels[column] > pixels[column + 1])
+    return value
+
+
+def hamming_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count("1")
+
+
+class NearDuplicateFilter:
+    """
+    Sliding window of recent frame hashes per source (userId/camera) and grid cell.
+    A frame whose perceptual hash is within max_distance bits of a recent frame of the same
+    source in the same or a neighbouring cell is a near-duplicate of that frame's event.
+    Frames are matched on their own timestamps, so out-of-order delivery is handled.
+    """
+
+    def __init__(self, max_distance=6, window=timedelta(minutes=2), cell_meters=100, max_frames_per_cell=16):
+        """
+        :param max_distance: Maximum Hamming distance (of 64 bits) for a near-duplicate.
+        :param window: How far apart in time two frames may be.
+        :param cell_meters: Grid cell size; frames are compared with the 3x3 cells around them.
+        :param max_frames_per_cell: Recent frames kept per source and cell.
+        """
+        self.max_distance = max_distance
+        self.window = window
+        self.cell_degrees = cell_meters / METERS_PER_DEGREE
+        self.max_frames_per_cell = max_frames_per_cell
+        self._frames = {}  # (source, row, column) -> deque of (frame_time, frame_hash, event_ref)
+        self._latest_time = None
+        self._adds_since_prune = 0
+        self._lock = threading.Lock()
+
+    def signature(self, incident, location, frame_time, base64_image):
+        """
+        Hashes a frame. Returns None if the image cannot be decoded, in which case the
+        frame simply goes through the full pipeline.
+        """
+        try:
+            frame_hash = dhash(Base64StreamReader(base64_image))
+        except Exception as e:
+            logging.warning(f"Could not hash frame for near-duplicate check: {e}")
+            return None
+        longitude, latitude = location["coordinates"]
+        source = incident.get("userId") or incident.get("camera_id") or "unknown"
+        return FrameSignature(str(source), latitude, longitude, frame_time, frame_hash)
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    def find(self, signature):
+        """Returns the event reference of a recent near-identical frame, or None."""
+        row, column = self._cell(signature.latitude, signature.longitude)
+        best_ref, best_distance = None, self.max_distance + 1
+        with self._lock:
+            for d_row in (-1, 0, 1):
+                for d_column in (-1, 0, 1):
+                    frames = self._frames.get((signature.source, row + d_row, column + d_column))
+                    if not frames:
+                        continue
+                    for frame_time, frame_hash, event_ref in frames:
+                        if abs(frame_time - signature.frame_time) > self.window:
+                            continue
+                        distance = hamming_distance(frame_hash, signature.frame_hash)
+                        if distance < best_distance:
+                            best_ref, best_distance = event_ref, distance
+        return best_ref
+
+    def add(self, signature, event_ref):
+        """Remembers a fully processed frame and the event it was stored in."""
+        key = (signature.source,) + self._cell(signature.latitude, signature.longitude)
+        with self._lock:
+            frames = self._frames.get(key)
+            if frames is None:
+                frames = self._frames[key] = deque(maxlen=self.max_frames_per_cell)
+            frames.append((signature.frame_time, signature.frame_hash, event_ref))
+            if self._latest_time is None or signature.frame_time > self._latest_time:
+                self._latest_time = signature.frame_time
+            self._adds_since_prune += 1
+            if self._adds_since_prune >= 1000:
+                self._prune()
+
+    def _prune(self):
+        """Drops cells whose newest frame left the window (caller holds the lock)."""
+        self._adds_since_prune = 0
+        cutoff = self._latest_time - self.window
+        for key in [key for key, frames in self._frames.items() if max(f[0] for f in frames) < cutoff]:
+            del self._frames[key]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(frames) for frames in self._frames.values())
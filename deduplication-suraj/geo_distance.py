@@ -0,0 +1,103 @@
+"""
+Shared distance kernel for deduplication and agency allocation.
+
+Points are (latitude, longitude) tuples in degrees, the same convention as geopy.
+
+Distances are computed with the haversine formula on a sphere of mean Earth radius.
+Against the WGS-84 geodesic (geopy.distance.geodesic) its relative error is below 0.57%
+everywhere (about 1.1 m at 200 m, 0.3 m at 50 m). Threshold checks only call geodesic for
+points whose haversine distance falls inside that error band around the threshold, so the
+result is always the same as an exact geodesic comparison.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371008.8
+
+# Upper bound of |haversine - geodesic| / geodesic on the WGS-84 ellipsoid
+HAVERSINE_MAX_RELATIVE_ERROR = 0.0057
+
+
+def point_distance_meters(point1, point2):
+    """Haversine distance in meters between two (lat, lon) points, without NumPy overhead."""
+    phi1, phi2 = math.radians(point1[0]), math.radians(point2[0])
+    dphi = phi2 - phi1
+    dlambda = math.radians(point2[1] - point1[1])
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distances_meters(point, points):
+    """
+    Haversine distances in meters from one (lat, lon) point to many, in a single NumPy batch.
+    :param points: Sequence or (n, 2) array of (lat, lon) pairs.
+    :return: Array of n distances.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    phi1 = math.radians(point[0])
+    phi2 = np.radians(points[:, 0])
+    dphi = phi2 - phi1
+    dlambda = np.radians(points[:, 1] - point[1])
+    a = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def _exact_band(threshold_meters):
+    return (threshold_meters * (1 - HAVERSINE_MAX_RELATIVE_ERROR),
+            threshold_meters * (1 + HAVERSINE_MAX_RELATIVE_ERROR))
+
+
+def geodesic_meters(point1, point2):
+    """WGS-84 geodesic distance in meters. geopy is imported on the first exact comparison only."""
+    from geopy.distance import geodesic
+    return geodesic(point1, point2).meters
+
+
+def is_within(point1, point2, threshold_meters, distance=None):
+    """
+    True if two points are at most threshold_meters apart (geodesic), using haversine when unambiguous.
+    :param distance: Haversine distance of the points when the caller already computed it.
+    """
+    if distance is None:
+        distance = point_distance_meters(point1, point2)
+    lower, upper = _exact_band(threshold_meters)
+    if distance < lower:
+        return True
+    if distance > upper:
+        return False
+    return geodesic_meters(point1, point2) <= threshold_meters
+
+
+def within_distance(point, points, threshold_meters):
+    """
+    Vectorized threshold check of one point against many.
+    :return: Boolean array, True where the geodesic distance is at most threshold_meters.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    distances = distances_meters(point, points)
+    lower, upper = _exact_band(threshold_meters)
+    result = distances < lower
+    for i in np.flatnonzero((distances >= lower) & (distances <= upper)):
+        result[i] = geodesic_meters(point, tuple(points[i])) <= threshold_meters
+    return result
+
+
+def nearest(point, points, top_n):
+    """
+    Ranks points by distance from point.
+    Haversine selects the candidates; geodesic is only computed for points that could be
+    reordered by the approximation around the top_n cut-off.
+    :return: List of (index, geodesic distance in meters) for the top_n nearest points.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if not len(points):
+        return []
+    distances = distances_meters(point, points)
+    top_n = min(top_n, len(points))
+    cutoff = np.partition(distances, top_n - 1)[top_n - 1]
+    bound = cutoff * (1 + HAVERSINE_MAX_RELATIVE_ERROR) / (1 - HAVERSINE_MAX_RELATIVE_ERROR)
+    candidates = np.flatnonzero(distances <= bound)
+    exact = [(int(i), geodesic_meters(point, tuple(points[i]))) for i in candidates]
+    exact.sort(key=lambda item: item[1])
+    return exact[:top_n]
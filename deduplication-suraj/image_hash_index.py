@@ -0,0 +1,72 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+
+class ImageHashIndex:
+    """
+    Maps the SHA-256 of decoded image bytes to the URL of the object already stored for it.
+    Lookups go to a bounded local LRU first, then to a Mongo collection keyed by the digest
+    that every consumer shares.
+    """
+
+    def __init__(self, collection, cache_size=10000):
+        """
+        :param collection: Mongo collection of {_id: sha256 hex digest, image_url, size, created_at}.
+        :param cache_size: Number of digests kept in the local LRU.
+        """
+        self.collection = collection
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # digest -> image_url
+        self._lock = threading.Lock()
+
+    def _remember(self, digest, image_url):
+        with self._lock:
+            self._cache[digest] = image_url
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def lookup(self, digest):
+        """Returns the stored URL for digest, or None if these bytes were never uploaded."""
+        with self._lock:
+            image_url = self._cache.get(digest)
+            if image_url is not None:
+                self._cache.move_to_end(digest)
+                return image_url
+        try:
+            document = self.collection.find_one({"_id": digest}, {"image_url": 1})
+        except PyMongoError as e:
+            logging.warning(f"Image hash lookup failed, uploading anyway: {e}")
+            return None
+        if document is None:
+            return None
+        self._remember(digest, document["image_url"])
+        return document["image_url"]
+
+    def register(self, digest, image_url, size=None):
+        """
+        Records the URL of a freshly uploaded image.
+        If another consumer registered the same bytes first, its URL wins and is returned,
+        so every incident with these bytes points at the same object.
+        """
+        try:
+            self.collection.insert_one({
+                "_id": digest,
+                "image_url": image_url,
+                "size": size,
+                "created_at": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            existing = self.collection.find_one({"_id": digest}, {"image_url": 1})
+            if existing is not None:
+                logging.info(f"Image {digest[:12]} was registered concurrently, using {existing['image_url']}.")
+                image_url = existing["image_url"]
+        except PyMongoError as e:
+            logging.warning(f"Could not register image hash {digest[:12]}: {e}")
+            return image_url
+        self._remember(digest, image_url)
+        return image_url
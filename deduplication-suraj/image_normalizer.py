@@ -0,0 +1,88 @@
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+def thumbnail_key(filename):
+    """Object key of the thumbnail stored next to an image, e.g. 2025/I-20250307-001-thumb.jpg."""
+    stem, dot, extension = filename.rpartition(".")
+    return f"{stem}-thumb.{extension}" if dot else f"{filename}-thumb"
+
+
+def _encode_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def normalize_image(image_bytes, max_dimension=1920, quality=85, thumbnail_size=320, thumbnail_quality=70):
+    """
+    Downscales an image to fit max_dimension, re-encodes it as JPEG and renders a thumbnail.
+    CPU-bound; meant to run in an ImageNormalizer process.
+    The original bytes are kept when re-encoding would not make them smaller.
+    :return: (image bytes, thumbnail bytes), both JPEG.
+    """
+    from PIL import Image, ImageOps  # Imported in the worker processes, not at consumer startup
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        # For JPEGs, decode at the smallest scale that still covers max_dimension
+        original.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    resized = max(image.size) > max_dimension
+    if resized:
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    normalized = _encode_jpeg(image, quality)
+    if not resized and len(normalized) >= len(image_bytes) and image_bytes[:2] == b"\xff\xd8":
+        normalized = bytes(image_bytes)
+
+    image.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+    return normalized, _encode_jpeg(image, thumbnail_quality)
+
+
+class ImageNormalizer:
+    """
+    Runs normalize_image() in a process pool so resizing and re-encoding never block
+    the consumer's I/O threads or event loop.
+    """
+
+    def __init__(self, workers=2, max_dimension=1920, quality=85, thumbnail_size=320, thumbnail_quality=70):
+        """
+        :param workers: Number of normalizer processes.
+        :param max_dimension: Longest side of stored images, in pixels.
+        :param quality: JPEG quality of stored images.
+        :param thumbnail_size: Longest side of thumbnails, in pixels.
+        :param thumbnail_quality: JPEG quality of thumbnails.
+        """
+        self.workers = workers
+        self.options = {
+            "max_dimension": max_dimension,
+            "quality": quality,
+            "thumbnail_size": thumbnail_size,
+            "thumbnail_quality": thumbnail_quality
+        }
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned (not forked) processes do not inherit the consumer's connections and threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def submit(self, image_bytes):
+        """Queues an image; returns a future of (image bytes, thumbnail bytes)."""
+        return self._get_executor().submit(normalize_image, image_bytes, **self.options)
+
+    def normalize(self, image_bytes):
+        """Blocking version of submit()."""
+        return self.submit(image_bytes).result()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,128 @@
+import binascii
+import hashlib
+import io
+
+DATA_URI_SCAN_LIMIT = 256  # A data URI header ("data:image/jpeg;base64,") is far shorter than this
+
+
+def payload_offset(base64_image):
+    """
+    Returns where the Base64 data starts, skipping an optional "data:...;base64," prefix
+    without splitting (and so copying) the payload.
+    """
+    if isinstance(base64_image, str):
+        comma = base64_image.find(",", 0, DATA_URI_SCAN_LIMIT)
+    else:
+        comma = bytes(base64_image[:DATA_URI_SCAN_LIMIT]).find(b",")
+    return comma + 1 if comma != -1 else 0
+
+
+def decoded_size(base64_image, start=0):
+    """Exact decoded size of an unwrapped, padded Base64 payload from start (an upper bound otherwise)."""
+    tail = base64_image[-2:]
+    padding = tail.count("=") if isinstance(tail, str) else bytes(tail).count(b"=")
+    return max(0, (len(base64_image) - start) // 4 * 3 - padding)
+
+
+class Base64StreamReader(io.RawIOBase):
+    """
+    Read-only binary stream that decodes a Base64 payload chunk by chunk.
+    The payload (str, bytes or memoryview, with or without a data URI prefix) is never copied
+    as a whole: bytes-like payloads are sliced through a memoryview and str payloads in
+    chunk_size pieces, so only one decoded chunk is held at a time.
+    Pass it straight to s3_client.upload_fileobj().
+    """
+
+    def __init__(self, base64_image, chunk_size=64 * 1024):
+        """
+        :param base64_image: Base64 text, optionally prefixed with "data:image/...;base64,".
+        :param chunk_size: Encoded characters decoded per step (rounded down to a multiple of 4).
+        """
+        super().__init__()
+        self._payload = base64_image if isinstance(base64_image, str) else memoryview(base64_image).cast("B")
+        self._position = payload_offset(base64_image)
+        self._end = len(self._payload)
+        self._chunk_size = max(4, chunk_size - chunk_size % 4)
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def _decode_next_chunk(self):
+        start = self._position
+        stop = min(start + self._chunk_size, self._end)
+        try:
+            decoded = binascii.a2b_base64(self._payload[start:stop])
+        except binascii.Error:
+            if stop == self._end:
+                raise
+            decoded = b""
+        if stop < self._end and len(decoded) != (stop - start) // 4 * 3:
+            # Line breaks or other ignored characters broke the 4-character alignment:
+            # decode the rest in one go, exactly like base64.b64decode would
+            decoded = binascii.a2b_base64(self._payload[start:])
+            stop = self._end
+        self._position = stop
+        self._pending = memoryview(decoded)
+
+    def readinto(self, buffer):
+        """Fills buffer completely unless the end of the payload is reached."""
+        out = memoryview(buffer).cast("B")
+        written = 0
+        while written < len(out):
+            if not self._pending:
+                if self._position >= self._end:
+                    break
+                self._decode_next_chunk()
+                continue
+            count = min(len(out) - written, len(self._pending))
+            out[written:written + count] = self._pending[:count]
+            self._pending = self._pending[count:]
+            written += count
+        return written
+
+    def read(self, size=-1):
+        """Returns up to size decoded bytes (everything if size < 0), joined once from the decoded chunks."""
+        if size is None or size < 0:
+            return bytes(self.readall())
+        parts = []
+        while size > 0:
+            if not self._pending:
+                if self._position >= self._end:
+                    break
+                self._decode_next_chunk()
+                continue
+            part = self._pending[:size]
+            self._pending = self._pending[len(part):]
+            parts.append(part)
+            size -= len(part)
+        return b"".join(parts)
+
+    def readall(self):
+        """Decodes the remaining payload into a single preallocated buffer."""
+        buffer = bytearray(decoded_size(self._payload, self._position) + len(self._pending))
+        del buffer[self.readinto(buffer):]
+        # A remainder only exists if the payload contained ignored characters
+        buffer += super().readall() or b""
+        return buffer
+
+
+def decode_base64_image(base64_image):
+    """Decodes a (data URI) Base64 image like base64.b64decode, without splitting the prefix off (returns a bytearray)."""
+    return Base64StreamReader(base64_image).readall()
+
+
+def hash_base64_image(base64_image, chunk_size=1024 * 1024):
+    """
+    SHA-256 of the decoded image, computed in one streaming pass without holding the decoded bytes.
+    :return: (hex digest, decoded size in bytes).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    reader = Base64StreamReader(base64_image)
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            return digest.hexdigest(), size
+        digest.update(chunk)
+        size += len(chunk)
@@ -1,22 +1,37 @@
 import json
-from fuzzywuzzy import process
+import logging
 import re
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 from datetime import datetime
 
+import config
+from term_normalizer import TermNormalizer
+
 class IncidentPrioritizer:
     """
     Handles prioritization of detected objects based on a priority configuration.
     Now loads default terms directly from priority.json.
     """
     
-    def __init__(self, priority_config_path: str = 'priority.json'):
+    def __init__(self, priority_config_path: str = 'priority.json', aliases_path: Optional[str] = None,
+                 cache_size: Optional[int] = None, priority_config: Optional[dict] = None):
         """
         Initialize with path to priority configuration file.
         Default terms are now loaded directly from the config file.
+        :param aliases_path: Optional JSON file of {detector label: known term} exact mappings.
+        :param cache_size: Maximum number of fuzzy matches kept in the normalizer's LRU cache.
+        :param priority_config: Already parsed priorities (e.g. from ReferenceDataManager); skips reading the file.
         """
-        self.priority_config = self._load_priority_config(priority_config_path)
+        if priority_config is None:
+            priority_config = self._load_priority_config(priority_config_path)
+        self.priority_config = priority_config
         self.known_terms = list(self.priority_config.keys())  # Get terms directly from config
+        aliases_path = aliases_path if aliases_path is not None else config.TERM_ALIASES_PATH
+        self.normalizer = TermNormalizer(
+            self.known_terms,
+            aliases=TermNormalizer.load_aliases(aliases_path) if aliases_path else None,
+            cache_size=cache_size if cache_size is not None else config.TERM_CACHE_SIZE
+        )
     
     def _load_priority_config(self, config_path: str) -> dict:
         """
@@ -38,27 +53,28 @@ class IncidentPrioritizer:
             print(f"Warning: Invalid JSON in {config_path}. Using empty priorities.")
             return {}
     
-    def preprocess_detected_objects(self, input_str: str, threshold: int = 80) -> List[str]:
+    @staticmethod
+    def split_terms(input_str: str) -> List[str]:
         """
-        Clean and normalize detected objects string using terms from priority config.
+        Splits a detected objects string into lowercased candidate terms.
         """
         normalized = re.sub(r'\s+', ' ', input_str.strip().lower())
         if not normalized:
             return []
-        
         potential_terms = re.findall(r'\b\w+(?:\s+\w+)*\b', normalized)  # Updated regex to handle multiple words
+        return [term for term in potential_terms if term.strip()]
+    
+    def preprocess_detected_objects(self, input_str: str, threshold: int = 80) -> List[str]:
+        """
+        Clean and normalize detected objects string using terms from priority config.
+        """
+        potential_terms = self.split_terms(input_str)
+        if not potential_terms:
+            return []
         
         cleaned = []
-        for term in potential_terms:
-            if not term.strip():
-                continue
-            
-            match, score = process.extractOne(
-                term,
-                self.known_terms,
-                processor=lambda x: x
-            )
-            
+        # Exact labels and aliases resolve without fuzzy matching; misses are scored in one batch
+        for term, (match, score) in zip(potential_terms, self.normalizer.normalize_many(potential_terms)):
             if score >= threshold:
                 cleaned.append(match)
             else:
@@ -67,6 +83,10 @@ class IncidentPrioritizer:
         # Remove consecutive duplicates while preserving order
         return [term for i, term in enumerate(cleaned) if i == 0 or term != cleaned[i-1]]
     
+    def normalizer_stats(self) -> dict:
+        """Exact/cache hit counts, hit rate and fuzzy-miss latency of the term normalizer."""
+        return self.normalizer.stats()
+    
     def get_highest_priority_object(self, detected_objects: List[str]) -> Optional[str]:
         """
         Returns the highest priority object from the list based on config.
@@ -109,8 +129,22 @@ class IncidentClassifier:
 }
 
         self.prioritizer = prioritizer or IncidentPrioritizer()
+        self.build_lookup_tables()
         print("[INIT] IncidentClassifier initialized with rules matching priority.json")
 
+    def build_lookup_tables(self):
+        """
+        Precomputes, for every priority term, its priority rank and classification outcome
+        so classify_many() needs no rule evaluation per incident.
+        Call again after changing incident_rules or the prioritizer's config.
+        """
+        self._priority_rank = dict(self.prioritizer.priority_config)
+        self._daytime_only = {"street light"}
+        self._outcomes = {
+            term: self.incident_rules.get(term, "Unknown")
+            for term in self._priority_rank
+        }
+
     def is_daytime(self, timestamp):
         """Check if timestamp falls within daytime hours (6 AM - 6 PM)."""
     # Handle both dict format and direct timestamp
@@ -151,6 +185,61 @@ class IncidentClassifier:
         print(f"[ALERT] {detected_object} detected")
         return self.incident_rules[detected_object]
 
+    @staticmethod
+    def _local_hour(timestamp: Union[int, float, dict, datetime]) -> int:
+        """Hour of day used for the daytime check, parsed the same way as classify_incident()."""
+        if isinstance(timestamp, dict) and "$date" in timestamp:
+            timestamp = int(datetime.fromisoformat(timestamp["$date"].replace("Z", "+00:00")).timestamp())
+        if isinstance(timestamp, (int, float)):
+            return datetime.fromtimestamp(timestamp).hour
+        return timestamp.hour
+
+    def _highest_priority(self, terms: List[str]) -> Optional[str]:
+        best, best_rank = None, None
+        for term in terms:
+            rank = self._priority_rank.get(term)
+            if rank is not None and (best_rank is None or rank < best_rank):
+                best, best_rank = term, rank
+        return best
+
+    def classify_many(self, incidents: List[Tuple[Union[str, List[str]], Union[int, float, dict]]],
+                      threshold: int = 80) -> List[Optional[str]]:
+        """
+        Batch version of process_incidents() for (detected_objects, timestamp) pairs.
+        Every detected-objects string of the batch is normalized in one call, priorities and
+        outcomes come from the precomputed tables, and a timestamp is only parsed when the
+        outcome depends on the time of day. Nothing is printed per incident.
+        :return: Incident types (or None) in input order.
+        """
+        term_lists = [
+            self.prioritizer.split_terms(objects) if isinstance(objects, str) else None
+            for objects, _ in incidents
+        ]
+        flat_terms = [term for terms in term_lists if terms for term in terms]
+        matches = iter(self.prioritizer.normalizer.normalize_many(flat_terms))
+
+        results = []
+        for (objects, timestamp), terms in zip(incidents, term_lists):
+            if terms is None:
+                candidates = objects
+            else:
+                candidates = []
+                for term in terms:
+                    match, score = next(matches)
+                    if score >= threshold:
+                        candidates.append(match)
+                    else:
+                        logging.debug(f"No good match for term '{term}' (best '{match}', score {score})")
+
+            priority_obj = self._highest_priority(candidates)
+            if priority_obj is None:
+                results.append(None)
+            elif priority_obj in self._daytime_only and priority_obj in self.incident_rules:
+                results.append(self._outcomes[priority_obj] if 6 <= self._local_hour(timestamp) < 18 else None)
+            else:
+                results.append(self._outcomes[priority_obj])
+        return results
+
     def process_incidents(self, detected_objects: Union[str, List[str]], timestamp: Union[int, float, dict]) -> Optional[str]:
         """
         Complete incident processing pipeline:
@@ -0,0 +1,71 @@
+import json
+import re
+
+from Mongo_interaction import EventSearcher
+
+IMAGE_FIELD = "base64String"
+_IMAGE_KEY = re.compile(rb'"%s"\s*:\s*"' % IMAGE_FIELD.encode())
+
+
+def loads_incident(body):
+    """
+    Deserializes an incident message without copying its image.
+    The Base64 image is located in the raw body and returned as a memoryview over it,
+    so only the (small) remaining JSON is parsed. Falls back to json.loads for bodies
+    where the image value is not a plain string.
+    :param body: Raw message body (bytes).
+    :return: The incident dictionary; incident["base64String"] is a memoryview or a str.
+    """
+    match = _IMAGE_KEY.search(body)
+    if match is not None:
+        start = match.end()
+        end = body.find(b'"', start)
+        # Base64 and data URIs never contain escapes, so a backslash means we must really parse it
+        if end != -1 and body.find(b"\\", start, end) == -1:
+            incident = json.loads(body[:start] + body[end:])
+            if incident.get(IMAGE_FIELD) == "":
+                incident[IMAGE_FIELD] = memoryview(body)[start:end]
+                return incident
+    return json.loads(body)
+
+
+def parse_incident(incident):
+    """
+    Extracts the fields the pipeline needs from a deserialized incident message.
+    Shared by the blocking and asyncio consumers so both normalize messages the same way.
+    :param incident: The incident message as a dictionary.
+    :return: Tuple of (detected_object, timestamp, location, base64_image); timestamp is a naive
+             UTC datetime, or None when it is missing or invalid.
+    """
+    # Extract required fields
+    detected_objects = incident.get("detected_objects", "")
+
+    # Ensure detected_objects is a string before applying lower()
+    if isinstance(detected_objects, list):
+        detected_objects = " ".join(detected_objects)  # Convert list to space-separated string
+
+    detected_object = detected_objects.lower()
+
+    # Parse the timestamp ({"$date": ...} or ISO string) once, for the classifier and dedup alike
+    timestamp = incident.get("timestamp", None)
+    if timestamp is not None:
+        timestamp = EventSearcher.parse_timestamp(timestamp)
+
+    # Extract coordinates correctly
+    coordinates = incident.get("location", {}).get("coordinates", [])
+    longitude, latitude = coordinates if len(coordinates) == 2 else (None, None)
+
+    location = {
+        "type": "Point",
+        "coordinates": [longitude, latitude]
+    }
+
+    # Extract base64 image
+    base64_image = incident.get("base64String", "")
+
+    return detected_object, timestamp, location, base64_image
+
+
+def has_required_fields(detected_object, timestamp, location, base64_image):
+    """Checks that every field needed for classification, upload and deduplication is present."""
+    return bool(detected_object and location["coordinates"] != [None, None] and timestamp and base64_image)
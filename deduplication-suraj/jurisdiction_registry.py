@@ -0,0 +1,124 @@
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from shapely import STRtree, box
+from shapely.geometry import Point, Polygon
+from shapely.prepared import prep
+
+from geo_distance import EARTH_RADIUS_METERS, HAVERSINE_MAX_RELATIVE_ERROR, within_distance
+
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_METERS / 180
+
+
+class _Jurisdiction:
+    __slots__ = ("agency_id", "order", "prepared", "vertices")
+
+    def __init__(self, agency_id, order, prepared, vertices):
+        self.agency_id = agency_id
+        self.order = order
+        self.prepared = prepared
+        self.vertices = vertices
+
+
+class _ResponsibilityIndex:
+    """STRtree over the (margin-expanded) bounding boxes of the jurisdictions of one event type."""
+
+    def __init__(self, jurisdictions, boxes):
+        self.jurisdictions = jurisdictions
+        self.tree = STRtree(boxes)
+
+    def candidates(self, point):
+        """Jurisdictions whose expanded bounding box contains the point, in agency order."""
+        return [self.jurisdictions[i] for i in sorted(self.tree.query(point))]
+
+
+class JurisdictionRegistry:
+    """
+    Agency jurisdictions loaded from Mongo, as prepared polygons indexed by an STRtree
+    per responsibility type. Coordinates follow the stored [latitude, longitude] order.
+    Bounding boxes are expanded by the nearby threshold, so a single tree query returns every
+    jurisdiction the event is inside of or near a vertex of.
+    The registry is reloaded after ttl_seconds (None: never) or after invalidate().
+    """
+
+    def __init__(self, db_client, nearby_threshold_km=0.05, ttl_seconds=None):
+        self.db_client = db_client
+        self.nearby_threshold_meters = nearby_threshold_km * 1000
+        self.ttl_seconds = ttl_seconds
+        self._indexes = {}  # responsibility -> _ResponsibilityIndex
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _margin(self, vertices):
+        """Bounding box margins (latitude, longitude degrees) covering the nearby threshold."""
+        lat_margin = self.nearby_threshold_meters * (1 + HAVERSINE_MAX_RELATIVE_ERROR) / METERS_PER_DEGREE
+        max_latitude = min(89.0, float(np.abs(vertices[:, 0]).max()) + lat_margin)
+        return lat_margin, lat_margin / math.cos(math.radians(max_latitude))
+
+    def build(self, agencies):
+        """Builds the per-responsibility indexes from agency documents (in query order)."""
+        by_responsibility = {}
+        for order, agency in enumerate(agencies):
+            jurisdiction = agency.get("jurisdiction") or {}
+            coordinates = jurisdiction.get("coordinates") or []
+            if len(coordinates) < 3:
+                logging.warning(f"Agency {agency.get('AgencyId')} has no usable jurisdiction polygon.")
+                continue
+
+            vertices = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+            polygon = Polygon(vertices)
+            entry = _Jurisdiction(agency["AgencyId"], order, prep(polygon), vertices)
+
+            lat_margin, lon_margin = self._margin(vertices)
+            min_lat, min_lon, max_lat, max_lon = polygon.bounds
+            expanded = box(min_lat - lat_margin, min_lon - lon_margin, max_lat + lat_margin, max_lon + lon_margin)
+
+            for responsibility in set(agency.get("eventResponsibleFor") or []):
+                by_responsibility.setdefault(responsibility, ([], []))
+                by_responsibility[responsibility][0].append(entry)
+                by_responsibility[responsibility][1].append(expanded)
+
+        indexes = {
+            responsibility: _ResponsibilityIndex(entries, boxes)
+            for responsibility, (entries, boxes) in by_responsibility.items()
+        }
+        with self._lock:
+            self._indexes = indexes
+            self._loaded_at = time.monotonic()
+        logging.info(f"Jurisdiction registry loaded for {len(indexes)} event types.")
+
+    def load(self):
+        """(Re)loads every agency with a jurisdiction from Mongo."""
+        agencies_collection = self.db_client.get_collection("agencies")
+        self.build(agencies_collection.find(
+            {"jurisdiction": {"$exists": True}},
+            {"AgencyId": 1, "jurisdiction": 1, "eventResponsibleFor": 1}
+        ))
+
+    def invalidate(self):
+        """Forces a reload on the next lookup."""
+        with self._lock:
+            self._loaded_at = None
+
+    def find(self, event_type, event_location):
+        """
+        Returns the first agency (in Mongo order) responsible for event_type whose jurisdiction
+        contains event_location or has a vertex within the nearby threshold, or None.
+        """
+        if self._loaded_at is None or (
+                self.ttl_seconds is not None and time.monotonic() - self._loaded_at > self.ttl_seconds):
+            self.load()
+        index = self._indexes.get(event_type)
+        if index is None:
+            return None
+
+        point = Point(event_location)
+        for jurisdiction in index.candidates(point):
+            if jurisdiction.prepared.contains(point):
+                return jurisdiction.agency_id
+            if within_distance(event_location, jurisdiction.vertices, self.nearby_threshold_meters).any():
+                return jurisdiction.agency_id
+        return None
@@ -0,0 +1,251 @@
+"""
+In-process metrics for the consumer: counters, gauges and latency histograms,
+served in the Prometheus text format on http://<METRICS_HOST>:<port>/metrics.
+
+    with metrics.timed("classify"):
+        ...
+    metrics.ACKS.inc()
+"""
+import bisect
+import functools
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, **extra):
+        labels = dict(zip(self.labelnames, key))
+        labels.update(extra)
+        return labels
+
+    def samples(self):
+        """(suffix, labels, value) tuples for the exposition format."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            if not self.labelnames and not self._values:
+                return [("", {}, 0)]  # Unlabelled counters are exported from the start
+            return [("", self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Gauge set directly or computed at scrape time from a callback."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, **labels):
+        """Reads the gauge from function() on every scrape (e.g. a queue length)."""
+        self.set(function, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        samples = []
+        for key, value in items:
+            if callable(value):
+                try:
+                    value = value()
+                except Exception as e:
+                    logging.warning(f"Gauge {self.name} callback failed: {e}")
+                    continue
+            samples.append(("", self._labels(key), value))
+        return samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", self._labels(key, le=_format_value(float(bound))), cumulative))
+            samples.append(("_sum", self._labels(key), total))
+            samples.append(("_count", self._labels(key), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+MESSAGES = REGISTRY.counter("consumer_messages_total", "Messages received from RabbitMQ.")
+ACKS = REGISTRY.counter("consumer_acks_total", "Messages acknowledged.")
+NACKS = REGISTRY.counter("consumer_nacks_total", "Messages rejected, by reason.", ["reason"])
+NON_INCIDENTS = REGISTRY.counter("consumer_non_incidents_total", "Messages classified as no incident.")
+DEDUP_MATCHES = REGISTRY.counter("dedup_matches_total", "Incidents added to an existing event.")
+EVENTS_CREATED = REGISTRY.counter("events_created_total", "New events created.")
+DEDUP_INDEX_LOOKUPS = REGISTRY.counter(
+    "dedup_index_lookups_total", "Dedup lookups answered by the in-memory index or falling back to Mongo.", ["result"]
+)
+ALLOCATION_CACHE_LOOKUPS = REGISTRY.counter(
+    "allocation_cache_lookups_total", "Agency allocations served from the allocation cache or computed.", ["result"]
+)
+NEAR_DUPLICATES = REGISTRY.counter("near_duplicate_frames_total", "Frames attached to an event as near-duplicates.")
+ROUTED = REGISTRY.counter("router_messages_total", "Messages routed to a partition queue.", ["partition"])
+STAGE_SECONDS = REGISTRY.histogram("pipeline_stage_seconds", "Latency of each pipeline stage.", ["stage"])
+QUEUE_DEPTH = REGISTRY.gauge("pipeline_queue_depth", "Items waiting in an in-process queue.", ["queue", "worker"])
+
+
+class timed:
+    """Records the duration of a stage in STAGE_SECONDS; use as a context manager or decorator."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._local = threading.local()
+
+    def __enter__(self):
+        self._local.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe(time.perf_counter() - self._local.started, stage=self.stage)
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage=self.stage)
+        return wrapper
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line each
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serves /metrics from a daemon thread; one server per process, later calls are no-ops."""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            logging.error(f"Could not start metrics server on {host}:{port}: {e}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        logging.info(f"Metrics available on http://{host}:{port}/metrics")
+        return _server
@@ -0,0 +1,125 @@
+import logging
+
+import pika
+
+from incident_classifier import IncidentClassifier, IncidentPrioritizer
+from incident_message import loads_incident, parse_incident, has_required_fields
+from partitioning import ConsistentHashRing, partition_key, partition_queue
+from reference_data import ReferenceDataManager
+import config
+import metrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# One active consumer per partition queue: a restarted or duplicate worker waits as a standby
+PARTITION_QUEUE_ARGUMENTS = {"x-single-active-consumer": True}
+
+
+def declare_partition_queues(channel, partitions=None):
+    """Declares the partition queues (idempotent)."""
+    for partition in range(partitions or config.PARTITIONS):
+        channel.queue_declare(
+            queue=partition_queue(config.INPUT_QUEUE, partition), arguments=PARTITION_QUEUE_ARGUMENTS
+        )
+
+
+class PartitionRouter:
+    """
+    Routes incident messages from the input queue to partition queues by incident type and
+    coarse geocell (consistent hashing), so incidents of the same type in the same cell are
+    handled by the same partition worker, one at a time. Similar incidents on either side of a
+    cell edge can reach different workers; those workers take leases on the cells near the edge
+    (see CellLeases), so the incidents are still deduplicated one at a time.
+    """
+
+    def __init__(self, classifier=None, ring=None, cell_km=None):
+        """
+        :param classifier: IncidentClassifier giving the incident type (the dedup key) of a message.
+        :param ring: ConsistentHashRing over config.PARTITIONS partitions by default.
+        :param cell_km: Geocell size; cells much larger than the dedup distance keep few events on cell edges.
+        """
+        self.classifier = classifier or IncidentClassifier(IncidentPrioritizer('priority.json'))
+        self.ring = ring or ConsistentHashRing(config.PARTITIONS, config.PARTITION_VIRTUAL_NODES)
+        self.cell_km = cell_km or config.PARTITION_CELL_KM
+
+    def partition(self, body):
+        """Partition of a raw message body. Unparseable messages go to partition 0, which rejects them."""
+        try:
+            incident = loads_incident(body)
+            detected_object, timestamp, location, base64_image = parse_incident(incident)
+            if not has_required_fields(detected_object, timestamp, location, base64_image):
+                return 0
+            incident_type = self.classifier.classify_many([(detected_object, timestamp)])[0]
+        except Exception as e:
+            logging.warning(f"Routing unparseable message to partition 0: {e}")
+            return 0
+        longitude, latitude = location["coordinates"]
+        return self.ring.partition(partition_key(incident_type or "none", latitude, longitude, self.cell_km))
+
+
+def run_router(worker_id=0, stop_event=None):
+    """
+    Moves messages from the input queue to the partition queues until stop_event is set.
+    An input message is acked only after the broker confirmed its copy on the partition queue.
+    """
+    connection = pika.BlockingConnection(pika.ConnectionParameters(
+        host=config.RABBITMQ_HOST,
+        port=config.RABBITMQ_PORT
+    ))
+    channel = connection.channel()
+    channel.queue_declare(queue=config.INPUT_QUEUE)
+    declare_partition_queues(channel)
+    channel.confirm_delivery()
+    channel.basic_qos(prefetch_count=config.PREFETCH_COUNT)
+    # File-only reference data: routing follows priority.json changes like the consumers do
+    reference_data = ReferenceDataManager().start()
+    router = PartitionRouter(reference_data.current().classifier)
+
+    def use_snapshot(snapshot):
+        router.classifier = snapshot.classifier
+
+    reference_data.add_listener(use_snapshot)
+
+    if config.METRICS_ENABLED:
+        # Routers are supervised after the partition workers, so worker_id is past their ports
+        port_offset = worker_id if config.CONSUMER_WORKER_MODE == "process" else 0
+        metrics.start_metrics_server(config.METRICS_PORT + port_offset, config.METRICS_HOST)
+
+    def callback(ch, method, properties, body):
+        try:
+            partition = router.partition(body)
+            ch.basic_publish(
+                exchange="", routing_key=partition_queue(config.INPUT_QUEUE, partition), body=body,
+                properties=properties, mandatory=True
+            )
+        except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+            logging.error(f"Partition queue rejected a message, requeueing it: {e}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        metrics.ROUTED.inc(partition=partition)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def check_stop():
+        if stop_event.is_set():
+            channel.stop_consuming()
+        else:
+            connection.call_later(1, check_stop)
+
+    if stop_event is not None:
+        connection.call_later(1, check_stop)
+
+    channel.basic_consume(queue=config.INPUT_QUEUE, on_message_callback=callback)
+    logging.info(f"Router {worker_id} routing {config.INPUT_QUEUE} to {config.PARTITIONS} partitions...")
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        channel.stop_consuming()
+    finally:
+        reference_data.stop()
+        connection.close()
+        logging.info(f"Router {worker_id} stopped.")
+
+
+if __name__ == "__main__":
+    run_router()
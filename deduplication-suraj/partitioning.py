@@ -0,0 +1,84 @@
+import bisect
+import hashlib
+import math
+
+from geo_distance import EARTH_RADIUS_METERS
+
+METERS_PER_DEGREE = 111320
+
+
+def geocell(latitude, longitude, cell_km):
+    """
+    (row, column) of the coarse grid cell containing a point. Cells are cell_km tall and,
+    per row, cell_km wide at the row's equator-side edge, so they never shrink below cell_km.
+    """
+    cell_degrees = cell_km * 1000 / METERS_PER_DEGREE
+    row = math.floor((latitude + 90) / cell_degrees)
+    edge_latitude = min(89.0, min(abs(row * cell_degrees - 90), abs((row + 1) * cell_degrees - 90)))
+    column = math.floor((longitude + 180) * math.cos(math.radians(edge_latitude)) / cell_degrees)
+    return row, column
+
+
+def cells_within(latitude, longitude, radius_meters, cell_km):
+    """
+    Sorted (row, column) of the geocells overlapping the bounding box of a circle around a point.
+    Two points within radius_meters of each other always share a cell (the cell of either point).
+    :param radius_meters: Circle radius on the mean-radius sphere; pad it to cover geodesic distances.
+    """
+    radius_degrees = math.degrees(radius_meters / EARTH_RADIUS_METERS)
+    radius_longitude = radius_degrees / math.cos(math.radians(min(89.0, abs(latitude) + radius_degrees)))
+    lowest, highest = latitude - radius_degrees, latitude + radius_degrees
+    cell_degrees = cell_km * 1000 / METERS_PER_DEGREE
+    cells = set()
+    for row in range(math.floor((lowest + 90) / cell_degrees), math.floor((highest + 90) / cell_degrees) + 1):
+        # Within a row, columns only depend on the longitude
+        row_latitude = min(max((row + 0.5) * cell_degrees - 90, lowest), highest)
+        row, first = geocell(row_latitude, longitude - radius_longitude, cell_km)
+        _, last = geocell(row_latitude, longitude + radius_longitude, cell_km)
+        cells.update((row, column) for column in range(first, last + 1))
+    return sorted(cells)
+
+
+def partition_key(incident_type, latitude, longitude, cell_km):
+    """Routing key of an incident: its incident type and coarse geocell."""
+    row, column = geocell(latitude, longitude, cell_km)
+    return f"{incident_type}|{row}|{column}"
+
+
+def _hash(value):
+    # Stable across processes and restarts, unlike hash()
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def partition_queue(base_queue, partition):
+    """Name of the queue consumed by one partition worker, e.g. detected_objects_queue.p3."""
+    return f"{base_queue}.p{partition}"
+
+
+class ConsistentHashRing:
+    """
+    Maps partition keys to partitions on a hash ring with virtual nodes, so every key always
+    lands on the same partition and changing the number of partitions only moves about 1/N
+    of the keys.
+    """
+
+    def __init__(self, partitions, virtual_nodes=64):
+        """
+        :param partitions: Number of partitions (one consumer each).
+        :param virtual_nodes: Points per partition on the ring; more points even out the load.
+        """
+        if partitions < 1:
+            raise ValueError("At least one partition is required")
+        self.partitions = partitions
+        points = sorted(
+            (_hash(f"partition-{partition}#{replica}"), partition)
+            for partition in range(partitions)
+            for replica in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [partition for _, partition in points]
+
+    def partition(self, key):
+        """Partition owning key: the first ring point clockwise from the key's hash."""
+        position = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[position]
@@ -0,0 +1,232 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from pymongo.errors import PyMongoError
+
+from Agency_event_allocation_db_2 import AgencyFinder, ConfigLoader, EventProcessor, JurisdictionFinder
+from agency_index import AgencyChangeWatcher, AgencyIndex
+from incident_classifier import IncidentClassifier, IncidentPrioritizer
+import config
+import metrics
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class ReferenceSnapshot:
+    """
+    One consistent version of the reference data, built ahead of time and never modified.
+    Take the current snapshot once per message and use only its structures, so a message
+    never mixes two versions.
+    """
+
+    def __init__(self, version, classifier, config_loader, incident_codes,
+                 agency_finder=None, jurisdiction_finder=None, processor=None):
+        """
+        :param classifier: IncidentClassifier built from priority.json (term tables included).
+        :param config_loader: ConfigLoader holding the criticality map.
+        :param incident_codes: {incident type: code} used in event IDs.
+        :param agency_finder: AgencyFinder over a loaded agency KD-tree index (None without Mongo).
+        :param jurisdiction_finder: JurisdictionFinder over a loaded polygon registry (None without Mongo).
+        :param processor: EventProcessor combining the criticality map and both finders (None without Mongo).
+        """
+        self.version = version
+        self.classifier = classifier
+        self.config_loader = config_loader
+        self.incident_codes = incident_codes
+        self.agency_finder = agency_finder
+        self.jurisdiction_finder = jurisdiction_finder
+        self.processor = processor
+        self.created_at = time.time()
+
+
+class ReferenceDataManager:
+    """
+    Owns the reference data: priority terms, criticality, incident codes and (with a db_client)
+    the agency and jurisdiction indexes. A background thread rebuilds the parts whose source
+    changed (file mtime, agencies change stream) and swaps in a new ReferenceSnapshot; the agency
+    indexes are also rebuilt every agency_refresh_seconds, with or without a change stream.
+    Hot paths only read current(), so they never wait on file or Mongo I/O.
+    A file that fails to parse keeps the previous version.
+    """
+
+    FILES = ("priority", "criticality", "codes")
+
+    def __init__(self, db_client=None, priority_path="priority.json", criticality_path="Incident_criticalness.json",
+                 codes_path="incident_codes.json", poll_seconds=None, agency_refresh_seconds=None,
+                 allocation_cache=None):
+        """
+        :param db_client: MongoDBClient for the agency data; None builds the file-based parts only.
+        :param poll_seconds: Interval between file mtime checks (default REFERENCE_POLL_SECONDS).
+        :param agency_refresh_seconds: Agency rebuild interval when no change stream fires (default AGENCY_INDEX_TTL).
+        :param allocation_cache: AllocationCache cleared whenever criticality or agencies change.
+        """
+        self.db_client = db_client
+        self.paths = {"priority": priority_path, "criticality": criticality_path, "codes": codes_path}
+        self.poll_seconds = poll_seconds if poll_seconds is not None else config.REFERENCE_POLL_SECONDS
+        self.agency_refresh_seconds = (
+            agency_refresh_seconds if agency_refresh_seconds is not None else config.AGENCY_INDEX_TTL
+        )
+        self.allocation_cache = allocation_cache
+        self._mtimes = {}
+        self._listeners = []
+        self._reload_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._agencies_changed = False
+        self._agencies_loaded_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._watcher = None
+        self._snapshot = None
+        self.reload(set(self.FILES), agencies=db_client is not None)
+
+    def current(self):
+        """The current snapshot (a plain attribute read, never blocks)."""
+        return self._snapshot
+
+    def add_listener(self, listener):
+        """Calls listener(snapshot) after every swap."""
+        self._listeners.append(listener)
+
+    def _mtime(self, name):
+        try:
+            return os.stat(self.paths[name]).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read_json(self, name):
+        """Reads and validates a reference file. Raises on a missing or invalid file."""
+        self._mtimes[name] = self._mtime(name)
+        with open(self.paths[name]) as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{self.paths[name]} must hold a JSON object")
+        if name == "priority" and not all(isinstance(value, int) for value in data.values()):
+            raise ValueError(f"{self.paths[name]} has non-integer priorities")
+        return data
+
+    def _load_file(self, name, previous):
+        """Parsed file content, or the previous content (empty on the first load) if it cannot be read."""
+        try:
+            return self._read_json(name)
+        except (OSError, ValueError) as e:
+            if previous is None:
+                logging.error(f"Could not load {self.paths[name]}, using empty reference data: {e}")
+                return {}
+            logging.error(f"Could not reload {self.paths[name]}, keeping the previous version: {e}")
+            return None
+
+    def _load_agencies(self):
+        """Builds fresh agency and jurisdiction finders; their indexes never reload on a lookup."""
+        from jurisdiction_registry import JurisdictionRegistry  # shapely is only imported with agency data
+        agency_index = AgencyIndex(self.db_client, ttl_seconds=math.inf)
+        agency_index.load()
+        registry = JurisdictionRegistry(self.db_client, ttl_seconds=None)
+        registry.load()
+        self._agencies_loaded_at = time.monotonic()
+        return AgencyFinder(self.db_client, agency_index), JurisdictionFinder(self.db_client, registry)
+
+    @metrics.timed("reference_data_reload")
+    def reload(self, files=(), agencies=False):
+        """
+        Rebuilds the given parts ("priority", "criticality", "codes" and/or agencies), reuses the
+        others from the current snapshot and swaps the result in.
+        :return: The current snapshot.
+        """
+        with self._reload_lock:
+            previous = self._snapshot
+            classifier = previous.classifier if previous else None
+            config_loader = previous.config_loader if previous else None
+            incident_codes = previous.incident_codes if previous else None
+            agency_finder = previous.agency_finder if previous else None
+            jurisdiction_finder = previous.jurisdiction_finder if previous else None
+            changed = set()
+
+            if "priority" in files:
+                priorities = self._load_file("priority", previous)
+                if priorities is not None:
+                    prioritizer = IncidentPrioritizer(self.paths["priority"], priority_config=priorities)
+                    classifier = IncidentClassifier(prioritizer)
+                    changed.add("priority")
+            if "criticality" in files:
+                criticality = self._load_file("criticality", previous)
+                if criticality is not None:
+                    config_loader = ConfigLoader(self.paths["criticality"], data=criticality)
+                    changed.add("criticality")
+            if "codes" in files:
+                codes = self._load_file("codes", previous)
+                if codes is not None:
+                    incident_codes = codes
+                    changed.add("codes")
+            if agencies and self.db_client is not None:
+                try:
+                    agency_finder, jurisdiction_finder = self._load_agencies()
+                    changed.add("agencies")
+                except PyMongoError as e:
+                    if previous is None:
+                        raise
+                    logging.error(f"Could not reload agencies, keeping the previous indexes: {e}")
+
+            if previous is not None and not changed:
+                return previous
+            if self.allocation_cache is not None and changed & {"criticality", "agencies"}:
+                # Before the new processor is built: the previous one keeps the old generation
+                self.allocation_cache.invalidate()
+            processor = None
+            if agency_finder is not None:
+                processor = EventProcessor(config_loader, agency_finder, jurisdiction_finder, self.allocation_cache)
+            version = previous.version + 1 if previous else 1
+            self._snapshot = ReferenceSnapshot(
+                version, classifier, config_loader, incident_codes, agency_finder, jurisdiction_finder, processor
+            )
+
+        logging.info(f"Reference data version {version} loaded ({', '.join(sorted(changed))}).")
+        for listener in self._listeners:
+            try:
+                listener(self._snapshot)
+            except Exception as e:
+                logging.error(f"Reference data listener failed: {e}")
+        return self._snapshot
+
+    def request_agency_reload(self):
+        """Schedules an agency rebuild on the background thread (e.g. from a change stream)."""
+        self._agencies_changed = True
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+            files = {name for name in self.FILES if self._mtime(name) != self._mtimes.get(name)}
+            agencies = self.db_client is not None and (
+                self._agencies_changed or time.monotonic() - self._agencies_loaded_at > self.agency_refresh_seconds
+            )
+            self._agencies_changed = False
+            if files or agencies:
+                try:
+                    self.reload(files, agencies)
+                except Exception as e:
+                    logging.error(f"Reference data reload failed: {e}")
+
+    def start(self):
+        """Starts the background reloader (and the agencies change stream, if enabled)."""
+        if self._thread is None:
+            if self.db_client is not None and config.AGENCY_CHANGE_STREAM_ENABLED:
+                self._watcher = AgencyChangeWatcher(
+                    self.db_client.get_collection("agencies"), [self.request_agency_reload]
+                ).start()
+            self._thread = threading.Thread(target=self._run, name="reference-data-reloader", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._watcher is not None:
+            self._watcher.stop()
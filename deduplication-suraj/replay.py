@@ -0,0 +1,300 @@
+"""
+Offline replay of stored incidents through deduplication and agency allocation, e.g. after
+changing DEDUP_WINDOW_MINUTES / DEDUP_MAX_DISTANCE_METERS or Incident_criticalness.json.
+
+Incidents are streamed in time order from the Incident collection (or a mongoexport JSONL file)
+and deduplicated in memory with a sweep over a SpatioTemporalIndex: an event stays open while
+incidents can still join it and is written, with all its incidents, once the sweep has moved
+past its time window. Agencies are allocated per batch of finished events, and events are
+written with one bulk insert per batch (their incident buckets go to "<target>_incidents").
+RabbitMQ, MinIO and the live events collection are not touched (unless the live collection is
+passed as --target, which --drop-target refuses).
+
+    python replay.py --target events_replay --drop-target
+    python replay.py --jsonl incidents.jsonl --window-minutes 60 --distance-meters 150 --dry-run
+"""
+import argparse
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from bson import ObjectId, json_util
+from pymongo import ASCENDING, UpdateOne
+
+from Agency_event_allocation_db_2 import AgencyFinder, ConfigLoader, EventProcessor, JurisdictionFinder, MongoDBClient
+from dedup_index import SpatioTemporalIndex
+from Mongo_interaction import EventSearcher
+from app import Application
+from sequence_allocator import MemorySequenceAllocator, create_sequence_allocator, last_issued_sequence
+from test_dedup3 import EventHandler
+import config
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# The image payload is never stored with incidents, but exports of older data may still carry it
+INCIDENT_PROJECTION = {"base64String": 0}
+
+
+def stamp_incident_times(collection, batch_size=1000):
+    """
+    Stores incident_time (a BSON date parsed from timestamp) on incidents that lack it,
+    so the replay can read them sorted by time from an index.
+    :return: Number of incidents updated.
+    """
+    updated = 0
+    operations = []
+    for incident in collection.find({"incident_time": {"$exists": False}}, {"timestamp": 1}):
+        incident_time = EventSearcher.parse_timestamp(incident.get("timestamp"))
+        if incident_time is None:
+            continue
+        operations.append(UpdateOne({"_id": incident["_id"]}, {"$set": {"incident_time": incident_time}}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    logging.info(f"Stamped incident_time on {updated} incidents.")
+    return updated
+
+
+def iter_mongo_incidents(collection, since=None, until=None, batch_size=5000, create_index=True):
+    """
+    Streams incidents with an incident_time from Mongo, oldest first.
+    :param create_index: Create the incident_time index first (off for dry runs, which write nothing).
+    """
+    if create_index:
+        collection.create_index([("incident_time", ASCENDING)], name="incident_time")
+    query = {"incident_time": {"$ne": None}}
+    if since is not None:
+        query["incident_time"]["$gte"] = since
+    if until is not None:
+        query["incident_time"]["$lt"] = until
+    return collection.find(query, INCIDENT_PROJECTION, batch_size=batch_size).sort("incident_time", ASCENDING)
+
+
+def iter_jsonl_incidents(path, presorted=False):
+    """
+    Reads incidents from a mongoexport (Extended JSON) file, one document per line.
+    Unless presorted, the incidents are sorted by time in memory first.
+    """
+    def read():
+        with open(path, "r") as export:
+            for line in export:
+                if line.strip():
+                    incident = json_util.loads(line)
+                    incident.pop("base64String", None)
+                    incident["incident_time"] = EventSearcher.get_incident_time(incident)
+                    yield incident
+
+    if presorted:
+        return read()
+    incidents = [incident for incident in read() if incident["incident_time"] is not None]
+    incidents.sort(key=lambda incident: incident["incident_time"])
+    return iter(incidents)
+
+
+class EventReplayer:
+    """
+    Rebuilds events from a time-ordered stream of incidents with the live dedup rule
+    (same incident type, most recent incident within the window and distance threshold).
+    """
+
+    def __init__(self, processor, target_collection=None, window=None, max_distance_meters=None, batch_size=1000,
+                 buckets_collection=None, incident_codes=None, sequence=None):
+        """
+        :param processor: EventProcessor used to allocate agencies to new events.
+        :param target_collection: Collection the events are written to; None for a dry run.
+        :param window: Dedup time window (default EventSearcher.TIME_WINDOW).
+        :param max_distance_meters: Dedup distance threshold (default EventSearcher.MAX_DISTANCE_METERS).
+        :param batch_size: Finished events allocated and written per bulk insert.
+        :param buckets_collection: Collection the incident buckets of the events are written to.
+        :param incident_codes: {incident type: code} used in event IDs ("UNK" for other types).
+        :param sequence: Allocator of the daily event ID numbers (default: in memory, starting at 1,
+                         so a replay never consumes the live counters).
+        """
+        self.processor = processor
+        self.target_collection = target_collection
+        self.window = window or EventSearcher.TIME_WINDOW
+        self.max_distance_meters = max_distance_meters or EventSearcher.MAX_DISTANCE_METERS
+        self.batch_size = batch_size
+        self.incident_codes = incident_codes or {}
+        self.sequence = sequence or MemorySequenceAllocator()
+        self.index = SpatioTemporalIndex(self.max_distance_meters, self.window, max_events=float("inf"))
+        self.event_handler = EventHandler(target_collection, None, buckets_collection)
+        self._open_events = OrderedDict()  # key -> event, least recently updated first
+        self._finished = []
+        self._next_key = 0
+        self._watermark = None
+        self.stats = {"incidents": 0, "skipped": 0, "events": 0, "written": 0}
+
+    def add(self, incident):
+        """Adds the next incident (in time order) to a matching open event or starts a new one."""
+        incident_type = incident.get("incident_type")
+        incident_time = incident.get("incident_time")
+        location = incident.get("location")
+        if not incident_type or incident_time is None or not location:
+            self.stats["skipped"] += 1
+            return
+        latitude, longitude = EventSearcher.extract_coordinates(location)
+        self.stats["incidents"] += 1
+        if self._watermark is None or incident_time > self._watermark:
+            self._watermark = incident_time
+
+        key = self.index.find(incident_type, incident_time, latitude, longitude)
+        event = self._open_events.get(key)
+        if event is not None:
+            event["incidents"].append(incident)
+            event["incident_count"] += 1
+            event["last_incident_time"] = incident_time
+            event["last_location"] = location
+            self._open_events.move_to_end(key)
+        else:
+            key = self._next_key
+            self._next_key += 1
+            self._open_events[key] = {
+                "incident_type": incident_type,
+                "incidents": [incident],
+                "incident_count": 1,
+                "last_incident_time": incident_time,
+                "last_location": location
+            }
+            self.stats["events"] += 1
+        self.index.add(key, incident_type, incident_time, latitude, longitude)
+        self._close_expired()
+
+    def _close_expired(self):
+        """Moves events no later incident can join any more to the write batch."""
+        horizon = self._watermark - self.window
+        while self._open_events:
+            key, event = next(iter(self._open_events.items()))
+            if event["last_incident_time"] >= horizon:
+                break
+            del self._open_events[key]
+            self._finished.append(event)
+        if len(self._finished) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        """Allocates agencies to the finished events in one batch and bulk-inserts them with their buckets."""
+        if not self._finished:
+            return
+        finished, self._finished = self._finished, []
+        first_incidents = [event["incidents"][0] for event in finished]
+        allocations = self.processor.process_events([
+            self.event_handler._extract_event_data(incident, event["incident_type"])
+            for incident, event in zip(first_incidents, finished)
+        ])
+
+        documents = []
+        buckets = []
+        for event, first_incident, assigned_agency in zip(finished, first_incidents, allocations):
+            day = first_incident["incident_time"].strftime("%Y%m%d")
+            event_id = self.event_handler._format_event_id(
+                day, self.incident_codes.get(event["incident_type"], "UNK"), self.sequence.next(day)
+            )
+            document = self.event_handler._build_new_event(first_incident, event["incident_type"], assigned_agency, event_id)
+            document.update(event)
+            document["_id"] = ObjectId()
+            document["incidents"] = event["incidents"][-config.EVENT_INLINE_INCIDENTS:]
+            buckets.extend(self.event_handler._build_buckets(document["_id"], event["incidents"]))
+            documents.append(document)
+
+        if self.target_collection is not None:
+            self.target_collection.insert_many(documents, ordered=False)
+            self.event_handler.buckets_collection.insert_many(buckets, ordered=False)
+            self.stats["written"] += len(documents)
+
+    def finish(self):
+        """Writes the events that are still open at the end of the stream."""
+        self._finished.extend(self._open_events.values())
+        self._open_events.clear()
+        self._flush()
+        return self.stats
+
+    def run(self, incidents, log_every=100000):
+        started = time.perf_counter()
+        for count, incident in enumerate(incidents, 1):
+            self.add(incident)
+            if count % log_every == 0:
+                logging.info(f"Replayed {count} incidents ({count / (time.perf_counter() - started):.0f}/s), "
+                             f"{self.stats['events']} events, {len(self._open_events)} open.")
+        stats = self.finish()
+        stats["seconds"] = round(time.perf_counter() - started, 2)
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jsonl", help="Replay a mongoexport JSONL file instead of the Incident collection")
+    parser.add_argument("--presorted", action="store_true", help="The JSONL file is already sorted by time")
+    parser.add_argument("--since", help="Only incidents at or after this ISO time (Mongo source)")
+    parser.add_argument("--until", help="Only incidents before this ISO time (Mongo source)")
+    parser.add_argument("--target", default="events_replay", help="Collection the rebuilt events are written to")
+    parser.add_argument(
+        "--drop-target", action="store_true",
+        help="Delete the target's events before writing (refused for the live collections)"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Compute the events without writing anything")
+    parser.add_argument("--window-minutes", type=float, default=config.DEDUP_WINDOW_MINUTES)
+    parser.add_argument("--distance-meters", type=float, default=config.DEDUP_MAX_DISTANCE_METERS)
+    parser.add_argument("--criticality", default="Incident_criticalness.json", help="Critical incident types file")
+    parser.add_argument("--codes", default="incident_codes.json", help="Incident codes used in event IDs")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    live_collections = ("events", config.MONGO_COLLECTION, config.INCIDENT_BUCKET_COLLECTION)
+    if args.drop_target and (args.target in live_collections or f"{args.target}_incidents" in live_collections):
+        parser.error(f"--drop-target would delete live data through --target {args.target}; replay into another collection.")
+
+    db_client = MongoDBClient(config.MONGO_URI)
+    processor = EventProcessor(
+        ConfigLoader(config_path=args.criticality), AgencyFinder(db_client), JurisdictionFinder(db_client)
+    )
+
+    if args.jsonl:
+        incidents = iter_jsonl_incidents(args.jsonl, args.presorted)
+    else:
+        incident_collection = db_client.get_collection(config.MONGO_COLLECTION)
+        if args.dry_run:
+            missing = incident_collection.count_documents({"incident_time": {"$exists": False}})
+            if missing:
+                logging.warning(f"{missing} incidents have no incident_time and are skipped in a dry run.")
+        else:
+            stamp_incident_times(incident_collection)
+        since = EventSearcher.parse_timestamp(args.since) if args.since else None
+        until = EventSearcher.parse_timestamp(args.until) if args.until else None
+        incidents = iter_mongo_incidents(incident_collection, since, until, create_index=not args.dry_run)
+
+    with open(args.codes, "r") as codes_file:
+        incident_codes = json.load(codes_file)
+
+    target = buckets = sequence = None
+    if not args.dry_run:
+        if args.target == "events":
+            logging.warning("Writing into the live events collection.")
+            buckets = db_client.get_collection(config.INCIDENT_BUCKET_COLLECTION)
+            # IDs must not collide with the ones the consumers issue, nor with stored events of old
+            # days whose counter expired
+            sequence = create_sequence_allocator(
+                db_client.db, "event", Application.EVENT_SEQUENCE_FILE,
+                issued_floor=lambda day: last_issued_sequence(target, "event_id", f"E-{day}-")
+            )
+        else:
+            buckets = db_client.get_collection(f"{args.target}_incidents")
+        target = db_client.get_collection(args.target)
+        if args.drop_target:
+            target.delete_many({})
+            buckets.delete_many({})
+
+    replayer = EventReplayer(
+        processor, target, timedelta(minutes=args.window_minutes), args.distance_meters, args.batch_size, buckets,
+        incident_codes, sequence
+    )
+    stats = replayer.run(incidents)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
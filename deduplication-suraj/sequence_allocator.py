@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import config
+
+
+class FileSequenceAllocator:
+    """
+    Legacy allocator: keeps one counter per key in a JSON file and rewrites it on every ID.
+    Only safe with a single consumer process.
+    """
+
+    def __init__(self, tracker_file):
+        self.tracker_file = tracker_file
+        self._lock = threading.Lock()
+
+    def load_sequence_tracker(self):
+        """Loads the sequence tracker from a file."""
+        if os.path.exists(self.tracker_file):
+            with open(self.tracker_file, "r") as file:
+                return json.load(file)
+        return {}
+
+    def save_sequence_tracker(self, tracker):
+        """Saves the sequence tracker to a file."""
+        with open(self.tracker_file, "w") as file:
+            json.dump(tracker, file)
+
+    def next(self, key):
+        """Returns the next sequence number for key."""
+        with self._lock:
+            sequence_tracker = self.load_sequence_tracker()
+            sequence_tracker[key] = sequence_tracker.get(key, 0) + 1
+            self.save_sequence_tracker(sequence_tracker)
+            return sequence_tracker[key]
+
+
+class MemorySequenceAllocator:
+    """
+    Counters kept in this process only, starting at 1 per key. For replays and dry runs,
+    whose IDs must not consume the live counters.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def next(self, key):
+        """Returns the next sequence number for key."""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class MongoSequenceAllocator:
+    """
+    Allocates sequence numbers from an atomic Mongo counter ($inc via find_one_and_update).
+    Each call to Mongo reserves a block of block_size numbers that are then handed out from
+    memory, so most IDs need no I/O and IDs stay unique across processes and nodes.
+    Numbers are unique and increasing per process, but processes interleave and a stopped
+    process leaves the unused rest of its block as a gap.
+    Counters of past days expire (TTL index), so a counter can be missing when late incidents or
+    a replay issue IDs for an old day: it is then recreated above the numbers issued_floor reports.
+    """
+
+    def __init__(self, collection, namespace, block_size=50, retention_days=7, seed_file=None, issued_floor=None):
+        """
+        :param collection: Counters collection shared by every consumer.
+        :param namespace: Prefix of the counter documents, e.g. "incident" or "event".
+        :param block_size: Numbers reserved per round-trip.
+        :param retention_days: Counter documents expire this many days after their day (key YYYYMMDD)
+                               or their last use, whichever is later (via a TTL index).
+        :param seed_file: Optional legacy JSON tracker whose values the counters must start above.
+        :param issued_floor: Optional function returning the highest number already issued for a key
+                             (see last_issued_sequence); a missing counter is created above it.
+        """
+        self.collection = collection
+        self.namespace = namespace
+        self.block_size = block_size
+        self.retention_days = retention_days
+        self.seed_file = seed_file
+        self.issued_floor = issued_floor
+        self._blocks = {}  # key -> [next, last]
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _ensure_ready(self):
+        """Creates the TTL index and seeds from the legacy tracker on first use (no I/O at import)."""
+        if self._ready:
+            return
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+        if self.seed_file:
+            self.seed_from_file(self.seed_file)
+        self._ready = True
+
+    def _expires_at(self, key):
+        """Expiry of a counter used now: retention_days after the end of its day or now, whichever is later."""
+        now = datetime.utcnow()
+        try:
+            day_end = datetime.strptime(key, "%Y%m%d") + timedelta(days=1)
+        except ValueError:
+            day_end = now
+        return max(day_end, now) + timedelta(days=self.retention_days)
+
+    def _create_counter(self, key):
+        """Creates a missing counter, above the numbers already issued for key."""
+        issued = self.issued_floor(key) if self.issued_floor is not None else 0
+        try:
+            self.collection.update_one(
+                {"_id": f"{self.namespace}:{key}"},
+                {"$max": {"seq": issued}, "$setOnInsert": {"expires_at": self._expires_at(key)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # Created by another process meanwhile, from the same issued numbers
+        if issued:
+            logging.info(f"Recreated the {self.namespace} counter of {key} above {issued} issued numbers.")
+
+    def _reserve_block(self, key):
+        self._ensure_ready()
+        while True:
+            # Never upserted here: only _create_counter() creates counters, so no block comes from an unseeded one
+            counter = self.collection.find_one_and_update(
+                {"_id": f"{self.namespace}:{key}"},
+                {"$inc": {"seq": self.block_size}, "$max": {"expires_at": self._expires_at(key)}},
+                return_document=ReturnDocument.AFTER
+            )
+            if counter is not None:
+                last = counter["seq"]
+                return [last - self.block_size + 1, last]
+            self._create_counter(key)
+
+    def next(self, key):
+        """Returns the next sequence number for key."""
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] > block[1]:
+                block = self._reserve_block(key)
+                # Blocks for past days are never used again
+                self._blocks = {key: block}
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def seed_from_file(self, tracker_file):
+        """Raises counters to the values of a legacy JSON tracker so new IDs never repeat old ones."""
+        if not os.path.exists(tracker_file):
+            return
+        with open(tracker_file, "r") as file:
+            tracker = json.load(file)
+        for key, value in tracker.items():
+            self.collection.update_one(
+                {"_id": f"{self.namespace}:{key}"},
+                {"$max": {"seq": value}, "$setOnInsert": {"expires_at": self._expires_at(key)}},
+                upsert=True
+            )
+        logging.info(f"Seeded {len(tracker)} {self.namespace} counters from {tracker_file}.")
+
+
+def last_issued_sequence(collection, field, prefix):
+    """
+    Highest sequence number among the IDs in field that start with prefix, e.g. the events of a
+    day for prefix "E-20250307-" (IDs end with "-<number>"). 0 when there are none.
+    """
+    collection.create_index(field)
+    # IDs starting with prefix sort between prefix and prefix with its last character incremented
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    last = 0
+    for document in collection.find({field: {"$gte": prefix, "$lt": upper}}, {field: 1, "_id": 0}):
+        number = document[field].rsplit("-", 1)[-1]
+        if number.isdigit():
+            last = max(last, int(number))
+    return last
+
+
+def create_sequence_allocator(db, namespace, tracker_file, issued_floor=None):
+    """
+    Builds the allocator selected by config.SEQUENCE_BACKEND ("mongo" or "file").
+    :param db: Mongo database holding the counters collection.
+    :param tracker_file: Legacy JSON tracker, used by the file backend and to seed Mongo counters.
+    :param issued_floor: Highest number already issued for a key (Mongo backend, see MongoSequenceAllocator).
+    """
+    if config.SEQUENCE_BACKEND == "file":
+        return FileSequenceAllocator(tracker_file)
+    return MongoSequenceAllocator(
+        db[config.SEQUENCE_COLLECTION], namespace, block_size=config.SEQUENCE_BLOCK_SIZE, seed_file=tracker_file,
+        issued_floor=issued_floor
+    )
@@ -0,0 +1,125 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from rapidfuzz import fuzz, process, utils
+    HAS_RAPIDFUZZ = True
+except ImportError:  # Fall back to the slower fuzzywuzzy scorer
+    from fuzzywuzzy import process
+    HAS_RAPIDFUZZ = False
+
+
+class TermNormalizer:
+    """
+    Maps detected labels to known priority terms in three layers:
+    1. exact/alias dictionary (known terms, "_"/" " spellings, plurals, optional alias file)
+    2. bounded LRU cache of earlier fuzzy results
+    3. fuzzy scoring (rapidfuzz WRatio, batched with cdist) for real misses only
+    Results match fuzzywuzzy's extractOne with its default WRatio scorer.
+    """
+
+    def __init__(self, known_terms: List[str], aliases: Optional[Dict[str, str]] = None, cache_size: int = 4096):
+        self.known_terms = list(known_terms)
+        self.cache_size = cache_size
+        self.exact = self._build_exact_table(self.known_terms, aliases or {})
+        self._cache = OrderedDict()  # term -> (best match, score)
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+
+    @staticmethod
+    def _build_exact_table(known_terms, aliases):
+        exact = {}
+        for term in known_terms:
+            for variant in (term, term.replace("_", " "), term.replace(" ", "_")):
+                exact.setdefault(variant, term)
+                exact.setdefault(variant + "s", term)
+        for alias, term in aliases.items():
+            if term in known_terms:
+                exact[alias.strip().lower()] = term
+            else:
+                logging.warning(f"Ignoring alias '{alias}': '{term}' is not a known term.")
+        # Known terms always map to themselves
+        exact.update({term: term for term in known_terms})
+        return exact
+
+    @staticmethod
+    def load_aliases(path: str) -> Dict[str, str]:
+        """Loads an optional {alias: known term} JSON file; returns {} if it does not exist."""
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logging.warning(f"Invalid JSON in {path}. Using no aliases.")
+            return {}
+
+    def _score(self, terms: List[str]) -> List[Tuple[str, int]]:
+        """Best (match, score) for each term; one cdist call for the whole batch."""
+        if not self.known_terms:
+            return [(None, 0) for _ in terms]
+        if not HAS_RAPIDFUZZ:
+            return [process.extractOne(term, self.known_terms, processor=lambda x: x)[:2] for term in terms]
+        if len(terms) == 1:
+            match, score, _ = process.extractOne(
+                terms[0], self.known_terms, scorer=fuzz.WRatio, processor=utils.default_process
+            )
+            return [(match, round(score))]
+        scores = process.cdist(terms, self.known_terms, scorer=fuzz.WRatio, processor=utils.default_process)
+        best = scores.argmax(axis=1)
+        return [(self.known_terms[j], round(float(scores[i, j]))) for i, j in enumerate(best)]
+
+    def normalize_many(self, terms: List[str]) -> List[Tuple[str, int]]:
+        """
+        Returns the best known term and its score (100 for exact/alias hits) for every term.
+        The caller applies its own score threshold.
+        """
+        results = [None] * len(terms)
+        missing = OrderedDict()  # term -> positions
+        with self._lock:
+            for position, term in enumerate(terms):
+                exact_match = self.exact.get(term)
+                if exact_match is not None:
+                    self.exact_hits += 1
+                    results[position] = (exact_match, 100)
+                elif term in self._cache:
+                    self.cache_hits += 1
+                    self._cache.move_to_end(term)
+                    results[position] = self._cache[term]
+                else:
+                    missing.setdefault(term, []).append(position)
+
+        if missing:
+            started = time.perf_counter()
+            scored = self._score(list(missing))
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.misses += len(missing)
+                self.miss_seconds += elapsed
+                for (term, positions), result in zip(missing.items(), scored):
+                    self._cache[term] = result
+                    for position in positions:
+                        results[position] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return results
+
+    def stats(self) -> Dict[str, float]:
+        """Hit counts, overall hit rate and mean fuzzy-miss latency."""
+        with self._lock:
+            lookups = self.exact_hits + self.cache_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "cache_hits": self.cache_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.cache_hits) / lookups if lookups else 0.0,
+                "mean_miss_ms": 1000 * self.miss_seconds / self.misses if self.misses else 0.0,
+                "cache_size": len(self._cache)
+            }
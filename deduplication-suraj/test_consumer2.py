@@ -1,96 +1,82 @@
 import pika
 import json
-from pymongo import MongoClient
+import logging
+import threading
+import time
+from pymongo import InsertOne
+from bson import ObjectId
 from Mongo_interaction import EventSearcher
-from test_dedup3 import EventHandler  # Import deduplication function
-from incident_classifier import IncidentClassifier  # Import classifier
-from incident_classifier import IncidentPrioritizer
-from demo_objectstorage3 import process_image
+from cell_leases import CellLeases
+from geo_distance import HAVERSINE_MAX_RELATIVE_ERROR
+from app import get_app
+from demo_objectstorage3 import process_image, process_image_async
 from demo_objectstorage3 import FilenameGenerator
-from datetime import datetime
+from incident_message import loads_incident, parse_incident, has_required_fields
+from worker_supervisor import WorkerSupervisor
+from partition_router import PARTITION_QUEUE_ARGUMENTS, run_router
+from partitioning import partition_queue
+from write_buffer import MongoWriteBuffer
+import metrics
 import config  # Using your config file
 
-# MongoDB Connection
-mongo_client = MongoClient(config.MONGO_URI)
-db = mongo_client[config.MONGO_DB]
-incidents_collection = db[config.MONGO_COLLECTION]  # Collection to store raw incidents
-
-# Initializing deduplication module
-searcher = EventSearcher(db)
-events = db["events"]
-event_handler = EventHandler(events, searcher)
-
-# Initializing the classifier
-prioritizer = IncidentPrioritizer('priority.json')
-classifier = IncidentClassifier(prioritizer)  # ✅ Create an instance
-
-
+# Mongo, the dedup index, the event handler and the near-duplicate filter come from the
+# application; run_consumer() builds them (get_app().warm_up()) before consuming
 generator = FilenameGenerator()
 
+# Per-worker state (each worker thread owns its connection and write buffer)
+worker_state = threading.local()
+
 # RabbitMQ connection
-def connect_rabbitmq():
+def connect_rabbitmq(queue=config.INPUT_QUEUE, arguments=None):
     connection = pika.BlockingConnection(pika.ConnectionParameters(
         host=config.RABBITMQ_HOST,
         port=config.RABBITMQ_PORT
     ))
     channel = connection.channel()
-    channel.queue_declare(queue=config.INPUT_QUEUE)  # Ensure queue exists
+    channel.queue_declare(queue=queue, arguments=arguments)  # Ensure queue exists
+    channel.basic_qos(prefetch_count=config.PREFETCH_COUNT)  # Bound unacked messages per worker
     return channel
 
 # Message processing
 def callback(ch, method, properties, body):
+    metrics.MESSAGES.inc()
     try:
-        incident = json.loads(body)  # Deserialize message
-        print("Received Event.")
-
-        # Extract required fields
-        detected_objects = incident.get("detected_objects", "")
+        with metrics.timed("parse"):
+            incident = loads_incident(body)  # Deserialize message (the image stays a view over the body)
+            print("Received Event.")
 
-        # Ensure detected_objects is a string before applying lower()
-        if isinstance(detected_objects, list):
-            detected_objects = " ".join(detected_objects)  # Convert list to space-separated string
+            detected_object, timestamp, location, base64_image = parse_incident(incident)
 
-        detected_object = detected_objects.lower()
-
-        # Extract timestamp correctly
-        timestamp = incident.get("timestamp", None)
-
-        if isinstance(timestamp, dict):  # If timestamp is a dictionary, extract "$date"
-            timestamp = timestamp.get("$date")
-        elif isinstance(timestamp, str):  # Convert string timestamp to required format
-            try:
-                dt_obj = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-                timestamp = {"$date": dt_obj.isoformat().replace("+00:00", "Z")}
-            except ValueError:
-                timestamp = None  # Handle invalid format
-
-        # At this point, timestamp is either a dictionary with "$date" or None
+        # At this point, timestamp is either a datetime (UTC) or None
         print("Parsed Timestamp:", timestamp)
-
-        # Extract coordinates correctly
-        coordinates = incident.get("location", {}).get("coordinates", [])
-        longitude, latitude = coordinates if len(coordinates) == 2 else (None, None)
-
-        location = {
-            "type": "Point",
-            "coordinates": [longitude, latitude]
-        }
-
-        # Extract base64 image
-        base64_image = incident.get("base64String", "")
         print("[DEBUG] Base64 String Length:", len(base64_image))
-       
+
         # Debugging output
         print(f"[DEBUG] Extracted Data -> Object: {detected_object}, Timestamp: {timestamp}, Location: {location}")
 
         # Check if required fields are missing
-        if not (detected_object and location["coordinates"] != [None, None] and timestamp and base64_image):
+        if not has_required_fields(detected_object, timestamp, location, base64_image):
             print("[ERROR] Missing required fields in incident data.")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            nack_message(ch, method.delivery_tag, "missing_fields")
             return
         print(timestamp)
+
+        # Near-identical frames of a recent incident skip classification, upload and storage
+        signature = None
+        near_duplicate_filter = get_app().near_duplicate_filter
+        if near_duplicate_filter is not None:
+            with metrics.timed("near_duplicate_check"):
+                frame_time = EventSearcher.parse_timestamp(timestamp)
+                signature = near_duplicate_filter.signature(incident, location, frame_time, base64_image)
+                event_ref = near_duplicate_filter.find(signature) if signature is not None else None
+            if event_ref is not None:
+                attach_duplicate_frame(ch, method.delivery_tag, incident, timestamp, location, signature, event_ref)
+                return
+
         # Classify the incident using the classifier instance
-        incident_type = classifier.process_incidents(detected_object, timestamp)  # ✅ Call method from instance
+        with metrics.timed("classify"):
+            # Classifier of the current reference data (swapped in the background on priority.json changes)
+            incident_type = get_app().reference_data.current().classifier.process_incidents(detected_object, timestamp)
 
         # If it's a valid incident, store it in MongoDB
         if incident_type:
@@ -99,43 +85,221 @@ def callback(ch, method, properties, body):
             incident["timestamp"] = timestamp  # ✅ Ensure timestamp is stored in the right format
 
             # Upload to object storage and get incident ID
-            image_url = process_image({
-                "base64_img": f"data:image/jpeg;base64,{base64_image}",
+            image = {
+                "base64_img": base64_image,  # Passed as is; the uploader handles an optional data URI prefix
                 "detected_object": detected_object
-            })
-
-            if image_url:
-                incident["image_url"] = image_url
-                incident["incident_id"] = generator.generate_incident_id(detected_object)  # Generate incident ID
-            else:
-                print("[ERROR] Image processing failed, skipping MongoDB insert.")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            }
+            if config.UPLOAD_WORKERS > 0:
+                # Storing continues on this connection's thread once the upload is done;
+                # meanwhile the consumer goes on with the next (prefetched) messages
+                upload = process_image_async(image)
+                worker_state.counts["pending_uploads"] += 1
+                connection = ch.connection
+                delivery_tag = method.delivery_tag
+                upload.add_done_callback(lambda future: connection.add_callback_threadsafe(
+                    lambda: finish_upload(ch, delivery_tag, incident, incident_type, detected_object, future, signature)
+                ))
                 return
+            store_incident(
+                ch, method.delivery_tag, incident, incident_type, detected_object, process_image(image), signature
+            )
+        else:
+            print("[INFO] Event is not an incident, skipping MongoDB insert.")
+            metrics.NON_INCIDENTS.inc()
+            # Acknowledge message after processing
+            ack_message(ch, method.delivery_tag)
+
+    except Exception as e:
+        print("[ERROR] Processing message:", str(e))
+        discard_queued_writes()
+        nack_message(ch, method.delivery_tag, "error")  # Don't requeue on failure
 
-            # Insert into MongoDB
-            incident.pop("base64String", None)  # Remove base64String if it exists
+def finish_upload(ch, delivery_tag, incident, incident_type, detected_object, upload, signature=None):
+    """Runs on the connection's thread when an upload queued by callback() completes."""
+    worker_state.counts["pending_uploads"] -= 1
+    if not ch.is_open:
+        return  # The broker requeues the unacked message
+    try:
+        store_incident(ch, delivery_tag, incident, incident_type, detected_object, upload.result(), signature)
+    except Exception as e:
+        logging.error(f"Processing message: {e}")
+        discard_queued_writes()
+        nack_message(ch, delivery_tag, "error")  # Don't requeue on failure
+
+def store_incident(ch, delivery_tag, incident, incident_type, detected_object, image_url, signature=None):
+    """Inserts an uploaded incident, deduplicates it into an event and acks the message."""
+    write_buffer = getattr(worker_state, "write_buffer", None)
+    incidents_collection = get_app().incidents_collection
+    if image_url:
+        incident["image_url"] = image_url
+        incident["incident_id"] = generator.generate_incident_id(detected_object)  # Generate incident ID
+    else:
+        logging.error("Image processing failed, skipping MongoDB insert.")
+        nack_message(ch, delivery_tag, "upload_failed")
+        return
+
+    # Insert into MongoDB
+    incident.pop("base64String", None)  # Remove base64String if it exists
+    if write_buffer is not None:
+        incident.setdefault("_id", ObjectId())  # Same _id in the Incident collection and the event
+        write_buffer.add(incidents_collection, InsertOne(incident))
+        logging.debug("Incident queued for MongoDB.")
+    else:
+        with metrics.timed("incident_insert"):
             incidents_collection.insert_one(incident)
-            print("Incident pushed to MongoDB")
+        logging.debug("Incident pushed to MongoDB.")
+
+    # Near a partition cell edge, workers of the neighbouring cells wait until this event is written
+    cell_leases = getattr(worker_state, "cell_leases", None)
+    lease_keys = []
+    if cell_leases is not None:
+        latitude, longitude = EventSearcher.extract_coordinates(incident["location"])
+        lease_keys = cell_leases.cells(incident_type, latitude, longitude)
+        cell_leases.acquire(lease_keys)
+    try:
+        # Pass event to deduplication function
+        output = get_app().event_handler.handle_event(incident,incident_type, write_buffer)
+        logging.info(f"Deduplication output: {output}")
+        if signature is not None:
+            def add_signature():
+                get_app().near_duplicate_filter.add(signature, output["event_ref"])
+
+            if write_buffer is not None:
+                write_buffer.after_write(add_signature)  # Never point later frames at an event that was not written
+            else:
+                add_signature()
+
+        ack_message(ch, delivery_tag, write_buffer, flush=bool(lease_keys))
+    finally:
+        if lease_keys:
+            cell_leases.release(lease_keys)
+
+def attach_duplicate_frame(ch, delivery_tag, incident, timestamp, location, signature, event_ref):
+    """Attaches a near-duplicate frame to the event of the frame it repeats and acks the message."""
+    write_buffer = getattr(worker_state, "write_buffer", None)
+    get_app().event_handler.attach_duplicate_frame(event_ref, {
+        "userId": incident.get("userId"),
+        "timestamp": timestamp,
+        "incident_time": signature.frame_time,
+        "location": location,
+        "frame_hash": f"{signature.frame_hash:016x}"
+    }, write_buffer)
+    metrics.NEAR_DUPLICATES.inc()
+    ack_message(ch, delivery_tag, write_buffer)
+
+def ack_message(ch, delivery_tag, write_buffer=None, flush=False):
+    """
+    Acks a processed message, after its batch is flushed when writes are buffered.
+    :param flush: Flush the batch now, e.g. while other workers wait for the message's event.
+    """
+    if write_buffer is not None:
+        # Ack only once the batch holding this message is flushed
+        write_buffer.add_message(
+            lambda: ack_message(ch, delivery_tag),
+            lambda requeue: nack_message(ch, delivery_tag, "write_retry" if requeue else "write_failed", requeue)
+        )
+        if flush or write_buffer.is_due():
+            with metrics.timed("write_buffer_flush"):
+                write_buffer.flush()
+    else:
+        ch.basic_ack(delivery_tag=delivery_tag)
+        metrics.ACKS.inc()
 
-            print("Sending to handle_event.")
+def nack_message(ch, delivery_tag, reason, requeue=False):
+    """Rejects a message, without requeueing it unless requeue is set."""
+    ch.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+    metrics.NACKS.inc(reason=reason)
 
-            # Pass event to deduplication function
-            output = event_handler.handle_event(incident,incident_type)
-            print("Deduplication Output:", output)
+def discard_queued_writes():
+    """Drops the buffered writes of a message that failed before it was added to the batch."""
+    write_buffer = getattr(worker_state, "write_buffer", None)
+    if write_buffer is not None:
+        write_buffer.rollback()
 
+def run_consumer(worker_id=0, stop_event=None, queue=config.INPUT_QUEUE, queue_arguments=None):
+    """
+    Runs one consumer on its own connection and channel until stop_event is set.
+    Acks/nacks always go back on the channel that delivered the message.
+    :param queue: Queue to consume, the input queue or a partition queue.
+    """
+    get_app().warm_up()  # Connections, indexes and reference data are ready before the first message
+    channel = connect_rabbitmq(queue, queue_arguments)
+    connection = channel.connection
+
+    write_buffer = None
+    if config.WRITE_BUFFER_ENABLED:
+        write_buffer = MongoWriteBuffer(config.WRITE_BATCH_SIZE, config.WRITE_FLUSH_INTERVAL)
+        metrics.QUEUE_DEPTH.set_function(lambda: len(write_buffer), queue="write_buffer", worker=worker_id)
+    worker_state.write_buffer = write_buffer
+    worker_state.cell_leases = None
+    if config.PARTITIONED_CONSUMERS:
+        worker_state.cell_leases = CellLeases(
+            get_app().db[config.DEDUP_LEASE_COLLECTION], config.PARTITION_CELL_KM,
+            EventSearcher.MAX_DISTANCE_METERS * (1 + HAVERSINE_MAX_RELATIVE_ERROR), config.DEDUP_LEASE_TTL_SECONDS
+        )
+    # Plain dict so the metrics thread can read it (worker_state itself is thread-local)
+    counts = worker_state.counts = {"pending_uploads": 0}
+    metrics.QUEUE_DEPTH.set_function(lambda: counts["pending_uploads"], queue="pending_uploads", worker=worker_id)
+
+    if config.METRICS_ENABLED:
+        # Worker processes each serve their own registry on the next port
+        multi_worker = config.CONSUMER_WORKERS > 1 or config.PARTITIONED_CONSUMERS
+        port_offset = worker_id if multi_worker and config.CONSUMER_WORKER_MODE == "process" else 0
+        metrics.start_metrics_server(config.METRICS_PORT + port_offset, config.METRICS_HOST)
+
+    def flush_due():
+        if write_buffer.is_due():
+            write_buffer.flush()
+        connection.call_later(write_buffer.max_delay / 4, flush_due)
+
+    def check_stop():
+        if stop_event.is_set():
+            channel.stop_consuming()  # Current message is already acked or buffered at this point
         else:
-            print("[INFO] Event is not an incident, skipping MongoDB insert.")
+            connection.call_later(1, check_stop)
 
-        # Acknowledge message after processing
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+    if write_buffer is not None:
+        connection.call_later(write_buffer.max_delay / 4, flush_due)
+    if stop_event is not None:
+        connection.call_later(1, check_stop)
 
-    except Exception as e:
-        print("[ERROR] Processing message:", str(e))
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)  # Don't requeue on failure
+    channel.basic_consume(queue=queue, on_message_callback=callback)
+    logging.info(f"Worker {worker_id} waiting for messages on {queue}...")
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        channel.stop_consuming()
+    finally:
+        # Let uploads that are already running finish and store their incidents
+        deadline = time.monotonic() + config.S3_READ_TIMEOUT
+        while counts["pending_uploads"] and connection.is_open and time.monotonic() < deadline:
+            connection.process_data_events(time_limit=0.1)
+        if write_buffer is not None and channel.is_open:
+            write_buffer.flush()  # Ack everything that is already buffered
+        # Unacked prefetched messages are requeued by the broker on close
+        connection.close()
+        logging.info(f"Worker {worker_id} stopped.")
 
-# Start consuming messages
-channel = connect_rabbitmq()
-channel.basic_consume(queue=config.INPUT_QUEUE, on_message_callback=callback)
+def run_partition_worker(worker_id, stop_event=None):
+    """
+    Supervisor target in partitioned mode: workers 0..PARTITIONS-1 each consume their own
+    partition queue, the remaining ROUTER_WORKERS workers route the input queue to them.
+    """
+    if worker_id < config.PARTITIONS:
+        run_consumer(worker_id, stop_event, partition_queue(config.INPUT_QUEUE, worker_id), PARTITION_QUEUE_ARGUMENTS)
+    else:
+        run_router(worker_id, stop_event)
 
-print("Waiting for messages...")
-channel.start_consuming()
\ No newline at end of file
+
+# Start consuming messages
+if __name__ == "__main__":
+    if config.PARTITIONED_CONSUMERS:
+        supervisor = WorkerSupervisor(
+            run_partition_worker, config.PARTITIONS + config.ROUTER_WORKERS, mode=config.CONSUMER_WORKER_MODE
+        )
+        supervisor.run()
+    elif config.CONSUMER_WORKERS > 1:
+        supervisor = WorkerSupervisor(run_consumer, config.CONSUMER_WORKERS, mode=config.CONSUMER_WORKER_MODE)
+        supervisor.run()
+    else:
+        run_consumer()
@@ -1,160 +1,383 @@
-import json
+import logging
+import sys
 import uuid
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient
-from geopy.distance import geodesic
+from pymongo import MongoClient, InsertOne, UpdateOne, ASCENDING
+from pymongo.errors import PyMongoError
+from bson import ObjectId
 from Mongo_interaction import EventSearcher
-from Agency_event_allocation_db_2 import EventProcessor
-from Agency_event_allocation_db_2 import ConfigLoader
-from Agency_event_allocation_db_2 import AgencyFinder
-from Agency_event_allocation_db_2 import JurisdictionFinder
-from Agency_event_allocation_db_2 import MongoDBClient
+from app import get_app
 import secrets
 import os
 import config  # Using your config file
+import metrics
 
-# MongoDB Connection
-db_client = MongoDBClient(config.MONGO_URI)  # Use the wrapper with config
-client = db_client.client  # Extract the raw client if needed
-db = client[config.MONGO_DB]
-events = db["events"]
-incidents = db[config.MONGO_COLLECTION]  # Use configured collection name
-searcher = EventSearcher(db)
-
-# initialize Agency_event_allocation_db_2 requirements 
-config_loader = ConfigLoader(config_path="Incident_criticalness.json")
-agency_finder = AgencyFinder(db_client)
-jurisdiction_finder = JurisdictionFinder(db_client)
-processor = EventProcessor(config_loader, agency_finder, jurisdiction_finder)
-
-with open("incident_codes.json", "r") as f:
-    INCIDENT_CODES = json.load(f)
-
-SEQUENCE_TRACKER_FILE = "event_sequence_tracker.json"
+# Connections, the reference data and the event sequence come from the application (built on first use)
 
 class EventHandler:
     """
     Handles event-related operations, such as finding similar events and creating new events.
     """
 
-    def __init__(self, events_collection, searcher):
+    # Incident bucket indexes: one to find the open (not yet full) bucket of an event
+    # and one to read an event's buckets in time order
+    BUCKET_INDEXES = [
+        ([("event_ref", ASCENDING), ("count", ASCENDING)], "event_open_bucket"),
+        ([("event_ref", ASCENDING), ("first_incident_time", ASCENDING)], "event_buckets")
+    ]
+
+    def __init__(self, events_collection, searcher, buckets_collection=None):
+        """
+        :param events_collection: Collection holding the event documents.
+        :param searcher: EventSearcher used to find similar events.
+        :param buckets_collection: Collection of incident buckets (default: INCIDENT_BUCKET_COLLECTION
+                                   in the database of events_collection).
+        """
         self.events_collection = events_collection
         self.searcher = searcher
+        if buckets_collection is None and events_collection is not None:
+            buckets_collection = events_collection.database[config.INCIDENT_BUCKET_COLLECTION]
+        self.buckets_collection = buckets_collection
+        if self.buckets_collection is not None:
+            self.ensure_indexes()
+
+    def ensure_indexes(self):
+        """Creates the incident bucket indexes (BUCKET_INDEXES)."""
+        try:
+            for keys, name in self.BUCKET_INDEXES:
+                self.buckets_collection.create_index(keys, name=name)
+        except PyMongoError as e:
+            logging.error(f"Could not create incident bucket indexes: {e}")
 
-    def handle_event(self, incident,incident_type):
+    @metrics.timed("handle_event")
+    def handle_event(self, incident,incident_type, write_buffer=None):
         """
         Handles an incident by either adding it to an existing event or creating a new event.
         :param incident: The incident data to handle.
+        :param write_buffer: Optional MongoWriteBuffer; event writes are queued instead of sent.
         :return: A dictionary containing the event ID and status.
         """
         #print("Received incident:", incident)
         detected_incident=incident_type
+        self._stamp_incident_time(incident)
         # Find a similar event
         print(incident)
-        matching_event_id = self.searcher.find_similar_event(incident_type,incident)
+        matching_event_id = None
+        if write_buffer is not None:
+            # Events created or updated in the unflushed batch are not visible in Mongo yet
+            matching_event_id = self._find_buffered_event(incident_type, incident, write_buffer)
+        if not matching_event_id:
+            matching_event_id = self.searcher.find_similar_event(incident_type,incident)
         #print("Matching event ID:", matching_event_id)
 
         if matching_event_id:
             # Add the incident to the existing event
-            self._add_incident_to_event(matching_event_id, incident)
+            self._add_incident_to_event(matching_event_id, incident, incident_type, write_buffer)
+            metrics.DEDUP_MATCHES.inc()
             return {
                 "_id": matching_event_id,
+                "event_ref": matching_event_id,  # Mongo _id of the event
                 "status": "updated",
                 "description": f"Incident added to existing event {matching_event_id}"
             }
         else:
             # Create a new event
-            new_event_id = self._create_new_event(incident,detected_incident)
+            new_event = self._create_new_event(incident,detected_incident, write_buffer)
+            metrics.EVENTS_CREATED.inc()
             return {
-                "_id": new_event_id,
+                "_id": new_event["event_id"],
+                "event_ref": new_event["_id"],  # Mongo _id of the event
                 "status": "new",
                 "description": f"New {detected_incident} incident"
             }
     
     @staticmethod
-    def load_sequence_tracker():
-        """Loads the sequence tracker from a file."""
-        if os.path.exists(SEQUENCE_TRACKER_FILE):
-            with open(SEQUENCE_TRACKER_FILE, "r") as file:
-                return json.load(file)
-        return {}
-    
+    def _stamp_incident_time(incident):
+        """Stores the parsed timestamp as a BSON date so candidate lookups can filter on it."""
+        if "incident_time" not in incident:
+            incident["incident_time"] = EventSearcher.parse_timestamp(incident["timestamp"])
+
+    def _find_buffered_event(self, incident_type, incident, write_buffer):
+        """Checks the unflushed events of a write buffer for one similar to the incident."""
+        for event_id, recent_incident in write_buffer.recent_incidents(incident_type):
+            if self.searcher.is_event_similar(incident, recent_incident):
+                return event_id
+        return None
+
     @staticmethod
-    def save_sequence_tracker(tracker):
-        """Saves the sequence tracker to a file."""
-        with open(SEQUENCE_TRACKER_FILE, "w") as file:
-            json.dump(tracker, file)
+    def _build_add_update(incident):
+        """
+        Builds the update that appends an incident to an event and maintains the summary fields
+        (incident_count, last_incident_time, last_location) in the same atomic pipeline update.
+        The summary only moves forward, so out-of-order incidents never replace a newer one.
+        Bucketed events keep only their EVENT_INLINE_INCIDENTS most recent incidents inline;
+        events stored before bucketing keep their full array until migrate_incident_buckets runs.
+        """
+        incident_time = incident.get("incident_time")
+        appended = {"$concatArrays": [{"$ifNull": ["$incidents", []]}, {"$literal": [incident]}]}  # Append incident to incidents array
+        summary = {
+            "incidents": {"$cond": [
+                {"$eq": ["$incidents_bucketed", True]},
+                {"$slice": [appended, -config.EVENT_INLINE_INCIDENTS]},
+                appended
+            ]},
+            "incident_count": {"$add": [{"$ifNull": ["$incident_count", {"$size": {"$ifNull": ["$incidents", []]}}]}, 1]}
+        }
+        if incident_time is not None:
+            is_newest = {"$gte": [incident_time, {"$ifNull": ["$last_incident_time", incident_time]}]}
+            summary["last_location"] = {"$cond": [is_newest, {"$literal": incident["location"]}, "$last_location"]}
+            summary["last_incident_time"] = {"$max": ["$last_incident_time", incident_time]}
+        return [{"$set": summary}]
 
-    def _add_incident_to_event(self, event_id, incident):
+    @staticmethod
+    def _build_bucket_update(event_ref, incident):
+        """
+        Builds the upsert that appends an incident to the open bucket of an event. A bucket that
+        holds INCIDENT_BUCKET_SIZE incidents no longer matches, so the next incident starts a new one
+        and every write touches one small document however many incidents the event has.
+        :return: (filter, update) for update_one/UpdateOne with upsert=True.
+        """
+        update = {"$push": {"incidents": incident}, "$inc": {"count": 1}}
+        incident_time = incident.get("incident_time")
+        if incident_time is not None:
+            update["$min"] = {"first_incident_time": incident_time}
+            update["$max"] = {"last_incident_time": incident_time}
+        return {"event_ref": event_ref, "count": {"$lt": config.INCIDENT_BUCKET_SIZE}}, update
+
+    @staticmethod
+    def _build_buckets(event_ref, incidents):
+        """Splits a list of incidents into full bucket documents (for bulk inserts)."""
+        buckets = []
+        for start in range(0, len(incidents), config.INCIDENT_BUCKET_SIZE):
+            chunk = incidents[start:start + config.INCIDENT_BUCKET_SIZE]
+            times = [incident["incident_time"] for incident in chunk if incident.get("incident_time") is not None]
+            bucket = {"event_ref": event_ref, "count": len(chunk), "incidents": chunk}
+            if times:
+                bucket["first_incident_time"] = min(times)
+                bucket["last_incident_time"] = max(times)
+            buckets.append(bucket)
+        return buckets
+
+    def _append_to_bucket(self, event_ref, incident, write_buffer=None):
+        """Stores an incident in the buckets of its event."""
+        if self.buckets_collection is None:
+            return
+        bucket_filter, update = self._build_bucket_update(event_ref, incident)
+        if write_buffer is not None:
+            write_buffer.add(self.buckets_collection, UpdateOne(bucket_filter, update, upsert=True))
+        else:
+            with metrics.timed("bucket_update"):
+                self.buckets_collection.update_one(bucket_filter, update, upsert=True)
+
+    def iter_event_incidents(self, event_ref):
+        """
+        Yields every incident of an event: from its buckets, oldest bucket first, or from
+        the inline array for events stored before bucketing.
+        """
+        event = self.events_collection.find_one({"_id": event_ref}, {"incidents_bucketed": 1, "incidents": 1})
+        if event is None:
+            return
+        if not event.get("incidents_bucketed"):
+            yield from event.get("incidents", [])
+            return
+        buckets = self.buckets_collection.find({"event_ref": event_ref}, {"incidents": 1})
+        for bucket in buckets.sort("first_incident_time", ASCENDING):
+            yield from bucket["incidents"]
+
+    def _add_incident_to_event(self, event_id, incident, incident_type=None, write_buffer=None):
         """
         Adds an incident to an existing event.
         :param event_id: The ID of the event to update.
         :param incident: The incident data to add.
         """
-        self.events_collection.update_one(
-            {"_id": event_id},
-            {"$push": {"incidents": incident}}  # Append incident to incidents array
-        )
+        update = self._build_add_update(incident)
+        if write_buffer is not None:
+            write_buffer.add(self.events_collection, UpdateOne({"_id": event_id}, update))
+            write_buffer.track_event_incident(event_id, incident_type, incident)
+        else:
+            with metrics.timed("event_update"):
+                self.events_collection.update_one({"_id": event_id}, update)
+        self._append_to_bucket(event_id, incident, write_buffer)
+        self._record_incident(event_id, incident_type, incident, write_buffer)
         print(f"Incident added to event {event_id}")
 
-    def _generate_event_id(self, incident_type):
-        """Generates a unique event ID based on date, incident type, and a random hex string."""
-        today = datetime.utcnow().strftime("%Y%m%d")  # Format: YYYYMMDD
-        incident_code = INCIDENT_CODES.get(incident_type, "UNK")  # Get code or default to "UNK"
-        # random_hex = secrets.token_hex(3).upper()  # Generate a 6-character random hex
-        sequence_tracker = EventHandler.load_sequence_tracker()
-
-        # Increment sequence or reset if a new day
-        if today not in sequence_tracker:
-            sequence_tracker[today] = 1
+    def _record_incident(self, event_id, incident_type, incident, write_buffer=None):
+        """
+        Adds the incident to the searcher's in-memory index. Buffered writes are only indexed once
+        they are flushed: index hits are trusted, so an event whose insert failed must never be in it.
+        """
+        if write_buffer is not None:
+            write_buffer.after_write(lambda: self.searcher.record_incident(event_id, incident_type, incident))
         else:
-            sequence_tracker[today] += 1
-        
-        seq_number = sequence_tracker[today]
-        EventHandler.save_sequence_tracker(sequence_tracker)  # Save the updated sequence
-        
+            self.searcher.record_incident(event_id, incident_type, incident)
 
-        return f"E-{today}-{incident_code}-{seq_number:03d}"
-
-    def _create_new_event(self, incident, detected_incident):
+    def _generate_event_id(self, incident_type, day=None):
         """
-        Creates a new event with the given incident.
-        :param incident: The incident data to include in the new event.
-        :return: The ID of the newly created event.
+        Generates a unique event ID based on date, incident type, and a daily sequence number.
+        :param day: Date the ID is issued for (default: today, UTC); replays pass the incident date.
         """
-        detected_object = incident["detected_objects"]
+        today = (day or datetime.utcnow()).strftime("%Y%m%d")  # Format: YYYYMMDD
+        incident_code = get_app().reference_data.current().incident_codes.get(incident_type, "UNK")  # Get code or default to "UNK"
+        seq_number = get_app().event_sequence.next(today)  # Sequence resets every day
+
+        return self._format_event_id(today, incident_code, seq_number)
 
-        if not isinstance(detected_object, str):
-            detected_object = " ".join(map(str, detected_object))  # Convert list to space-separated string
+    @staticmethod
+    def _format_event_id(day, incident_code, seq_number):
+        """Event ID of the seq_number-th event of a day (YYYYMMDD) with the given incident code."""
+        return f"E-{day}-{incident_code}-{seq_number:03d}"
 
-        Extract_event_data = {
+    @staticmethod
+    def _extract_event_data(incident, detected_incident):
+        """Builds the allocation input (type and lat/lon) for a new event."""
+        return {
             "detected_object": detected_incident,
             "latitude": incident["location"]["coordinates"][1],
             "longitude": incident["location"]["coordinates"][0]
         }
-        print("Extract_event_data:", Extract_event_data)
-        assigned_agency = processor.process_event(Extract_event_data)
-        print("Allocated Agency:", assigned_agency)
 
-        new_event_id = self._generate_event_id(detected_incident)  # Generate event ID
-
-        new_event = {
+    @staticmethod
+    def _build_new_event(incident, detected_incident, assigned_agency, new_event_id):
+        """Builds the document for a new event holding its first incident."""
+        return {
             "event_id": new_event_id,  # Use generated event ID
             "description": f"{detected_incident} event",
             "status": "open",
             "assigned_agency": assigned_agency,
             "assignment_time": None,
             "ground_staff": None,
-            "incidents": [incident]
+            "incidents": [incident],  # Most recent incidents only; all of them are in the buckets
+            "incidents_bucketed": True,
+            # Summary of the most recent incident, read by EventSearcher instead of the incidents array
+            "incident_type": detected_incident,
+            "incident_count": 1,
+            "last_incident_time": incident.get("incident_time"),
+            "last_location": incident["location"]
         }
-        self.events_collection.insert_one(new_event)
+
+    def backfill_event_summaries(self, batch_size=500):
+        """
+        Adds incident_type, incident_count, last_incident_time and last_location to events
+        created before these fields existed, so the dedup lookup can match them.
+        :return: Number of events updated.
+        """
+        updated = 0
+        operations = []
+        cursor = self.events_collection.find(
+            {"incident_count": {"$exists": False}},
+            {"incidents.incident_type": 1, "incidents.incident_time": 1, "incidents.timestamp": 1, "incidents.location": 1}
+        )
+        for event in cursor:
+            incidents = event.get("incidents", [])
+            recent_incident = self.searcher.get_most_recent_incident(incidents)
+            if not recent_incident:
+                continue
+            operations.append(UpdateOne({"_id": event["_id"]}, {"$set": {
+                "incident_type": recent_incident.get("incident_type"),
+                "incident_count": len(incidents),
+                "last_incident_time": self.searcher.get_incident_time(recent_incident),
+                "last_location": recent_incident["location"]
+            }}))
+            if len(operations) >= batch_size:
+                updated += self.events_collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            updated += self.events_collection.bulk_write(operations, ordered=False).modified_count
+        logging.info(f"Backfilled summary fields on {updated} events.")
+        return updated
+
+    def migrate_incident_buckets(self):
+        """
+        Moves the incidents of events stored before bucketing into buckets and trims their inline
+        array to the EVENT_INLINE_INCIDENTS most recent ones. Incidents that live consumers already
+        bucketed are skipped, and an event that receives an incident meanwhile is left for the next run.
+        :return: Number of events migrated.
+        """
+        migrated = 0
+        cursor = self.events_collection.find(
+            {"incidents_bucketed": {"$ne": True}}, {"incidents": 1, "incident_count": 1}
+        )
+        for event in cursor:
+            incidents = event.get("incidents", [])
+            bucketed_ids = {
+                incident.get("_id")
+                for bucket in self.buckets_collection.find({"event_ref": event["_id"]}, {"incidents._id": 1})
+                for incident in bucket.get("incidents", [])
+            }
+            missing = [incident for incident in incidents if incident.get("_id") not in bucketed_ids]
+            if missing:
+                self.buckets_collection.insert_many(self._build_buckets(event["_id"], missing), ordered=True)
+            result = self.events_collection.update_one(
+                {"_id": event["_id"], "incident_count": event.get("incident_count")},
+                {"$set": {"incidents": incidents[-config.EVENT_INLINE_INCIDENTS:], "incidents_bucketed": True}}
+            )
+            migrated += result.modified_count
+        logging.info(f"Moved the incidents of {migrated} events into buckets.")
+        return migrated
+
+    def _create_new_event(self, incident, detected_incident, write_buffer=None):
+        """
+        Creates a new event with the given incident.
+        :param incident: The incident data to include in the new event.
+        :param write_buffer: Optional MongoWriteBuffer to queue the insert on.
+        :return: The new event document (with its generated event_id and Mongo _id).
+        """
+        Extract_event_data = self._extract_event_data(incident, detected_incident)
+        print("Extract_event_data:", Extract_event_data)
+        assigned_agency = get_app().reference_data.current().processor.process_event(Extract_event_data)
+        print("Allocated Agency:", assigned_agency)
+
+        new_event_id = self._generate_event_id(detected_incident)  # Generate event ID
+
+        new_event = self._build_new_event(incident, detected_incident, assigned_agency, new_event_id)
+        if write_buffer is not None:
+            new_event["_id"] = ObjectId()  # Known before the flush so later incidents can be pushed to it
+            write_buffer.add(self.events_collection, InsertOne(new_event))
+            write_buffer.track_event_incident(new_event["_id"], detected_incident, incident)
+        else:
+            with metrics.timed("event_insert"):
+                self.events_collection.insert_one(new_event)
+        self._append_to_bucket(new_event["_id"], incident, write_buffer)
+        self._record_incident(new_event["_id"], detected_incident, incident, write_buffer)
         print(f"New event created with ID: {new_event_id}")
-        return new_event_id
+        return new_event
+
+    @staticmethod
+    def _build_duplicate_frame_update(frame):
+        """Appends a near-duplicate frame reference, keeping only the most recent ones."""
+        return {
+            "$push": {"duplicate_frames": {"$each": [frame], "$slice": -config.DUPLICATE_FRAMES_KEPT}},
+            "$inc": {"duplicate_frame_count": 1}
+        }
+
+    def attach_duplicate_frame(self, event_ref, frame, write_buffer=None):
+        """
+        Records a near-duplicate frame on an existing event as a lightweight reference
+        (no incident document, upload or deduplication).
+        :param event_ref: Mongo _id of the event.
+        :param frame: Reference data, e.g. source, timestamp, location and frame hash.
+        """
+        update = self._build_duplicate_frame_update(frame)
+        if write_buffer is not None:
+            write_buffer.add(self.events_collection, UpdateOne({"_id": event_ref}, update))
+        else:
+            self.events_collection.update_one({"_id": event_ref}, update)
+        print(f"Near-duplicate frame attached to event {event_ref}")
 
 # Example usage
 if __name__ == "__main__":
     # Initialize EventHandler
-    event_handler = EventHandler(events, searcher)
+    event_handler = get_app().event_handler
+
+    # One-off migration: python test_dedup3.py --backfill-summaries
+    if "--backfill-summaries" in sys.argv:
+        event_handler.backfill_event_summaries()
+        sys.exit(0)
+
+    # One-off migration (after --backfill-summaries): python test_dedup3.py --bucket-incidents
+    if "--bucket-incidents" in sys.argv:
+        event_handler.migrate_incident_buckets()
+        sys.exit(0)
 
     # Example incident
     incident = {
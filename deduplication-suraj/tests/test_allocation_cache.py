@@ -0,0 +1,112 @@
+import pytest
+
+from allocation_cache import AllocationCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("allocation_cache.time.monotonic", lambda: now[0])
+    return now
+
+
+def pothole(latitude=12.97, longitude=77.59):
+    return {"detected_object": "pothole", "latitude": latitude, "longitude": longitude}
+
+
+def test_get_returns_a_copy(clock):
+    cache = AllocationCache()
+    key = cache.key(pothole())
+    cache.put(key, {"agencies": ["BBMP"]}, cache.generation)
+
+    allocation = cache.get(key)
+    assert allocation == {"agencies": ["BBMP"]}
+    allocation["agencies"].append("changed by the caller")
+    assert cache.get(key) == {"agencies": ["BBMP"]}
+
+
+def test_key_groups_events_per_cell_and_type():
+    cache = AllocationCache(cell_meters=250)
+    assert cache.key(pothole()) == cache.key(pothole(12.97, 77.5901))
+    assert cache.key(pothole()) != cache.key(pothole(12.98, 77.59))
+    assert cache.key(pothole()) != cache.key({**pothole(), "detected_object": "litter"})
+    assert cache.key({"latitude": 12.97, "longitude": 77.59})[0] == "Unknown"
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = AllocationCache(ttl_seconds=300)
+    key = cache.key(pothole())
+    cache.put(key, {"agencies": ["BBMP"]}, cache.generation)
+
+    clock[0] += 299
+    assert cache.get(key) is not None
+    clock[0] += 1
+    assert cache.get(key) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = AllocationCache(max_entries=2)
+    keys = [("pothole", row, 0) for row in range(3)]
+    cache.put(keys[0], "a", cache.generation)
+    cache.put(keys[1], "b", cache.generation)
+    cache.get(keys[0])
+    cache.put(keys[2], "c", cache.generation)
+
+    assert len(cache) == 2
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "a" and cache.get(keys[2]) == "c"
+
+
+def test_invalidate_drops_entries_and_stale_puts(clock):
+    cache = AllocationCache()
+    key = cache.key(pothole())
+    cache.put(key, "old agencies", cache.generation)
+
+    generation = cache.generation  # An allocation is being computed ...
+    cache.invalidate()  # ... when the agencies change
+    cache.put(key, "computed from old agencies", generation)
+    assert cache.get(key) is None
+
+    cache.put(key, "new agencies", cache.generation)
+    assert cache.get(key) == "new agencies"
+
+
+def test_stats(clock):
+    cache = AllocationCache()
+    assert cache.stats() == {"hits": 0, "misses": 0, "hit_rate": 0.0, "entries": 0}
+    key = cache.key(pothole())
+    cache.get(key)
+    cache.put(key, "a", cache.generation)
+    cache.get(key)
+    cache.get(key)
+    assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3, "entries": 1}
+
+
+class StubConfig:
+    def is_critical(self, detected_object):
+        return False
+
+
+class StubJurisdictions:
+    def __init__(self, agency):
+        self.agency = agency
+
+    def find_jurisdiction(self, event):
+        return self.agency
+
+
+def test_processor_of_an_outdated_snapshot_does_not_cache(clock):
+    from Agency_event_allocation_db_2 import EventProcessor
+
+    cache = AllocationCache()
+    old_processor = EventProcessor(StubConfig(), None, StubJurisdictions("old agency"), cache)
+    cache.invalidate()  # Agencies changed: the reference data builds a new processor
+    new_processor = EventProcessor(StubConfig(), None, StubJurisdictions("new agency"), cache)
+
+    # Still running with the previous snapshot after the invalidation
+    old_allocation = old_processor.process_event(pothole())
+    assert len(cache) == 0
+    new_allocation = new_processor.process_event(pothole())
+    assert new_allocation != old_allocation
+    assert cache.get(cache.key(pothole())) == new_allocation
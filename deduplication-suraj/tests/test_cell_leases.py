@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeMongoClient
+from cell_leases import CellLeases
+from partitioning import METERS_PER_DEGREE, geocell
+
+
+@pytest.fixture
+def collection():
+    FakeMongoClient.reset()
+    yield FakeMongoClient("mongodb://cell-lease-tests")["test"]["dedup_leases"]
+    FakeMongoClient.reset()
+
+
+def edge_latitude(latitude, cell_km=5.0):
+    """Latitude of the southern edge of the cell row holding latitude."""
+    return geocell(latitude, 0.0, cell_km)[0] * cell_km * 1000 / METERS_PER_DEGREE - 90
+
+
+def test_only_incidents_near_an_edge_need_leases(collection):
+    leases = CellLeases(collection, 5.0, 201.2)
+    assert leases.cells("pothole", 12.97, 77.59) == []
+    edge = edge_latitude(12.97)
+    south, north = leases.cells("pothole", edge - 0.0005, 77.59), leases.cells("pothole", edge + 0.0005, 77.59)
+    assert len(south) == 2 and south == north
+    assert all(key.startswith("pothole|") for key in south)
+
+
+def test_lease_is_reentrant_and_exclusive(collection):
+    first, second = CellLeases(collection, 5.0, 201.2), CellLeases(collection, 5.0, 201.2, poll_seconds=0.01)
+    keys = ["pothole|1|2", "pothole|1|3"]
+    first.acquire(keys)
+    first.acquire(keys)  # Same owner, e.g. the next message of the same worker
+
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (second.acquire(keys), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.1)
+    first.release(keys)
+    assert acquired.wait(1.0)
+    waiter.join()
+    assert {document["owner"] for document in collection.find({})} == {second.owner}
+
+    second.release(keys)
+    assert len(collection) == 0
+
+
+def test_expired_lease_can_be_taken(collection):
+    crashed = CellLeases(collection, 5.0, 201.2, ttl_seconds=0.05)
+    crashed.acquire(["pothole|1|2"])
+    started = time.monotonic()
+    CellLeases(collection, 5.0, 201.2, poll_seconds=0.01).acquire(["pothole|1|2"])
+    assert time.monotonic() - started < 1.0
+
+
+def test_release_keeps_leases_of_other_owners(collection):
+    first, second = CellLeases(collection, 5.0, 201.2), CellLeases(collection, 5.0, 201.2)
+    first.acquire(["pothole|1|2"])
+    second.release(["pothole|1|2"])
+    assert len(collection) == 1
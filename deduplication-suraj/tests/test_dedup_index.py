@@ -0,0 +1,118 @@
+import math
+from datetime import datetime, timedelta
+
+from geopy.distance import geodesic
+
+from benchmarks.fakes import FakeMongoClient
+from dedup_index import SpatioTemporalIndex
+from geo_distance import is_within
+
+T0 = datetime(2025, 3, 7, 10, 0)
+
+
+def offset(point, meters, bearing):
+    """(lat, lon) of the point meters away from point along bearing (geodesic)."""
+    destination = geodesic(meters=meters).destination(point, bearing)
+    return destination.latitude, destination.longitude
+
+
+def warm(index):
+    index.rebuild(FakeMongoClient("mongodb://dedup-index-tests")["test"]["empty_events"], None, now=T0)
+    return index
+
+
+def test_finds_event_within_distance_and_window():
+    index = SpatioTemporalIndex(200, timedelta(hours=2))
+    index.add("e1", "pothole", T0, 20.0, 85.0)
+    near = offset((20.0, 85.0), 150, 45)
+    assert index.find("pothole", T0 + timedelta(minutes=30), *near) == "e1"
+    assert index.find("litter", T0, *near) is None
+    assert index.find("pothole", T0, *offset((20.0, 85.0), 250, 45)) is None
+    assert index.find("pothole", T0 + timedelta(hours=2, minutes=1), *near) is None
+
+
+def test_finds_events_across_cell_edges():
+    index = SpatioTemporalIndex(200, timedelta(hours=2))
+    # Row edge: a point just south of it, and points 199 m further north (and diagonally)
+    edge_latitude = index._row(20.0) * index.cell_degrees - 90
+    south = (edge_latitude - 1e-7, 85.0)
+    for bearing in (0, 30, 45, 315):
+        north = offset(south, 199.0, bearing)
+        assert index._row(north[0]) != index._row(south[0])
+        index.add("e-south", "pothole", T0, *south)
+        assert index.find("pothole", T0, *north) == "e-south"
+        index.discard("e-south")
+
+    # Column edge at a high latitude, where columns are widest in degrees
+    row = index._row(60.0)
+    row_latitude = min(89.0, abs(row * index.cell_degrees - 90) + 2 * index.cell_degrees)
+    column_edge = (index._col(row, 10.0) + 1) * index.cell_degrees / math.cos(math.radians(row_latitude)) - 180
+    west = (60.0, column_edge - 1e-7)
+    east = offset(west, 199.0, 90)
+    assert index._col(row, east[1]) != index._col(row, west[1])
+    index.add("e-west", "pothole", T0, *west)
+    assert index.find("pothole", T0, *east) == "e-west"
+
+
+def test_agrees_with_geodesic_near_the_threshold():
+    index = SpatioTemporalIndex(200, timedelta(hours=2))
+    origin = (20.0, 85.0)
+    index.add("e1", "pothole", T0, *origin)
+    for meters in (199.0, 199.9, 200.1, 201.0):
+        for bearing in (0, 90, 180, 270):
+            point = offset(origin, meters, bearing)
+            expected = "e1" if is_within(origin, point, 200) else None
+            assert index.find("pothole", T0, *point) == expected
+
+
+def test_earliest_event_wins():
+    index = SpatioTemporalIndex(200, timedelta(hours=2))
+    index.add("first", "pothole", T0, 20.0, 85.0)
+    index.add("second", "pothole", T0 + timedelta(minutes=1), 20.0, 85.0005)
+    index.add("first", "pothole", T0 + timedelta(minutes=2), 20.0, 85.0)  # Updated later, created first
+    assert index.find("pothole", T0 + timedelta(minutes=3), 20.0, 85.0002) == "first"
+
+
+def test_older_incident_does_not_move_an_event():
+    index = SpatioTemporalIndex(200, timedelta(hours=2))
+    index.add("e1", "pothole", T0, 20.0, 85.0)
+    index.add("e1", "pothole", T0 - timedelta(minutes=5), 21.0, 86.0)
+    assert index.find("pothole", T0, 20.0, 85.0) == "e1"
+    assert index.find("pothole", T0, 21.0, 86.0) is None
+
+
+def test_events_outside_the_window_are_evicted():
+    index = SpatioTemporalIndex(200, timedelta(hours=2))
+    index.add("old", "pothole", T0, 20.0, 85.0)
+    index.add("new", "pothole", T0 + timedelta(hours=3), 30.0, 80.0)
+    assert len(index) == 1
+    assert index.event_ids() == ["new"]
+
+
+def test_misses_are_not_conclusive_before_warm_up():
+    index = SpatioTemporalIndex(200, timedelta(hours=2))
+    assert not index.is_conclusive(T0)
+    warm(index)
+    assert index.is_conclusive(T0)
+
+
+def test_eviction_by_the_memory_cap_makes_misses_inconclusive():
+    index = warm(SpatioTemporalIndex(200, timedelta(hours=2), max_events=2))
+    index.add("a", "pothole", T0, 20.0, 85.0)
+    index.add("b", "pothole", T0 + timedelta(minutes=1), 21.0, 85.0)
+    index.add("c", "pothole", T0 + timedelta(minutes=2), 22.0, 85.0)  # Evicts "a" while it could still match
+    assert len(index) == 2
+    assert index.find("pothole", T0 + timedelta(minutes=5), 20.0, 85.0) is None
+    # "a" could still be matched until its window ends, so the miss must be checked in Mongo
+    assert not index.is_conclusive(T0 + timedelta(minutes=5))
+    assert not index.is_conclusive(T0 + timedelta(hours=2))
+    assert index.is_conclusive(T0 + timedelta(hours=2, seconds=1))
+
+
+def test_discard_removes_an_event():
+    index = SpatioTemporalIndex(200, timedelta(hours=2))
+    index.add("e1", "pothole", T0, 20.0, 85.0)
+    index.discard("e1")
+    index.discard("unknown")
+    assert index.find("pothole", T0, 20.0, 85.0) is None
+    assert len(index) == 0
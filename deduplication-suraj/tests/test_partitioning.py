@@ -0,0 +1,90 @@
+import math
+import random
+
+import pytest
+
+from geo_distance import geodesic_meters
+from partitioning import ConsistentHashRing, cells_within, geocell, partition_key, partition_queue, METERS_PER_DEGREE
+
+
+def test_geocell_is_deterministic():
+    # Pinned values: routing must not change between releases, or events split across partitions
+    assert geocell(12.97, 77.59, 5.0) == (2292, 5589)
+    assert geocell(-33.86, 151.2, 5.0) == (1249, 6123)
+    assert partition_key("pothole", 12.97, 77.59, 5.0) == "pothole|2292|5589"
+
+
+@pytest.mark.parametrize("latitude", [0.0, 20.0, 45.0, 60.0, 75.0, -60.0])
+def test_points_closer_than_a_cell_are_at_most_one_cell_apart(latitude):
+    cell_km = 5.0
+    rng = random.Random(latitude)
+    for _ in range(2000):
+        lat = latitude + rng.uniform(-0.5, 0.5)
+        lon = rng.uniform(-179, 179)
+        # A second point less than cell_km away (equirectangular offset, in degrees)
+        meters = rng.uniform(0, cell_km * 1000 * 0.99)
+        bearing = rng.uniform(0, 360)
+        dlat = meters * math.cos(math.radians(bearing)) / METERS_PER_DEGREE
+        dlon = meters * math.sin(math.radians(bearing)) / (
+            METERS_PER_DEGREE * math.cos(math.radians(lat))
+        )
+        row1, col1 = geocell(lat, lon, cell_km)
+        row2, col2 = geocell(lat + dlat, lon + dlon, cell_km)
+        assert abs(row1 - row2) <= 1
+        if row1 == row2:
+            assert abs(col1 - col2) <= 1
+
+
+@pytest.mark.parametrize("latitude", [0.0, 20.0, 60.0, -75.0])
+def test_points_within_a_radius_share_a_cell(latitude):
+    # Small cells, so most pairs straddle a cell edge
+    cell_km, radius = 0.8, 200.0
+    rng = random.Random(latitude)
+    for _ in range(2000):
+        first = (latitude + rng.uniform(-0.5, 0.5), rng.uniform(-179, 179))
+        second = (first[0] + rng.uniform(-0.002, 0.002), first[1] + rng.uniform(-0.002, 0.002))
+        if geodesic_meters(first, second) > radius:
+            continue
+        first_cells = cells_within(*first, radius * 1.0057, cell_km)
+        assert geocell(*first, cell_km) in first_cells
+        assert geocell(*second, cell_km) in first_cells
+        assert set(first_cells) & set(cells_within(*second, radius * 1.0057, cell_km))
+
+
+def test_cells_within_an_inner_circle_is_one_cell():
+    assert cells_within(12.97, 77.59, 200.0, 5.0) == [geocell(12.97, 77.59, 5.0)]
+
+
+def test_ring_is_stable_across_instances():
+    keys = [f"pothole|{row}|{col}" for row in range(30) for col in range(30)]
+    first, second = ConsistentHashRing(8), ConsistentHashRing(8)
+    assert [first.partition(key) for key in keys] == [second.partition(key) for key in keys]
+    # Pinned values: blake2b keeps the mapping identical across processes and restarts
+    assert [first.partition(key) for key in ("pothole|1|2", "car accident|10|20", "litter|0|0")] == [4, 5, 0]
+
+
+def test_ring_covers_every_partition_evenly():
+    ring = ConsistentHashRing(4)
+    counts = [0] * 4
+    for index in range(20000):
+        partition = ring.partition(f"litter|{index}|{index * 7}")
+        assert 0 <= partition < 4
+        counts[partition] += 1
+    assert min(counts) > 20000 / 4 * 0.6
+
+
+def test_adding_a_partition_only_moves_keys_to_it():
+    keys = [f"fallen_tree|{index}|{index % 97}" for index in range(10000)]
+    before, after = ConsistentHashRing(4), ConsistentHashRing(5)
+    moved = [key for key in keys if before.partition(key) != after.partition(key)]
+    assert all(after.partition(key) == 4 for key in moved)
+    assert len(moved) / len(keys) < 0.35  # About 1/5 expected
+
+
+def test_ring_needs_a_partition():
+    with pytest.raises(ValueError):
+        ConsistentHashRing(0)
+
+
+def test_partition_queue_name():
+    assert partition_queue("detected_objects_queue", 3) == "detected_objects_queue.p3"
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.fakes import FakeMongoClient
+from sequence_allocator import MongoSequenceAllocator, last_issued_sequence
+
+
+@pytest.fixture
+def db():
+    FakeMongoClient.reset()
+    yield FakeMongoClient("mongodb://sequence-tests")["test"]
+    FakeMongoClient.reset()
+
+
+def event_allocator(db, **kwargs):
+    return MongoSequenceAllocator(
+        db["counters"], "event",
+        issued_floor=lambda day: last_issued_sequence(db["events"], "event_id", f"E-{day}-"), **kwargs
+    )
+
+
+def test_last_issued_sequence_reads_the_ids_of_one_day(db):
+    for event_id in ("E-20240101-RD-001", "E-20240101-PH-057", "E-20240101-RD-1003", "E-20240102-RD-999"):
+        db["events"].insert_one({"event_id": event_id})
+    assert last_issued_sequence(db["events"], "event_id", "E-20240101-") == 1003
+    assert last_issued_sequence(db["events"], "event_id", "E-20240103-") == 0
+
+
+def test_missing_counter_restarts_above_stored_ids(db):
+    # A replay or late incident for a day whose counter has expired
+    db["events"].insert_one({"event_id": "E-20240101-RD-057"})
+    first, second = event_allocator(db), event_allocator(db, block_size=10)
+    assert first.next("20240101") == 58
+    assert second.next("20240101") == 108
+    assert first.next("20240101") == 59
+
+
+def test_new_day_starts_at_one(db):
+    assert event_allocator(db).next("20240101") == 1
+
+
+def test_counter_expires_after_its_day_or_its_last_use(db):
+    allocator = event_allocator(db, retention_days=7)
+    allocator.next("20240101")
+    expires_at = db["counters"].find_one({"_id": "event:20240101"})["expires_at"]
+    # Still in use: kept retention_days after now, not after its (long past) day
+    assert expires_at > datetime.utcnow() + timedelta(days=6)
+
+    tomorrow = (datetime.utcnow() + timedelta(days=1)).strftime("%Y%m%d")
+    allocator.next(tomorrow)
+    expires_at = db["counters"].find_one({"_id": f"event:{tomorrow}"})["expires_at"]
+    assert expires_at == datetime.strptime(tomorrow, "%Y%m%d") + timedelta(days=8)
@@ -0,0 +1,187 @@
+import pytest
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from benchmarks.fakes import FakeMongoClient
+from write_buffer import MongoWriteBuffer
+
+
+@pytest.fixture
+def db():
+    FakeMongoClient.reset()
+    yield FakeMongoClient("mongodb://write-buffer-tests")["test"]
+    FakeMongoClient.reset()
+
+
+class Outcome:
+    """Records what happened to one buffered message."""
+
+    def __init__(self, log, name):
+        self.log, self.name = log, name
+
+    def success(self):
+        self.log.append((self.name, "ack"))
+
+    def failure(self, requeue):
+        self.log.append((self.name, "requeue" if requeue else "reject"))
+
+
+def buffer_message(buffer, log, name, *writes):
+    for collection, operation in writes:
+        buffer.add(collection, operation)
+    outcome = Outcome(log, name)
+    buffer.add_message(outcome.success, outcome.failure)
+
+
+def fail_bulk_writes(collection, monkeypatch, error):
+    def bulk_write(operations, ordered=True, **kwargs):
+        raise error
+    monkeypatch.setattr(collection, "bulk_write", bulk_write)
+
+
+def test_flush_writes_and_acks_every_message(db):
+    buffer, log = MongoWriteBuffer(), []
+    buffer.add(db["incidents"], InsertOne({"_id": "i1"}))
+    buffer.after_write(lambda: log.append(("m1", "written")))
+    buffer_message(buffer, log, "m1")
+    buffer_message(buffer, log, "m2", (db["incidents"], InsertOne({"_id": "i2"})),
+                   (db["events"], UpdateOne({"_id": "e1"}, {"$set": {"count": 1}}, upsert=True)))
+
+    assert buffer.flush()
+    assert log == [("m1", "written"), ("m1", "ack"), ("m2", "ack")]
+    assert len(db["incidents"]) == 2 and len(db["events"]) == 1
+    assert len(buffer) == 0
+
+
+def test_rejected_operation_only_rejects_its_message(db):
+    db["incidents"].insert_one({"_id": "taken"})
+    buffer, log = MongoWriteBuffer(), []
+    buffer_message(buffer, log, "m1", (db["incidents"], InsertOne({"_id": "i1"})))
+    buffer.after_write(lambda: log.append(("m2", "written")))
+    buffer_message(buffer, log, "m2", (db["incidents"], InsertOne({"_id": "taken"})),
+                   (db["events"], UpdateOne({"_id": "e2"}, {"$set": {"count": 1}}, upsert=True)))
+    buffer_message(buffer, log, "m3", (db["incidents"], InsertOne({"_id": "i3"})),
+                   (db["events"], UpdateOne({"_id": "e3"}, {"$set": {"count": 1}}, upsert=True)))
+
+    assert not buffer.flush()
+    assert log == [("m1", "ack"), ("m2", "reject"), ("m3", "ack")]
+    assert sorted(d["_id"] for d in db["incidents"].find({})) == ["i1", "i3", "taken"]
+    # The rejected message's operations on later collections are not sent
+    assert [d["_id"] for d in db["events"].find({})] == ["e3"]
+
+
+def test_updates_of_a_rejected_insert_are_requeued(db):
+    db["events"].insert_one({"_id": "taken"})
+    buffer, log = MongoWriteBuffer(), []
+    # m1 creates an event that is rejected; m2 matched that event through the buffer, m3 its own event
+    buffer_message(buffer, log, "m1", (db["incidents"], InsertOne({"_id": "i1"})),
+                   (db["events"], InsertOne({"_id": "taken", "count": 1})))
+    buffer_message(buffer, log, "m2", (db["incidents"], InsertOne({"_id": "i2"})),
+                   (db["events"], UpdateOne({"_id": "taken"}, {"$inc": {"count": 1}})),
+                   (db["buckets"], UpdateOne({"event_ref": "taken"}, {"$inc": {"count": 1}}, upsert=True)))
+    buffer_message(buffer, log, "m3", (db["events"], InsertOne({"_id": "e3", "count": 1})),
+                   (db["buckets"], UpdateOne({"event_ref": "e3"}, {"$inc": {"count": 1}}, upsert=True)))
+
+    assert not buffer.flush()
+    assert log == [("m1", "reject"), ("m2", "requeue"), ("m3", "ack")]
+    assert "count" not in db["events"].find_one({"_id": "taken"})
+    assert [d["event_ref"] for d in db["buckets"].find({})] == ["e3"]
+
+
+def test_updates_of_an_insert_that_never_ran_are_requeued(db):
+    db["incidents"].insert_one({"_id": "taken"})
+    buffer, log = MongoWriteBuffer(), []
+    # m1 is rejected on its incident, so its event insert in the next collection is never sent
+    buffer_message(buffer, log, "m1", (db["incidents"], InsertOne({"_id": "taken"})),
+                   (db["events"], InsertOne({"_id": "e1", "count": 1})))
+    buffer_message(buffer, log, "m2", (db["events"], UpdateOne({"_id": "e1"}, {"$inc": {"count": 1}})))
+
+    assert not buffer.flush()
+    assert log == [("m1", "reject"), ("m2", "requeue")]
+    assert len(db["events"]) == 0
+
+
+def test_transient_error_requeues_unconfirmed_messages(db, monkeypatch):
+    fail_bulk_writes(db["incidents"], monkeypatch, AutoReconnect("primary stepped down"))
+    buffer, log = MongoWriteBuffer(), []
+    buffer_message(buffer, log, "m1", (db["incidents"], InsertOne({"_id": "i1"})),
+                   (db["events"], UpdateOne({"_id": "e1"}, {"$set": {"count": 1}}, upsert=True)))
+    buffer_message(buffer, log, "m2", (db["events"], UpdateOne({"_id": "e2"}, {"$set": {"count": 1}}, upsert=True)))
+
+    assert not buffer.flush()
+    assert log == [("m1", "requeue"), ("m2", "ack")]
+    assert [d["_id"] for d in db["events"].find({})] == ["e2"]
+
+
+def test_write_concern_error_requeues(db, monkeypatch):
+    error = BulkWriteError({"writeErrors": [], "writeConcernErrors": [{"code": 64, "errmsg": "waiting for journal"}]})
+    fail_bulk_writes(db["incidents"], monkeypatch, error)
+    buffer, log = MongoWriteBuffer(), []
+    buffer_message(buffer, log, "m1", (db["incidents"], InsertOne({"_id": "i1"})))
+
+    assert not buffer.flush()
+    assert log == [("m1", "requeue")]
+
+
+def test_unexpected_error_rejects_without_requeue(db, monkeypatch):
+    fail_bulk_writes(db["incidents"], monkeypatch, ValueError("bad operation"))
+    buffer, log = MongoWriteBuffer(), []
+    buffer_message(buffer, log, "m1", (db["incidents"], InsertOne({"_id": "i1"})))
+
+    assert not buffer.flush()
+    assert log == [("m1", "reject")]
+
+
+def test_rollback_drops_the_current_message(db):
+    buffer, log = MongoWriteBuffer(), []
+    buffer.add(db["incidents"], InsertOne({"_id": "failed"}))
+    buffer.after_write(lambda: log.append(("failed", "written")))
+    buffer.track_event_incident("e1", "pothole", {"incident_id": "failed"})
+    buffer.rollback()
+    buffer_message(buffer, log, "m1", (db["incidents"], InsertOne({"_id": "i1"})))
+
+    assert buffer.recent_incidents("pothole") == []
+    assert buffer.flush()
+    assert log == [("m1", "ack")]
+    assert [d["_id"] for d in db["incidents"].find({})] == ["i1"]
+
+
+def test_unregistered_operations_stay_buffered(db):
+    buffer, log = MongoWriteBuffer(), []
+    buffer_message(buffer, log, "m1", (db["incidents"], InsertOne({"_id": "i1"})))
+    buffer.add(db["incidents"], InsertOne({"_id": "i2"}))  # Message still being processed
+
+    assert buffer.flush()
+    assert [d["_id"] for d in db["incidents"].find({})] == ["i1"]
+    buffer_message(buffer, log, "m2")
+    assert buffer.flush()
+    assert log == [("m1", "ack"), ("m2", "ack")]
+    assert len(db["incidents"]) == 2
+
+
+def test_recent_incidents_cover_buffered_and_current_messages(db):
+    buffer, log = MongoWriteBuffer(), []
+    buffer.track_event_incident("e1", "pothole", {"incident_id": "i1"})
+    buffer_message(buffer, log, "m1")
+    buffer.track_event_incident("e2", "pothole", {"incident_id": "i2"})
+    buffer.track_event_incident("e3", "litter", {"incident_id": "i3"})
+
+    assert sorted(event_id for event_id, _ in buffer.recent_incidents("pothole")) == ["e1", "e2"]
+    buffer.flush()
+    assert [event_id for event_id, _ in buffer.recent_incidents("pothole")] == ["e2"]
+
+
+def test_is_due(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("write_buffer.time.monotonic", lambda: now[0])
+    buffer, log = MongoWriteBuffer(max_batch=2, max_delay=1.0), []
+    assert not buffer.is_due()
+    buffer_message(buffer, log, "m1")
+    assert not buffer.is_due()
+    now[0] += 1.0
+    assert buffer.is_due()
+
+    buffer = MongoWriteBuffer(max_batch=2, max_delay=1.0)
+    buffer_message(buffer, log, "m1")
+    buffer_message(buffer, log, "m2")
+    assert buffer.is_due()
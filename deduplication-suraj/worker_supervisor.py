@@ -0,0 +1,92 @@
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _process_entry(target, worker_id, stop_event):
+    """
+    Entry point for worker processes.
+    Signals are handled by the supervisor only; workers stop through the shared stop event
+    so that an in-flight message is always finished and acked before the worker exits.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    target(worker_id, stop_event)
+
+
+class WorkerSupervisor:
+    """
+    Runs N consumer workers (processes or threads), restarts workers that die unexpectedly
+    and shuts all of them down cleanly on SIGINT/SIGTERM.
+    """
+
+    def __init__(self, target, num_workers, mode="process", restart_delay=2.0):
+        """
+        :param target: Callable run by every worker as target(worker_id, stop_event).
+                       It must return once stop_event is set.
+        :param num_workers: Number of workers to keep alive.
+        :param mode: "process" (one OS process per worker) or "thread".
+        :param restart_delay: Seconds to wait before restarting a crashed worker.
+        """
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Unsupported worker mode: {mode}")
+        self.target = target
+        self.num_workers = num_workers
+        self.mode = mode
+        self.restart_delay = restart_delay
+        # Spawn keeps every process free of inherited Mongo/RabbitMQ sockets.
+        self._mp_context = multiprocessing.get_context("spawn")
+        self.stop_event = self._mp_context.Event() if mode == "process" else threading.Event()
+        self.workers = {}
+
+    def _start_worker(self, worker_id):
+        """Starts (or restarts) a single worker."""
+        if self.mode == "process":
+            worker = self._mp_context.Process(
+                target=_process_entry,
+                args=(self.target, worker_id, self.stop_event),
+                name=f"consumer-{worker_id}"
+            )
+        else:
+            worker = threading.Thread(
+                target=self.target,
+                args=(worker_id, self.stop_event),
+                name=f"consumer-{worker_id}",
+                daemon=True
+            )
+        worker.start()
+        self.workers[worker_id] = worker
+        logging.info(f"Started {self.mode} worker {worker_id}.")
+
+    def _handle_signal(self, signum, frame):
+        logging.info(f"Received signal {signum}, stopping workers...")
+        self.stop_event.set()
+
+    def stop(self):
+        """Requests all workers to stop after their current message."""
+        self.stop_event.set()
+
+    def run(self):
+        """Starts all workers and supervises them until a stop is requested."""
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+
+        for worker_id in range(self.num_workers):
+            self._start_worker(worker_id)
+
+        while not self.stop_event.is_set():
+            for worker_id, worker in list(self.workers.items()):
+                if not worker.is_alive() and not self.stop_event.is_set():
+                    logging.warning(f"Worker {worker_id} exited unexpectedly, restarting.")
+                    time.sleep(self.restart_delay)
+                    self._start_worker(worker_id)
+            self.stop_event.wait(1.0)
+
+        for worker_id, worker in self.workers.items():
+            worker.join()
+            logging.info(f"Worker {worker_id} stopped.")
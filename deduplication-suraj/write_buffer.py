@@ -0,0 +1,215 @@
+import logging
+import time
+
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, WTimeoutError
+from pymongo.write_concern import WriteConcern
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# Errors after which the unwritten operations may succeed on redelivery (network, failover, timeouts)
+TRANSIENT_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
+
+
+def _references(operation, document_ids):
+    """True if an update's filter matches on one of document_ids (e.g. {"_id": ...} or {"event_ref": ...})."""
+    if isinstance(operation, InsertOne):
+        return False
+    return any(
+        value in document_ids
+        for value in getattr(operation, "_filter", {}).values()
+        if not isinstance(value, (dict, list))
+    )
+
+
+class _BufferedMessage:
+    """Operations and callbacks of one message, written (and acked) or rejected together."""
+
+    def __init__(self):
+        self.operations = []  # (collection, operation)
+        self.recent_incidents = {}  # event _id -> (incident_type, incident)
+        self.on_written = []  # Run before on_success, e.g. to update in-memory state
+        self.on_success = None
+        self.on_failure = None
+
+
+class MongoWriteBuffer:
+    """
+    Write-behind buffer for incident inserts and event updates.
+    Operations are grouped per collection and flushed with one bulk_write each once
+    max_batch messages are buffered or the oldest buffered message is max_delay seconds old.
+    Each message registers ack/nack callbacks that only run after its batch is flushed.
+    Operations are queued for the message being processed and only become part of a batch
+    with add_message(); rollback() drops them when the message fails before that.
+    A buffer is not thread-safe: use one per consumer connection.
+    """
+
+    def __init__(self, max_batch=100, max_delay=1.0, journal=True):
+        """
+        :param max_batch: Number of buffered messages that triggers a flush.
+        :param max_delay: Maximum seconds a message may wait for its batch to be flushed.
+        :param journal: Wait for the journal commit so acked messages survive a mongod crash.
+        """
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.write_concern = WriteConcern(j=journal)
+        self._pending = _BufferedMessage()  # Message being processed, not yet registered
+        self._messages = []  # Registered messages of the current batch
+        self._recent_incidents = {}  # event _id -> (incident_type, latest buffered incident)
+        self._oldest = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    def add(self, collection, operation):
+        """Queues a pymongo write operation (InsertOne, UpdateOne, ...) of the current message."""
+        self._pending.operations.append((collection, operation))
+
+    def add_message(self, on_success, on_failure):
+        """
+        Registers the current message with its queued operations.
+        :param on_success: Called once every operation of the message was written.
+        :param on_failure: Called with requeue=True when the message's writes did not land because
+                           of a transient error (retry by redelivery), requeue=False when one of its
+                           operations was rejected.
+        """
+        message, self._pending = self._pending, _BufferedMessage()
+        message.on_success, message.on_failure = on_success, on_failure
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self._messages.append(message)
+        self._recent_incidents.update(message.recent_incidents)
+
+    def after_write(self, callback):
+        """Runs callback() once the current message's operations are written; never if they fail."""
+        self._pending.on_written.append(callback)
+
+    def rollback(self):
+        """Drops the operations queued since the last add_message(), e.g. when the message failed."""
+        self._pending = _BufferedMessage()
+
+    def track_event_incident(self, event_id, incident_type, incident):
+        """Remembers the latest buffered incident of an event so dedup can see unflushed writes."""
+        self._pending.recent_incidents[event_id] = (incident_type, incident)
+
+    def recent_incidents(self, incident_type):
+        """Returns (event_id, incident) pairs of buffered incidents with the given type."""
+        recent = {**self._recent_incidents, **self._pending.recent_incidents}
+        return [
+            (event_id, incident)
+            for event_id, (buffered_type, incident) in recent.items()
+            if buffered_type == incident_type
+        ]
+
+    def is_due(self):
+        """True when the buffer is full or its oldest message has waited max_delay seconds."""
+        if not self._messages:
+            return False
+        return len(self._messages) >= self.max_batch or time.monotonic() - self._oldest >= self.max_delay
+
+    def flush(self):
+        """
+        Writes the operations of every registered message, then acks the messages whose writes all
+        landed. Each collection gets one ordered bulk_write; when an operation is rejected, the
+        operations before it are written, its message is rejected and the rest of the batch is
+        retried without that message's operations. After a transient error the messages whose
+        writes are not confirmed are requeued, and their remaining operations are not sent.
+        Messages writing to a document that a failed message did not insert (e.g. an incident
+        matched to an event created earlier in the batch) are requeued too, before their update
+        can silently match nothing.
+        The message being processed (operations queued without add_message) stays buffered.
+        :return: True if every message was written.
+        """
+        if not self._messages:
+            return True
+
+        messages = self._messages
+        self._messages, self._recent_incidents, self._oldest = [], {}, None
+
+        operations = {}  # collection full_name -> (collection, [(message position, operation)])
+        inserts = {}  # _id -> position of the message inserting it, until the insert is written
+        for position, message in enumerate(messages):
+            for collection, operation in message.operations:
+                if collection.full_name not in operations:
+                    operations[collection.full_name] = (collection, [])
+                operations[collection.full_name][1].append((position, operation))
+                if isinstance(operation, InsertOne) and "_id" in operation._doc:
+                    inserts[operation._doc["_id"]] = position
+
+        failed = {}  # message position -> requeue
+
+        def written(entries):
+            for _, operation in entries:
+                if isinstance(operation, InsertOne):
+                    inserts.pop(operation._doc.get("_id"), None)
+
+        def fail_dependents():
+            # Until no more messages fail: a requeued message's own inserts are missing as well
+            while True:
+                missing = {document_id for document_id, position in inserts.items() if position in failed}
+                dependents = {
+                    position
+                    for position, message in enumerate(messages)
+                    if position not in failed and any(
+                        _references(operation, missing) for _, operation in message.operations
+                    )
+                }
+                if not dependents:
+                    return
+                for position in dependents:
+                    failed[position] = True
+
+        for collection, entries in operations.values():
+            collection = collection.with_options(write_concern=self.write_concern)
+            if failed:
+                fail_dependents()
+            remaining = [entry for entry in entries if entry[0] not in failed]
+            while remaining:
+                try:
+                    # Consecutive InsertOne operations are sent as one insert command by the driver
+                    collection.bulk_write([operation for _, operation in remaining], ordered=True)
+                    written(remaining)
+                    break
+                except BulkWriteError as e:
+                    write_errors = e.details.get("writeErrors") or []
+                    if not write_errors:
+                        # Written, but the write concern (journal) was not confirmed
+                        logging.error(f"Write concern failed on {collection.full_name}: {e.details}")
+                        for position, _ in remaining:
+                            failed.setdefault(position, True)
+                        break
+                    error = write_errors[0]
+                    rejected = remaining[error["index"]][0]
+                    logging.error(f"Write rejected on {collection.full_name}: {error.get('errmsg')}")
+                    failed[rejected] = False
+                    # Ordered: everything before the rejected operation is written, nothing after it
+                    written(remaining[:error["index"]])
+                    fail_dependents()
+                    remaining = [entry for entry in remaining[error["index"] + 1:] if entry[0] not in failed]
+                except TRANSIENT_ERRORS as e:
+                    logging.error(f"Failed to write {len(remaining)} operations to {collection.full_name}: {e}")
+                    for position, _ in remaining:
+                        failed.setdefault(position, True)
+                    break
+                except Exception as e:
+                    logging.error(f"Failed to write {len(remaining)} operations to {collection.full_name}: {e}")
+                    for position, _ in remaining:
+                        failed.setdefault(position, False)
+                    break
+
+        for position, message in enumerate(messages):
+            if position in failed:
+                message.on_failure(failed[position])
+            else:
+                for callback in message.on_written:
+                    callback()
+                message.on_success()
+        if failed:
+            requeued = sum(failed.values())
+            logging.error(f"Flushed {len(messages) - len(failed)} of {len(messages)} messages; "
+                          f"{requeued} requeued, {len(failed) - requeued} rejected.")
+            return False
+        logging.info(f"Flushed {len(messages)} messages in {len(operations)} bulk writes.")
+        return True